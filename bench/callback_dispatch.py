@@ -0,0 +1,104 @@
+"""
+Стоимость выбора обработчика callback-кнопки в зависимости от их числа.
+
+    python bench/callback_dispatch.py
+    python bench/callback_dispatch.py --handlers 10 100 1000 --updates 5000
+
+Сравниваются две схемы с N обработчиками, разложенными по нескольким роутерам
+(как в bot/handlers):
+
+* linear — обработчик на кнопку с фильтром lambda c: c.data.startswith(...),
+  aiogram проверяет фильтры по очереди;
+* indexed — CallbackRouter (bot/handlers/dispatch.py), поиск по словарю.
+
+Апдейты проходят через Dispatcher.feed_update целиком (middleware, FSM в
+памяти, фильтры) и нажимают кнопку последнего зарегистрированного
+обработчика — худший случай для linear. Сеть не используется: обработчики
+ничего не отправляют.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import CallbackQuery, Update, User
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bot.handlers.dispatch import CallbackRouter  # noqa: E402
+
+# столько же, сколько роутеров с кнопками в bot/handlers
+ROUTERS = 8
+
+
+async def _noop(call: CallbackQuery) -> None:
+    return None
+
+
+def _linear(n: int) -> Dispatcher:
+    dp = Dispatcher(storage=MemoryStorage())
+    routers = [Router(name=f"r{i}") for i in range(ROUTERS)]
+    for i in range(n):
+        prefix = f"ns{i}:"
+        routers[i * ROUTERS // n].callback_query.register(
+            _noop, lambda c, prefix=prefix: c.data.startswith(prefix)
+        )
+    dp.include_routers(*routers)
+    return dp
+
+
+def _indexed(n: int) -> Dispatcher:
+    dp = Dispatcher(storage=MemoryStorage())
+    callbacks = CallbackRouter()
+    for i in range(n):
+        callbacks.on(f"ns{i}")(_noop)
+    dp.include_router(callbacks)
+    return dp
+
+
+def _update(n: int, update_id: int) -> Update:
+    user = User(id=1, is_bot=False, first_name="bench")
+    return Update(
+        update_id=update_id,
+        callback_query=CallbackQuery(
+            id=str(update_id), from_user=user, chat_instance="bench", data=f"ns{n - 1}:arg"
+        ),
+    )
+
+
+async def _measure(dp: Dispatcher, bot: Bot, n: int, updates: int) -> float:
+    """Среднее время обработки апдейта, мкс."""
+    batch = [_update(n, i) for i in range(updates)]
+    # прогрев: ленивые импорты и кэши pydantic
+    for update in batch[:100]:
+        await dp.feed_update(bot, update)
+    started = time.perf_counter()
+    for update in batch:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / updates * 1e6
+
+
+async def main(handlers: List[int], updates: int) -> None:
+    bot = Bot("123:abc")
+    try:
+        print(f"{'handlers':>8} {'linear, us':>11} {'indexed, us':>12}")
+        for n in handlers:
+            linear = await _measure(_linear(n), bot, n, updates)
+            indexed = await _measure(_indexed(n), bot, n, updates)
+            print(f"{n:>8} {linear:>11.1f} {indexed:>12.1f}")
+    finally:
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handlers", type=int, nargs="+", default=[10, 50, 200, 1000])
+    parser.add_argument("--updates", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.handlers, args.updates))
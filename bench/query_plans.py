@@ -0,0 +1,408 @@
+"""
+Регрессионная проверка планов запросов Database на данных продового масштаба.
+
+    python bench/query_plans.py --dsn postgresql://localhost/bot_bench
+    python bench/query_plans.py --dsn ... --scale 0.3       # быстрый прогон
+    python bench/query_plans.py --dsn ... --skip-seed       # данные уже налиты
+
+Скрипт работает только с ПУСТОЙ отдельной базой: применяет миграции, наливает
+синтетические данные (по умолчанию 1M users, 5M orders/payments) и для каждого
+запроса из bot.statements проверяет EXPLAIN (ANALYZE, BUFFERS):
+
+* используются ожидаемые индексы;
+* нет Seq Scan по большим таблицам;
+* время выполнения укладывается в бюджет.
+
+На меньших масштабах таблицы настолько малы, что Seq Scan для планировщика
+законно дешевле индекса, и проверки планов теряют смысл.
+
+Планы строятся с plan_cache_mode = force_generic_plan — так же, как их видят
+подготовленные запросы пула после прогрева. Пишущие запросы выполняются в
+транзакции, которая откатывается. Завершается с кодом 1 при любой регрессии.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import asyncpg
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bot.migrations import apply_migrations  # noqa: E402
+from bot.statements import STATEMENTS  # noqa: E402
+
+# Таблицы, по которым Seq Scan в горячем пути недопустим
+BIG_TABLES = {"users", "orders", "payments", "subscriptions", "channel_access_log", "outbox", "fsm_storage"}
+
+READ_BUDGET_MS = 5.0
+WRITE_BUDGET_MS = 10.0
+SCAN_BUDGET_MS = 50.0
+
+# Seq Scan по партиции меньше этого (пустые будущие месяцы, default) допустим
+PARTITION_SEQ_SCAN_ROWS = 10_000
+
+KEYSET_START = datetime(1, 1, 1, tzinfo=timezone.utc)
+
+SEED_SQL = """
+INSERT INTO users(tg_user_id, username, first_name, created_at)
+SELECT 10000000 + g, 'user' || g, 'Name' || g, NOW() - (g % 730) * INTERVAL '1 day'
+FROM generate_series(1, {users}) g;
+
+INSERT INTO orders(user_id, direction, payload_json, status, created_at)
+SELECT 1 + (g % {users}),
+       (ARRAY['yoga', 'english', 'chinese', 'astrology', 'mentoring'])[1 + g % 5],
+       '{{"Тариф": "Йога: 4 практики / месяц"}}'::jsonb,
+       CASE WHEN g % 199 = 0 THEN 'awaiting_payment'
+            WHEN g % 3 = 0 THEN 'cancelled'
+            ELSE 'paid' END,
+       NOW() - (g % 730) * INTERVAL '1 day'
+FROM generate_series(1, {orders}) g;
+
+INSERT INTO payments(order_id, method, currency, amount, status, created_at, updated_at)
+SELECT o.id,
+       (ARRAY['rub_card', 'pix', 'crypto'])[1 + o.id % 3],
+       (ARRAY['RUB', 'BRL', 'USDT'])[1 + o.id % 3],
+       1000 + o.id % 5000,
+       CASE o.status WHEN 'paid' THEN 'paid'
+                     WHEN 'awaiting_payment' THEN
+                         CASE WHEN o.id % 2 = 0 THEN 'pending' ELSE 'proof_submitted' END
+                     ELSE CASE WHEN o.id % 2 = 0 THEN 'cancelled' ELSE 'rejected' END END,
+       o.created_at, o.created_at
+FROM orders o;
+
+INSERT INTO open_payments(
+  tg_user_id, direction, order_id, payment_id, status,
+  method, currency, amount, proof_file_id, created_at, updated_at
+)
+SELECT DISTINCT ON (u.tg_user_id, o.direction)
+       u.tg_user_id, o.direction, o.id, p.id, p.status,
+       p.method, p.currency, p.amount, p.proof_file_id, p.created_at, p.updated_at
+FROM payments p
+JOIN orders o ON o.id = p.order_id
+JOIN users u ON u.id = o.user_id
+WHERE p.status IN ('pending', 'proof_submitted')
+ORDER BY u.tg_user_id, o.direction, p.created_at DESC, p.id DESC;
+
+INSERT INTO subscriptions(user_id, product, status, starts_at, expires_at, channel_id)
+SELECT 1 + (g * 7) % {users},
+       (ARRAY['yoga_4', 'yoga_8', 'yoga_10_individual'])[1 + g % 3],
+       CASE WHEN g % 4 = 0 THEN 'active' ELSE 'expired' END,
+       NOW() - INTERVAL '30 days',
+       CASE WHEN g % 4 = 0 THEN NOW() + ((g % 90) - 2) * INTERVAL '1 day' + (g % 1440) * INTERVAL '1 minute'
+            ELSE NOW() - (g % 700) * INTERVAL '1 day' END,
+       -1000 - g % 2
+FROM generate_series(1, {subs}) g;
+
+SELECT create_channel_access_partition(m)
+FROM generate_series(
+  date_trunc('month', (SELECT MIN(starts_at) FROM subscriptions) AT TIME ZONE 'UTC'),
+  date_trunc('month', NOW() AT TIME ZONE 'UTC'),
+  INTERVAL '1 month'
+) AS m;
+
+INSERT INTO channel_access_log(user_id, channel_key, invite_link, granted_at, revoked_at)
+SELECT s.user_id, s.product, 'https://t.me/+x', s.starts_at,
+       CASE WHEN s.status = 'expired' THEN s.expires_at END
+FROM subscriptions s;
+
+-- События подписок записаны по ходу истории, а не в момент налива
+UPDATE subscription_events SET recorded_at = LEAST(at, recorded_at);
+
+-- Outbox за окно хранения: почти всё доставлено, малая доля ждёт доставки
+INSERT INTO outbox(kind, payload, idempotency_key, status, attempts, available_at, created_at, processed_at)
+SELECT (ARRAY['payment.approved', 'subscription.expired'])[1 + g % 2],
+       '{{"payment_id": 1}}'::jsonb,
+       'seed:' || g,
+       CASE WHEN g % 500 = 0 THEN 'pending' ELSE 'done' END,
+       1,
+       NOW() + ((g % 7) - 3) * INTERVAL '1 minute',
+       NOW() - (g % 15) * INTERVAL '1 day',
+       CASE WHEN g % 500 <> 0 THEN NOW() - (g % 15) * INTERVAL '1 day' END
+FROM generate_series(1, {outbox}) g;
+
+-- Состояния FSM: каждый десятый пользователь, половина старше TTL в 7 дней
+INSERT INTO fsm_storage(key, user_id, state, data, updated_at)
+SELECT 'fsm:1:' || (10000000 + g) || ':' || (10000000 + g) || ':default',
+       10000000 + g,
+       'LangFlow:payment',
+       '{{"direction": "english", "order_id": 1, "payment_id": 1}}'::jsonb,
+       NOW() - (g % 14) * INTERVAL '1 day'
+FROM generate_series(10, {users}, 10) g;
+"""
+
+
+@dataclass(frozen=True)
+class PlanCheck:
+    statement: str
+    args: Callable[[dict], Tuple]
+    # индексы, которые обязаны появиться в плане
+    indexes: Set[str]
+    write: bool = False
+    budget_ms: Optional[float] = None
+
+
+def _now(_: dict) -> datetime:
+    return datetime.now(timezone.utc)
+
+
+CHECKS: List[PlanCheck] = [
+    PlanCheck("users.upsert", lambda c: (c["tg_user_id"], "new_name", "New"),
+              {"users_tg_user_id_key"}, write=True),
+    PlanCheck("users.id_by_tg", lambda c: (c["tg_user_id"],), {"users_tg_user_id_key"}),
+    PlanCheck("checkout.open",
+              lambda c: (c["user_id"], "yoga", '{"Тариф": "4"}', "awaiting_payment", "pix", "BRL", 100),
+              {"users_pkey", "open_payments_pkey"}, write=True),
+    PlanCheck("checkout.reap_stale", lambda c: (_now(c) - timedelta(hours=72), 500),
+              {"idx_orders_unpaid", "idx_payments_order_id"}, write=True, budget_ms=SCAN_BUDGET_MS),
+    PlanCheck("orders.get", lambda c: (c["order_id"],), {"orders_pkey"}),
+    PlanCheck("orders.owner", lambda c: (c["order_id"],), {"orders_pkey", "users_pkey"}),
+    PlanCheck("orders.cancel", lambda c: (c["order_id"], "cancelled", "draft", "awaiting_payment"),
+              {"orders_pkey"}, write=True),
+    PlanCheck("payments.get", lambda c: (c["payment_id"],), {"payments_pkey"}),
+    PlanCheck("payments.set_proof", lambda c: (c["payment_id"], "proof_submitted", "file"),
+              {"payments_pkey", "open_payments_payment_id_key"}, write=True),
+    PlanCheck("payments.resolve", lambda c: (c["payment_id"], "paid", 1),
+              {"payments_pkey", "open_payments_payment_id_key"}, write=True),
+    PlanCheck("payments.lock_for_approval", lambda c: (c["payment_id"],),
+              {"payments_pkey", "orders_pkey", "users_pkey"}, write=True),
+    PlanCheck("payments.approve", lambda c: (c["payment_id"], 1, "paid", c["order_id"], "paid"),
+              {"payments_pkey", "open_payments_payment_id_key", "orders_pkey"}, write=True),
+    PlanCheck("payments.cancel_open_for_order", lambda c: (c["order_id"], "cancelled"),
+              {"idx_payments_open", "idx_open_payments_order_id"}, write=True),
+    PlanCheck("payments.open_for_order", lambda c: (c["order_id"],), {"idx_payments_open"}),
+    PlanCheck("subscriptions.create",
+              lambda c: (c["sub_user_id"], "yoga_4", _now(c) + timedelta(days=30), c["payment_id"], None),
+              set(), write=True),
+    PlanCheck("subscriptions.active_yoga", lambda c: (c["sub_user_id"],), {"idx_subscriptions_yoga_active"}),
+    PlanCheck("subscriptions.latest_yoga_id", lambda c: (c["sub_user_id"],), {"idx_subscriptions_yoga_user"}),
+    PlanCheck("subscriptions.update_yoga",
+              lambda c: (c["sub_id"], "yoga_8", _now(c) + timedelta(days=30), c["payment_id"], None, "active"),
+              {"subscriptions_pkey"}, write=True),
+    PlanCheck("subscriptions.any_yoga", lambda c: (c["sub_user_id"],), {"idx_subscriptions_yoga_user"}),
+    PlanCheck("subscriptions.latest_unexpired", lambda c: (c["sub_user_id"],), {"idx_subscriptions_user_id"}),
+    PlanCheck("subscriptions.extend",
+              lambda c: (c["sub_id"], "yoga_8", _now(c) + timedelta(days=30), c["payment_id"]),
+              {"subscriptions_pkey"}, write=True),
+    PlanCheck("subscriptions.due_page", lambda c: (_now(c), KEYSET_START, 0, 200),
+              {"idx_subscriptions_active_expires", "users_pkey"}),
+    PlanCheck("subscriptions.expired_yoga_with_channel", lambda c: (_now(c),),
+              {"idx_subscriptions_active_expires", "users_pkey"}, budget_ms=SCAN_BUDGET_MS),
+    PlanCheck("subscriptions.expire_bulk", lambda c: (c["due_ids"],), {"subscriptions_pkey", "users_pkey"},
+              write=True, budget_ms=SCAN_BUDGET_MS),
+    PlanCheck("subscriptions.expiring_between",
+              lambda c: (_now(c) + timedelta(days=1), _now(c) + timedelta(days=2)),
+              {"idx_subscriptions_active_expires"}, budget_ms=SCAN_BUDGET_MS),
+    PlanCheck("subscriptions.expiring_between_page",
+              lambda c: (_now(c) + timedelta(days=1), 0, _now(c) + timedelta(days=2), 200),
+              {"idx_subscriptions_active_expires", "users_pkey"}),
+    PlanCheck("subscriptions.mark_feedback_sent", lambda c: (c["sub_id"],), {"subscriptions_pkey"}, write=True),
+    PlanCheck("subscriptions.feedback_status", lambda c: (c["sub_id"],), {"subscriptions_pkey"}),
+    PlanCheck("channel_access.grant", lambda c: (c["sub_user_id"], "yoga_4", "https://t.me/+y"), set(), write=True),
+    PlanCheck("channel_access.revoke_bulk",
+              lambda c: ([u for u, _ in c["due_pairs"]], [k for _, k in c["due_pairs"]]),
+              {"idx_channel_access_log_open"}, write=True, budget_ms=SCAN_BUDGET_MS),
+    PlanCheck("archive.orders", lambda c: (_now(c) - timedelta(days=90), 1000),
+              {"idx_orders_cancelled", "idx_payments_order_id"}, write=True, budget_ms=SCAN_BUDGET_MS),
+    PlanCheck("archive.payments", lambda c: (_now(c) - timedelta(days=90), 1000),
+              {"idx_payments_closed", "idx_subscriptions_last_payment"}, write=True, budget_ms=SCAN_BUDGET_MS),
+    PlanCheck("archive.ensure_partitions", lambda c: (3,), set(), write=True),
+    PlanCheck("archive.detach_partitions", lambda c: (12,), set(), write=True),
+    PlanCheck("outbox.enqueue", lambda c: ("payment.approved", '{"payment_id": 1}', "bench:1"),
+              set(), write=True),
+    PlanCheck("outbox.enqueue_bulk",
+              lambda c: (["subscription.expired"] * len(c["due_ids"]),
+                         ['{"sub_id": %d}' % i for i in c["due_ids"]],
+                         ["bench:%d" % i for i in c["due_ids"]]),
+              set(), write=True),
+    PlanCheck("outbox.claim", lambda c: (10, 120.0), {"idx_outbox_pending", "outbox_pkey"}, write=True),
+    PlanCheck("outbox.renew", lambda c: (c["outbox_id"], 1, 120.0), {"outbox_pkey"}, write=True),
+    PlanCheck("outbox.step_done", lambda c: (c["outbox_id"], "bench"), {"outbox_pkey"}, write=True),
+    PlanCheck("outbox.done", lambda c: (c["outbox_id"], 1), {"outbox_pkey"}, write=True),
+    PlanCheck("outbox.retry", lambda c: (c["outbox_id"], 1, 30.0, "error"), {"outbox_pkey"}, write=True),
+    PlanCheck("outbox.dead", lambda c: (c["outbox_id"], 1, "error"), {"outbox_pkey"}, write=True),
+    PlanCheck("outbox.purge", lambda c: (_now(c) - timedelta(days=14),), {"idx_outbox_processed"},
+              write=True, budget_ms=SCAN_BUDGET_MS),
+    PlanCheck("fsm.get", lambda c: (c["fsm_keys"][0][0], 7 * 86400.0), {"fsm_storage_pkey"}),
+    PlanCheck("fsm.write",
+              lambda c: ([k for k, _ in c["fsm_keys"]], [u for _, u in c["fsm_keys"]],
+                         ["LangFlow:level" if i % 2 else None for i in range(len(c["fsm_keys"]))],
+                         ['{"direction": "english"}' if i % 2 else '{}' for i in range(len(c["fsm_keys"]))]),
+              {"fsm_storage_pkey"}, write=True),
+    PlanCheck("fsm.purge", lambda c: (7 * 86400.0, 1000), {"idx_fsm_storage_updated_at"},
+              write=True, budget_ms=SCAN_BUDGET_MS),
+    PlanCheck("stats.refresh", lambda c: ("UTC", 600.0), set(), write=True, budget_ms=SCAN_BUDGET_MS),
+    PlanCheck("stats.state", lambda c: (), set()),
+    PlanCheck("stats.revenue", lambda c: (_now(c).date() - timedelta(days=30), _now(c).date()), set()),
+    PlanCheck("stats.subscriptions", lambda c: (_now(c).date() - timedelta(days=30), _now(c).date()), set()),
+    PlanCheck("stats.proofs", lambda c: (_now(c).date() - timedelta(days=30), _now(c).date()), set()),
+    PlanCheck("replica.lag", lambda c: (), set()),
+]
+
+
+def _walk(node: dict, out: List[dict]) -> None:
+    out.append(node)
+    for child in node.get("Plans", []):
+        _walk(child, out)
+
+
+async def seed(con: asyncpg.Connection, scale: float) -> None:
+    users = max(int(1_000_000 * scale), 100)
+    orders = max(int(5_000_000 * scale), 500)
+    subs = max(int(400_000 * scale), 40)
+    outbox = max(int(250_000 * scale), 25)
+    print(f"Seeding {users} users, {orders} orders/payments, {subs} subscriptions, {outbox} outbox...")
+    started = time.perf_counter()
+    await con.execute(SEED_SQL.format(users=users, orders=orders, subs=subs, outbox=outbox))
+    # первый полный пересчёт: проверка stats.refresh меряет инкрементальный
+    await con.execute("SELECT refresh_daily_stats('UTC', INTERVAL '10 minutes')")
+    await con.execute("VACUUM ANALYZE")
+    print(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+
+async def sample_context(con: asyncpg.Connection) -> dict:
+    open_pay = await con.fetchrow(
+        """
+        SELECT p.id AS payment_id, o.id AS order_id, o.direction, u.id AS user_id, u.tg_user_id
+        FROM open_payments op
+        JOIN payments p ON p.id = op.payment_id
+        JOIN orders o ON o.id = op.order_id
+        JOIN users u ON u.tg_user_id = op.tg_user_id
+        WHERE op.status = 'pending'
+        ORDER BY op.payment_id DESC LIMIT 1
+        """
+    )
+    sub = await con.fetchrow(
+        "SELECT id, user_id FROM subscriptions WHERE status = 'active' AND product LIKE 'yoga_%' "
+        "ORDER BY id DESC LIMIT 1"
+    )
+    due = await con.fetch(
+        "SELECT id, user_id, product FROM subscriptions WHERE status = 'active' "
+        "ORDER BY expires_at, id LIMIT 200"
+    )
+    outbox_id = await con.fetchval("SELECT max(id) FROM outbox WHERE status = 'pending'")
+    fsm_keys = await con.fetch("SELECT key, user_id FROM fsm_storage ORDER BY updated_at DESC LIMIT 20")
+    if not open_pay or not sub or outbox_id is None or not fsm_keys:
+        raise SystemExit("Database has no seeded data; run without --skip-seed")
+    return {
+        "payment_id": open_pay["payment_id"],
+        "order_id": open_pay["order_id"],
+        "direction": open_pay["direction"],
+        "user_id": open_pay["user_id"],
+        "tg_user_id": open_pay["tg_user_id"],
+        "sub_id": sub["id"],
+        "sub_user_id": sub["user_id"],
+        "due_ids": [r["id"] for r in due],
+        "due_pairs": [(r["user_id"], r["product"]) for r in due],
+        "outbox_id": outbox_id,
+        "fsm_keys": [(r["key"], r["user_id"]) for r in fsm_keys],
+        "partitions": await partitions(con),
+    }
+
+
+async def partitions(con: asyncpg.Connection) -> Dict[str, Tuple[str, float]]:
+    """
+    Партиция (таблица или индекс) -> (родитель, оценка числа строк):
+    планы показывают имена партиций, а не родительских таблиц и индексов.
+    """
+    rows = await con.fetch(
+        """
+        SELECT c.relname AS child, p.relname AS parent, c.reltuples AS rows
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        """
+    )
+    return {r["child"]: (r["parent"], r["rows"]) for r in rows}
+
+
+async def check(con: asyncpg.Connection, chk: PlanCheck, ctx: dict) -> List[str]:
+    sql = STATEMENTS[chk.statement]
+    tr = con.transaction()
+    await tr.start()
+    try:
+        raw = await con.fetchval("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, *chk.args(ctx))
+    finally:
+        await tr.rollback()
+
+    plan = json.loads(raw)[0] if isinstance(raw, str) else raw[0]
+    nodes: List[dict] = []
+    _walk(plan["Plan"], nodes)
+
+    parts = ctx["partitions"]
+    used = {n["Index Name"] for n in nodes if "Index Name" in n}
+    used |= {parts[name][0] for name in used if name in parts}
+    seq = set()
+    for n in nodes:
+        if n["Node Type"] != "Seq Scan":
+            continue
+        name = n["Relation Name"]
+        if name in parts:
+            parent, rows = parts[name]
+            if rows < PARTITION_SEQ_SCAN_ROWS:
+                continue
+            name = parent
+        seq.add(name)
+    seq &= BIG_TABLES
+    elapsed = float(plan["Execution Time"])
+    budget = chk.budget_ms or (WRITE_BUDGET_MS if chk.write else READ_BUDGET_MS)
+
+    problems = []
+    if seq:
+        problems.append(f"seq scan on {', '.join(sorted(seq))}")
+    missing = chk.indexes - used
+    if missing:
+        problems.append(f"missing index {', '.join(sorted(missing))} (used: {', '.join(sorted(used)) or '-'})")
+    if elapsed > budget:
+        problems.append(f"{elapsed:.2f} ms > budget {budget:.0f} ms")
+
+    status = "FAIL" if problems else "ok"
+    print(f"{status:4} {chk.statement:45} {elapsed:8.3f} ms  {', '.join(sorted(used)) or '-'}")
+    for p in problems:
+        print(f"       - {p}")
+    return problems
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="DSN of an EMPTY scratch database")
+    parser.add_argument("--scale", type=float, default=1.0, help="1.0 = 1M users / 5M orders")
+    parser.add_argument("--skip-seed", action="store_true")
+    args = parser.parse_args(argv)
+
+    missing = set(STATEMENTS) - {c.statement for c in CHECKS}
+    if missing:
+        print(f"No plan check for statements: {', '.join(sorted(missing))}")
+        return 1
+
+    con = await asyncpg.connect(dsn=args.dsn)
+    try:
+        await apply_migrations(con)
+        if not args.skip_seed:
+            if await con.fetchval("SELECT EXISTS (SELECT 1 FROM users)"):
+                print("Refusing to seed a non-empty database; use --skip-seed")
+                return 1
+            await seed(con, args.scale)
+
+        await con.execute("SET plan_cache_mode = force_generic_plan")
+        ctx = await sample_context(con)
+        failures = 0
+        for chk in CHECKS:
+            if await check(con, chk, ctx):
+                failures += 1
+    finally:
+        await con.close()
+
+    print(f"\n{len(CHECKS) - failures}/{len(CHECKS)} statements within plan and latency budget")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
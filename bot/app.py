@@ -5,7 +5,6 @@ import logging
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
@@ -13,7 +12,13 @@ from dotenv import load_dotenv
 from bot.config import load_config
 from bot.db import Database
 from bot.handlers import router as main_router
+from bot.invalidation import InvalidationBus
 from bot.jobs.jobs import add_jobs
+from bot.middlewares import DbActorMiddleware, FsmFlushMiddleware
+from bot.outbox import OutboxDispatcher
+from bot.services.fulfillment import register_outbox_handlers
+from bot.storage import BoundedMemoryStorage, PostgresStorage
+from bot.webhook import run_webhook
 
 log = logging.getLogger(__name__)
 
@@ -30,14 +35,41 @@ async def main():
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
 
-    dp = Dispatcher(storage=MemoryStorage())
-
-    db = Database(cfg.database_url)
+    db = Database(
+        cfg.database_url,
+        cfg.db_pool,
+        auto_migrate=cfg.db_auto_migrate,
+        replica_dsn=cfg.database_replica_url,
+        replica_settings=cfg.db_replica,
+        cache_settings=cfg.db_cache,
+        slow_query_settings=cfg.db_slow_query,
+    )
     await db.connect()
 
+    if cfg.fsm_storage.backend == "postgres":
+        storage = PostgresStorage(db, cfg.fsm_storage)
+    else:
+        storage = BoundedMemoryStorage(cfg.fsm_storage)
+        if cfg.fsm_storage.snapshot_path:
+            storage.load_snapshot(cfg.fsm_storage.snapshot_path)
+    dp = Dispatcher(storage=storage)
+
+    invalidation = InvalidationBus(cfg.database_url, cfg.db_invalidation)
+    if cfg.db_invalidation.enabled:
+        db.subscribe_invalidation(invalidation)
+        if isinstance(storage, PostgresStorage):
+            storage.subscribe_invalidation(invalidation)
+        await invalidation.start()
+
     # attach shared objects
     dp["cfg"] = cfg
     dp["db"] = db
+    dp["outbox"] = outbox = OutboxDispatcher(db, cfg.outbox)
+    register_outbox_handlers(outbox, bot=bot, cfg=cfg, storage=dp.storage)
+    dp.update.outer_middleware(DbActorMiddleware())
+    if isinstance(storage, PostgresStorage):
+        dp.update.outer_middleware(FsmFlushMiddleware(storage))
+        await storage.start()
     dp.include_router(main_router)
 
     await bot.set_my_commands(
@@ -50,11 +82,18 @@ async def main():
     scheduler = AsyncIOScheduler(timezone=cfg.tz)
     add_jobs(scheduler, bot=bot, db=db, cfg=cfg)
     scheduler.start()
+    await outbox.start()
 
-    log.info("Bot started")
+    log.info(f"Bot started ({cfg.webhook.mode})")
     try:
-        await dp.start_polling(bot)
+        if cfg.webhook.mode == "webhook":
+            await run_webhook(dp, bot, cfg.webhook)
+        else:
+            await dp.start_polling(bot)
     finally:
         log.info("Shutting down")
+        await outbox.stop()
+        await storage.close()
+        await invalidation.stop()
         await db.close()
         await bot.session.close()
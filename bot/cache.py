@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+from bot.metrics import REGISTRY
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+CACHE_REQUESTS = "cache_requests_total"
+CACHE_ENTRIES = "cache_entries"
+REGISTRY.describe(CACHE_REQUESTS, "Cache lookups by result (hit/miss)")
+REGISTRY.describe(CACHE_ENTRIES, "Entries currently held in the cache")
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Ограниченный по размеру LRU-словарь.
+
+    Рассчитан на работу внутри одного event loop, поэтому без блокировок.
+    """
+
+    def __init__(self, maxsize: int = 10_000):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self._maxsize = maxsize
+        self._data: "OrderedDict[K, V]" = OrderedDict()
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        """Вернуть значение и отметить ключ как недавно использованный."""
+        try:
+            value = self._data[key]
+        except KeyError:
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        """Записать значение, вытеснив самые старые ключи при переполнении."""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        return self._data.pop(key, default)
+
+    def invalidate(self, key: K) -> None:
+        """Удалить ключ, если он есть (тот же интерфейс, что у TTLCache)."""
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
+
+
+class TTLCache(Generic[K, V]):
+    """
+    LRU-кэш с ограниченным временем жизни записей.
+
+    Попадания и промахи считаются в метрике cache_requests_total{cache=name},
+    текущий размер — в cache_entries{cache=name}.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            maxsize: int = 10_000,
+            ttl: float = 30.0,
+            clock: Callable[[], float] = time.monotonic
+    ):
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+        self.name = name
+        self._ttl = ttl
+        self._clock = clock
+        self._data: LRUCache[K, Tuple[float, V]] = LRUCache(maxsize)
+        self._hits = REGISTRY.counter(CACHE_REQUESTS, cache=name, result="hit")
+        self._misses = REGISTRY.counter(CACHE_REQUESTS, cache=name, result="miss")
+        REGISTRY.gauge(CACHE_ENTRIES, fn=lambda: len(self._data), cache=name)
+
+    def get(self, key: K) -> Optional[V]:
+        """Вернуть значение, если оно есть и не устарело."""
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > self._clock():
+                self._hits.inc()
+                return value
+            self._data.pop(key)
+        self._misses.inc()
+        return None
+
+    def set(self, key: K, value: V) -> None:
+        self._data.set(key, (self._clock() + self._ttl, value))
+
+    def invalidate(self, key: K) -> None:
+        self._data.pop(key)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict:
+        """Dict с полями size, maxsize, ttl, hits, misses, hit_ratio."""
+        hits, misses = self._hits.value, self._misses.value
+        total = hits + misses
+        return {
+            "size": len(self._data),
+            "maxsize": self._data.maxsize,
+            "ttl": self._ttl,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / total if total else None,
+        }
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -1,7 +1,7 @@
 from __future__ import annotations
 import os
-from dataclasses import dataclass
-from typing import List, Optional
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 
 def _getenv(name: str, default: Optional[str] = None) -> str:
     v = os.getenv(name, default)
@@ -19,6 +19,18 @@ def _parse_int_list(csv: str) -> List[int]:
     parts = [p.strip() for p in csv.split(",") if p.strip()]
     return [int(p) for p in parts]
 
+def _parse_float_map(csv: str) -> Dict[str, float]:
+    """"LangFlow=72,YogaFeedback=48" -> {"LangFlow": 72.0, "YogaFeedback": 48.0}"""
+    result = {}
+    for part in (p.strip() for p in csv.split(",")):
+        if not part:
+            continue
+        name, sep, value = part.partition("=")
+        if not sep:
+            raise RuntimeError(f"Expected NAME=VALUE, got {part!r}")
+        result[name.strip()] = float(value)
+    return result
+
 @dataclass(frozen=True)
 class Prices:
     trial_rub: int
@@ -35,11 +47,166 @@ class Prices:
     china_lesson_rub: int
     china_pack10_rub: int
 
+@dataclass(frozen=True)
+class DbPoolSettings:
+    min_size: int = 1
+    max_size: int = 10
+    # сколько соединений открыть и прогреть при старте (не меньше min_size)
+    warmup_size: int = 1
+    command_timeout: float = 60.0
+    # сколько ждать свободное соединение, прежде чем ответить "перегружено"
+    acquire_timeout: float = 5.0
+    max_inactive_connection_lifetime: float = 300.0
+    max_queries: int = 50000
+    statement_cache_size: int = 100
+
+@dataclass(frozen=True)
+class DbReplicaSettings:
+    # сколько секунд после записи пользователь читает только с primary
+    sticky_seconds: float = 5.0
+    # при большем отставании реплики все чтения уходят на primary
+    max_lag_seconds: float = 5.0
+    # как часто обновлять оценку отставания реплики
+    lag_refresh_seconds: float = 10.0
+
+@dataclass(frozen=True)
+class DbCacheSettings:
+    # сколько заказов/платежей держать в read-through кэше Database
+    size: int = 10_000
+    # сколько секунд запись живёт в кэше; ограничивает устаревание данных,
+    # изменённых в обход этого процесса
+    ttl_seconds: float = 30.0
+
+@dataclass(frozen=True)
+class DbSlowQuerySettings:
+    # запросы дольше стольких секунд (включая ожидание пула) пишутся в лог
+    threshold_seconds: float = 0.5
+    # один и тот же запрос логируется не чаще раза в столько секунд
+    log_interval_seconds: float = 60.0
+
+@dataclass(frozen=True)
+class InvalidationSettings:
+    # слушать LISTEN/NOTIFY и вытеснять из кэшей строки, изменённые
+    # другими процессами (второй экземпляр бота, ручные правки в БД)
+    enabled: bool = True
+    # как часто проверять, что соединение LISTEN живо
+    heartbeat_seconds: float = 30.0
+    # пауза перед переподключением растёт от min до max
+    reconnect_min_seconds: float = 1.0
+    reconnect_max_seconds: float = 30.0
+
+@dataclass(frozen=True)
+class OutboxSettings:
+    # сколько воркеров параллельно доставляют сообщения outbox
+    workers: int = 2
+    # сколько сообщений воркер забирает за раз
+    batch_size: int = 10
+    # пауза между опросами пустой очереди
+    poll_interval: float = 1.0
+    # сколько секунд сообщение закреплено за воркером; после этого его
+    # подберёт другой (например, если процесс упал посреди доставки)
+    lease_seconds: float = 120.0
+    # после стольких неудачных попыток сообщение помечается dead
+    max_attempts: int = 8
+    # задержка повтора: backoff_base * 2^(попытка-1), но не больше backoff_max
+    backoff_base: float = 5.0
+    backoff_max: float = 3600.0
+    # сколько дней хранить доставленные/dead сообщения
+    retention_days: int = 14
+
+@dataclass(frozen=True)
+class ArchiveSettings:
+    # отменённые заказы и закрытые платежи старше стольких дней уходят в archive
+    after_days: int = 90
+    # сколько строк переносить одним запросом
+    batch_size: int = 1000
+    # на сколько месяцев вперёд держать партиции channel_access_log
+    partitions_ahead: int = 3
+    # партиции channel_access_log старше стольких месяцев (без открытых
+    # доступов) отсоединяются в схему archive
+    channel_access_keep_months: int = 12
+
+@dataclass(frozen=True)
+class StatsSettings:
+    # как часто пересчитывать дневные агрегаты за изменившиеся дни
+    refresh_minutes: int = 15
+    # насколько заходить назад от прошлого пересчёта: транзакции, начатые
+    # до него и закоммиченные после, иначе были бы пропущены
+    overlap_seconds: float = 600.0
+
+@dataclass(frozen=True)
+class CheckoutReaperSettings:
+    # заказы без оплаты и без активности дольше стольких часов отменяются
+    # (0 — не отменять)
+    max_age_hours: float = 72.0
+    # как часто искать брошенные оформления
+    interval_minutes: int = 30
+    # сколько заказов отменять одной транзакцией
+    batch_size: int = 500
+    # сообщить пользователю, что его заказ отменён
+    notify: bool = True
+
+@dataclass(frozen=True)
+class FsmStorageSettings:
+    # postgres — состояние в БД (переживает деплой), memory — в процессе
+    backend: str = "postgres"
+    # сколько пользователей держать в кэше перед БД
+    cache_size: int = 10_000
+    # состояние без изменений дольше этого считается брошенным
+    ttl_seconds: float = 7 * 24 * 3600.0
+    # как часто записывать изменения, сделанные вне обработки апдейтов
+    # (обработчики outbox); после апдейта они пишутся сразу
+    flush_interval_seconds: float = 1.0
+    # memory: максимум состояний в процессе, сверх — вытесняются давно неактивные
+    max_entries: int = 10_000
+    # memory: свой TTL простоя для групп состояний ("LangFlow" -> секунды),
+    # остальные — ttl_seconds
+    group_ttl_seconds: Dict[str, float] = field(default_factory=dict)
+    # memory: файл, куда сохранить состояния при остановке и откуда
+    # поднять при запуске (None — не сохранять)
+    snapshot_path: Optional[str] = None
+
+@dataclass(frozen=True)
+class WebhookSettings:
+    # polling — getUpdates, webhook — HTTP-сервер aiohttp
+    mode: str = "polling"
+    listen_host: str = "0.0.0.0"
+    listen_port: int = 8080
+    path: str = "/webhook"
+    # публичный адрес сервера для setWebhook (None — вебхук уже настроен снаружи)
+    public_url: Optional[str] = None
+    # X-Telegram-Bot-Api-Secret-Token; обязателен в режиме webhook, иначе
+    # апдейт (и нажатие админской кнопки) может прислать кто угодно
+    secret_token: Optional[str] = None
+    # сколько апдейтов обрабатывается параллельно (апдейты одного
+    # пользователя — всегда по порядку)
+    workers: int = 16
+    # сколько апдейтов ждут обработки; при заполнении ответ Telegram
+    # задерживается, и он сам сбавляет темп
+    queue_size: int = 1000
+    # max_connections для setWebhook
+    max_connections: int = 40
+    # сколько ждать обработки очереди при остановке
+    drain_timeout_seconds: float = 30.0
+
 @dataclass(frozen=True)
 class Config:
     bot_token: str
     admin_ids: List[int]
     database_url: str
+    database_replica_url: Optional[str]
+    db_pool: DbPoolSettings
+    db_replica: DbReplicaSettings
+    db_cache: DbCacheSettings
+    db_slow_query: DbSlowQuerySettings
+    db_invalidation: InvalidationSettings
+    outbox: OutboxSettings
+    archive: ArchiveSettings
+    stats: StatsSettings
+    checkout_reaper: CheckoutReaperSettings
+    fsm_storage: FsmStorageSettings
+    webhook: WebhookSettings
+    db_auto_migrate: bool
     env: str
     tz: str
 
@@ -60,6 +227,8 @@ class Config:
 
     sweeper_hour: int
     sweeper_minute: int
+    # размер страницы, которой периодические задачи читают подписки из БД
+    jobs_batch_size: int
 
     olga_telegram: str
 
@@ -67,6 +236,98 @@ def load_config() -> Config:
     bot_token = _getenv("BOT_TOKEN")
     admin_ids = _parse_int_list(_getenv("ADMIN_IDS"))
     database_url = _getenv("DATABASE_PUBLIC_URL")
+    db_pool_min_size = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+    db_pool = DbPoolSettings(
+        min_size=db_pool_min_size,
+        max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+        warmup_size=int(os.getenv("DB_POOL_WARMUP_SIZE", str(db_pool_min_size))),
+        command_timeout=float(os.getenv("DB_COMMAND_TIMEOUT", "60")),
+        acquire_timeout=float(os.getenv("DB_ACQUIRE_TIMEOUT", "5")),
+        max_inactive_connection_lifetime=float(os.getenv("DB_MAX_INACTIVE_CONNECTION_LIFETIME", "300")),
+        max_queries=int(os.getenv("DB_MAX_QUERIES", "50000")),
+        statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100")),
+    )
+    database_replica_url = _getenv_opt("DATABASE_REPLICA_URL")
+    db_replica = DbReplicaSettings(
+        sticky_seconds=float(os.getenv("DB_REPLICA_STICKY_SECONDS", "5")),
+        max_lag_seconds=float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5")),
+        lag_refresh_seconds=float(os.getenv("DB_REPLICA_LAG_REFRESH_SECONDS", "10")),
+    )
+    db_cache = DbCacheSettings(
+        size=int(os.getenv("DB_CACHE_SIZE", "10000")),
+        ttl_seconds=float(os.getenv("DB_CACHE_TTL_SECONDS", "30")),
+    )
+    db_slow_query = DbSlowQuerySettings(
+        threshold_seconds=float(os.getenv("DB_SLOW_QUERY_SECONDS", "0.5")),
+        log_interval_seconds=float(os.getenv("DB_SLOW_QUERY_LOG_INTERVAL", "60")),
+    )
+    db_invalidation = InvalidationSettings(
+        enabled=os.getenv("DB_INVALIDATION_ENABLED", "1").lower() not in ("0", "false", "no"),
+        heartbeat_seconds=float(os.getenv("DB_INVALIDATION_HEARTBEAT_SECONDS", "30")),
+        reconnect_min_seconds=float(os.getenv("DB_INVALIDATION_RECONNECT_MIN_SECONDS", "1")),
+        reconnect_max_seconds=float(os.getenv("DB_INVALIDATION_RECONNECT_MAX_SECONDS", "30")),
+    )
+    outbox = OutboxSettings(
+        workers=int(os.getenv("OUTBOX_WORKERS", "2")),
+        batch_size=int(os.getenv("OUTBOX_BATCH_SIZE", "10")),
+        poll_interval=float(os.getenv("OUTBOX_POLL_INTERVAL", "1")),
+        lease_seconds=float(os.getenv("OUTBOX_LEASE_SECONDS", "120")),
+        max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8")),
+        backoff_base=float(os.getenv("OUTBOX_BACKOFF_BASE", "5")),
+        backoff_max=float(os.getenv("OUTBOX_BACKOFF_MAX", "3600")),
+        retention_days=int(os.getenv("OUTBOX_RETENTION_DAYS", "14")),
+    )
+    archive = ArchiveSettings(
+        after_days=int(os.getenv("ARCHIVE_AFTER_DAYS", "90")),
+        batch_size=int(os.getenv("ARCHIVE_BATCH_SIZE", "1000")),
+        partitions_ahead=int(os.getenv("ARCHIVE_PARTITIONS_AHEAD", "3")),
+        channel_access_keep_months=int(os.getenv("ARCHIVE_CHANNEL_ACCESS_KEEP_MONTHS", "12")),
+    )
+    stats = StatsSettings(
+        refresh_minutes=int(os.getenv("STATS_REFRESH_MINUTES", "15")),
+        overlap_seconds=float(os.getenv("STATS_REFRESH_OVERLAP_SECONDS", "600")),
+    )
+    checkout_reaper = CheckoutReaperSettings(
+        max_age_hours=float(os.getenv("CHECKOUT_REAPER_MAX_AGE_HOURS", "72")),
+        interval_minutes=int(os.getenv("CHECKOUT_REAPER_INTERVAL_MINUTES", "30")),
+        batch_size=int(os.getenv("CHECKOUT_REAPER_BATCH_SIZE", "500")),
+        notify=os.getenv("CHECKOUT_REAPER_NOTIFY", "1").lower() not in ("0", "false", "no"),
+    )
+    fsm_storage = FsmStorageSettings(
+        backend=os.getenv("FSM_STORAGE", "postgres").lower(),
+        cache_size=int(os.getenv("FSM_CACHE_SIZE", "10000")),
+        ttl_seconds=float(os.getenv("FSM_TTL_HOURS", "168")) * 3600,
+        flush_interval_seconds=float(os.getenv("FSM_FLUSH_INTERVAL_SECONDS", "1")),
+        max_entries=int(os.getenv("FSM_MEMORY_MAX_ENTRIES", "10000")),
+        group_ttl_seconds={
+            group: hours * 3600
+            for group, hours in _parse_float_map(os.getenv(
+                "FSM_GROUP_TTL_HOURS",
+                "LangFlow=72,YogaFlow=72,AstroFlow=72,MentorFlow=72,YogaFeedback=48",
+            )).items()
+        },
+        snapshot_path=_getenv_opt("FSM_SNAPSHOT_PATH"),
+    )
+    if fsm_storage.backend not in ("postgres", "memory"):
+        raise RuntimeError(f"FSM_STORAGE must be 'postgres' or 'memory', got {fsm_storage.backend!r}")
+    webhook = WebhookSettings(
+        mode=os.getenv("BOT_MODE", "polling").lower(),
+        listen_host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+        # PORT задаёт хостинг (Railway), если WEBHOOK_PORT не указан
+        listen_port=int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8080"))),
+        path=os.getenv("WEBHOOK_PATH", "/webhook"),
+        public_url=_getenv_opt("WEBHOOK_URL"),
+        secret_token=_getenv_opt("WEBHOOK_SECRET"),
+        workers=int(os.getenv("UPDATE_WORKERS", "16")),
+        queue_size=int(os.getenv("UPDATE_QUEUE_SIZE", "1000")),
+        max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+        drain_timeout_seconds=float(os.getenv("WEBHOOK_DRAIN_TIMEOUT_SECONDS", "30")),
+    )
+    if webhook.mode not in ("polling", "webhook"):
+        raise RuntimeError(f"BOT_MODE must be 'polling' or 'webhook', got {webhook.mode!r}")
+    if webhook.mode == "webhook" and not webhook.secret_token:
+        raise RuntimeError("WEBHOOK_SECRET is required when BOT_MODE=webhook")
+    db_auto_migrate = os.getenv("DB_AUTO_MIGRATE", "1").lower() not in ("0", "false", "no")
     env = os.getenv("ENV", "prod")
     tz = os.getenv("TZ", "America/Sao_Paulo")
 
@@ -104,12 +365,26 @@ def load_config() -> Config:
     yoga_subscription_days = int(os.getenv("YOGA_SUBSCRIPTION_DAYS", "30"))
     sweeper_hour = int(os.getenv("SWEEPER_HOUR", "9"))
     sweeper_minute = int(os.getenv("SWEEPER_MINUTE", "0"))
+    jobs_batch_size = int(os.getenv("JOBS_BATCH_SIZE", "200"))
 
 
     return Config(
         bot_token=bot_token,
         admin_ids=admin_ids,
         database_url=database_url,
+        database_replica_url=database_replica_url,
+        db_pool=db_pool,
+        db_replica=db_replica,
+        db_cache=db_cache,
+        db_slow_query=db_slow_query,
+        db_invalidation=db_invalidation,
+        outbox=outbox,
+        archive=archive,
+        stats=stats,
+        checkout_reaper=checkout_reaper,
+        fsm_storage=fsm_storage,
+        webhook=webhook,
+        db_auto_migrate=db_auto_migrate,
         env=env,
         tz=tz,
         channel_personal_id=channel_personal_id,
@@ -125,6 +400,7 @@ def load_config() -> Config:
         yoga_subscription_days=yoga_subscription_days,
         sweeper_hour=sweeper_hour,
         sweeper_minute=sweeper_minute,
+        jobs_batch_size=jobs_batch_size,
         pay_rub_card_owner=pay_rub_card_owner,
         olga_telegram=olga_telegram
     )
@@ -4,6 +4,14 @@ D_YOGA = "yoga"
 D_ASTRO = "astrology"
 D_MENTOR = "mentoring"
 
+DIRECTION_TITLES = {
+    D_ENGLISH: "Английский",
+    D_CHINESE: "Китайский",
+    D_YOGA: "Йога",
+    D_ASTRO: "Астрология",
+    D_MENTOR: "Менторство",
+}
+
 PAY_RUB_CARD = "rub_card"
 PAY_PIX = "pix"
 PAY_CRYPTO = "crypto"
@@ -16,3 +24,8 @@ C_USDT = "USDT"
 YOGA_4 = "yoga_4"
 YOGA_8 = "yoga_8"
 YOGA_10IND = "yoga_10_individual"
+
+# Виды сообщений outbox (побочные эффекты в Telegram, см. bot/outbox.py)
+OUTBOX_PAYMENT_APPROVED = "payment.approved"
+OUTBOX_SUBSCRIPTION_EXPIRED = "subscription.expired"
+OUTBOX_CHECKOUT_EXPIRED = "checkout.expired"
@@ -0,0 +1,480 @@
+"""
+Выгрузка и загрузка таблиц через COPY: резервные копии, аналитика, перенос
+данных между базами.
+
+    python -m bot.dataio export --dir backup/                    # все таблицы в CSV
+    python -m bot.dataio export --dir backup/ --format jsonl --since 2024-01-01 --until 2024-07-01
+    python -m bot.dataio import --dir backup/                    # в базу с применёнными миграциями
+
+Данные идут потоком (COPY ... TO STDOUT, COPY ... FROM STDIN), память не
+зависит от размера таблицы. Таблица делится на чанки по диапазону id, каждый
+чанк — отдельный файл. Готовые чанки записываются в manifest.json, поэтому
+прерванную выгрузку можно запустить повторно с тем же --dir: она продолжится
+со следующего чанка. Чанк загружается одной транзакцией, а чанк, id которого
+уже есть в целевой базе, пропускается — повторный import тоже продолжает с
+места остановки.
+
+Все чанки одного запуска export читаются из одного снимка (REPEATABLE READ).
+Фильтр --since/--until применяется к каждой таблице по своей колонке времени
+(TABLES): связанные строки вне диапазона не выгружаются, поэтому частичную
+выгрузку можно загрузить только в базу, где родительские строки уже есть.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import asyncpg
+from dotenv import load_dotenv
+
+from bot.migrations import current_version
+
+log = logging.getLogger(__name__)
+
+# Таблица -> колонка для фильтра --since/--until.
+# Порядок — порядок внешних ключей: в нём таблицы и загружаются.
+TABLES: Dict[str, str] = {
+    "users": "created_at",
+    "orders": "created_at",
+    "payments": "created_at",
+    "subscriptions": "starts_at",
+}
+
+FORMATS = ("csv", "jsonl")
+MANIFEST = "manifest.json"
+DEFAULT_CHUNK_ROWS = 1_000_000
+DEFAULT_BATCH_ROWS = 10_000
+
+# open_payments ведут запросы каталога, а COPY их обходит: после загрузки
+# платежей проекция достраивается так же, как в миграции 0003.
+REBUILD_OPEN_PAYMENTS_SQL = """
+INSERT INTO open_payments(
+  tg_user_id, direction, order_id, payment_id, status,
+  method, currency, amount, proof_file_id, created_at, updated_at
+)
+SELECT DISTINCT ON (u.tg_user_id, o.direction)
+       u.tg_user_id, o.direction, o.id, p.id, p.status,
+       p.method, p.currency, p.amount, p.proof_file_id, p.created_at, p.updated_at
+FROM payments p
+JOIN orders o ON o.id = p.order_id
+JOIN users u ON u.id = o.user_id
+WHERE p.status IN ('pending', 'proof_submitted')
+ORDER BY u.tg_user_id, o.direction, p.created_at DESC, p.id DESC
+ON CONFLICT DO NOTHING
+"""
+
+# Сдвинуть последовательность id за загруженные строки (но не назад)
+SYNC_SEQUENCE_SQL = """
+SELECT setval(seq, max_id)
+FROM (
+  SELECT pg_get_serial_sequence('{table}', 'id')::regclass AS seq,
+         (SELECT MAX(id) FROM {table}) AS max_id
+) s
+WHERE max_id > COALESCE(pg_sequence_last_value(seq), 0)
+"""
+
+
+class DataIOError(Exception):
+    """Ошибка выгрузки или загрузки данных."""
+    pass
+
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _copied(status: str) -> int:
+    """Число строк из статуса COPY ("COPY 1000")."""
+    return int(status.split()[-1])
+
+
+def _parse_time(value: str) -> datetime:
+    """Дата или дата-время ISO 8601; без часового пояса считается UTC."""
+    dt = datetime.fromisoformat(value)
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def _time_filter(
+    column: str, since: Optional[datetime], until: Optional[datetime], first_param: int
+) -> Tuple[str, list]:
+    """
+    Условие на колонку времени для дописывания к WHERE.
+
+    Returns:
+        (" AND ...", параметры начиная с $first_param)
+    """
+    sql, args = "", []
+    if since is not None:
+        args.append(since)
+        sql += f" AND {_ident(column)} >= ${first_param + len(args) - 1}"
+    if until is not None:
+        args.append(until)
+        sql += f" AND {_ident(column)} < ${first_param + len(args) - 1}"
+    return sql, args
+
+
+async def _columns(con: asyncpg.Connection, table: str) -> List[str]:
+    rows = await con.fetch(
+        """
+        SELECT attname FROM pg_attribute
+        WHERE attrelid = $1::regclass AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum
+        """,
+        table,
+    )
+    return [r["attname"] for r in rows]
+
+
+async def _column_types(con: asyncpg.Connection, table: str) -> Dict[str, str]:
+    rows = await con.fetch(
+        """
+        SELECT attname, atttypid::regtype::text AS type FROM pg_attribute
+        WHERE attrelid = $1::regclass AND attnum > 0 AND NOT attisdropped
+        """,
+        table,
+    )
+    return {r["attname"]: r["type"] for r in rows}
+
+
+def _load_manifest(directory: Path) -> Optional[dict]:
+    path = directory / MANIFEST
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _save_manifest(directory: Path, manifest: dict) -> None:
+    # Через временный файл: оборванная запись не портит список готовых чанков
+    tmp = directory / (MANIFEST + ".part")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, directory / MANIFEST)
+
+
+class _JsonLinesWriter:
+    """
+    Приёмник COPY для JSONL: по строке row_to_json на запись.
+
+    COPY в текстовом формате удваивает обратную косую черту. Других
+    экранирований в выводе нет: управляющие символы row_to_json уже
+    экранировал сам, поэтому достаточно вернуть "\\\\" -> "\\" в целых строках.
+    """
+
+    def __init__(self, fh):
+        self._fh = fh
+        self._tail = b""
+
+    async def __call__(self, data: bytes) -> None:
+        data = self._tail + data
+        end = data.rfind(b"\n") + 1
+        self._tail = data[end:]
+        self._fh.write(data[:end].replace(b"\\\\", b"\\"))
+
+
+async def _copy_out(
+    con: asyncpg.Connection, query: str, args: tuple, path: Path, fmt: str
+) -> int:
+    if fmt == "csv":
+        status = await con.copy_from_query(
+            query, *args, output=str(path), format="csv", header=True
+        )
+        return _copied(status)
+
+    with open(path, "wb") as fh:
+        status = await con.copy_from_query(
+            f"SELECT row_to_json(t)::text FROM ({query}) t", *args, output=_JsonLinesWriter(fh)
+        )
+    return _copied(status)
+
+
+async def _export_table(
+    con: asyncpg.Connection,
+    out_dir: Path,
+    manifest: dict,
+    table: str,
+    since: Optional[datetime],
+    until: Optional[datetime],
+) -> int:
+    fmt, chunk_rows = manifest["format"], manifest["chunk_rows"]
+    entry = manifest["tables"].get(table)
+    if entry is None:
+        entry = manifest["tables"][table] = {
+            "columns": await _columns(con, table),
+            "chunks": [],
+            "complete": False,
+        }
+    if entry["complete"]:
+        log.info(f"{table}: already exported, skipping")
+        return 0
+
+    (out_dir / table).mkdir(parents=True, exist_ok=True)
+    select = ", ".join(_ident(c) for c in entry["columns"])
+    where, filter_args = _time_filter(TABLES[table], since, until, first_param=3)
+    after_id = entry["chunks"][-1]["last_id"] if entry["chunks"] else 0
+    exported = 0
+
+    while True:
+        # Граница чанка по индексу id: последний id следующих chunk_rows строк
+        last_id = await con.fetchval(
+            f"SELECT MAX(id) FROM (SELECT id FROM {table} WHERE id > $1{where} "
+            f"ORDER BY id LIMIT $2) c",
+            after_id, chunk_rows, *filter_args,
+        )
+        if last_id is None:
+            break
+
+        name = f"{table}/{table}_{len(entry['chunks']) + 1:06d}.{fmt}"
+        tmp = out_dir / (name + ".part")
+        rows = await _copy_out(
+            con,
+            f"SELECT {select} FROM {table} WHERE id > $1 AND id <= $2{where} ORDER BY id",
+            (after_id, last_id, *filter_args),
+            tmp,
+            fmt,
+        )
+        os.replace(tmp, out_dir / name)
+
+        entry["chunks"].append({"file": name, "after_id": after_id, "last_id": last_id, "rows": rows})
+        _save_manifest(out_dir, manifest)
+        log.info(f"{table}: {name} ({rows} rows, id {after_id + 1}..{last_id})")
+        exported += rows
+        after_id = last_id
+
+    entry["complete"] = True
+    _save_manifest(out_dir, manifest)
+    return exported
+
+
+async def export_tables(
+    con: asyncpg.Connection,
+    out_dir: Path,
+    tables: List[str],
+    fmt: str = "csv",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> Dict[str, int]:
+    """
+    Выгрузить таблицы в out_dir (продолжая прерванную выгрузку, если есть manifest).
+
+    Args:
+        con: Соединение с исходной базой
+        out_dir: Каталог выгрузки
+        tables: Таблицы из TABLES
+        fmt: "csv" или "jsonl"
+        since: Нижняя граница (включительно) колонки времени таблицы
+        until: Верхняя граница (не включительно)
+        chunk_rows: Строк в одном файле
+
+    Returns:
+        Число выгруженных в этом запуске строк по таблицам
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    params = {
+        "format": fmt,
+        "since": since.isoformat() if since else None,
+        "until": until.isoformat() if until else None,
+        "chunk_rows": chunk_rows,
+    }
+    manifest = _load_manifest(out_dir)
+    if manifest is None:
+        manifest = {**params, "schema_version": await current_version(con), "tables": {}}
+    elif any(manifest.get(k) != v for k, v in params.items()):
+        raise DataIOError(
+            f"{out_dir / MANIFEST} was written with different parameters "
+            f"({', '.join(f'{k}={manifest.get(k)}' for k in params)}); use another --dir"
+        )
+
+    exported: Dict[str, int] = {}
+    async with con.transaction(isolation="repeatable_read", readonly=True):
+        for table in tables:
+            exported[table] = await _export_table(con, out_dir, manifest, table, since, until)
+    return exported
+
+
+def _json_converters(types: Dict[str, str], columns: List[str]) -> list:
+    """Преобразования значений JSON в Python-типы для бинарного COPY, по колонкам."""
+    converters = []
+    for column in columns:
+        if types[column].startswith("timestamp"):
+            converters.append(datetime.fromisoformat)
+        else:
+            converters.append(None)
+    return converters
+
+
+async def _copy_in_jsonl(
+    con: asyncpg.Connection, table: str, columns: List[str], path: Path, batch_rows: int
+) -> int:
+    converters = _json_converters(await _column_types(con, table), columns)
+    copied = 0
+    batch: list = []
+
+    async def flush() -> int:
+        status = await con.copy_records_to_table(table, records=batch, columns=columns)
+        batch.clear()
+        return _copied(status)
+
+    with open(path, "rb") as fh:
+        for line in fh:
+            row = json.loads(line)
+            batch.append(tuple(
+                convert(row[c]) if convert is not None and row[c] is not None else row[c]
+                for c, convert in zip(columns, converters)
+            ))
+            if len(batch) >= batch_rows:
+                copied += await flush()
+    if batch:
+        copied += await flush()
+    return copied
+
+
+async def _import_table(
+    con: asyncpg.Connection, in_dir: Path, manifest: dict, table: str, batch_rows: int
+) -> int:
+    entry = manifest["tables"][table]
+    columns = entry["columns"]
+    missing = set(columns) - set(await _columns(con, table))
+    if missing:
+        raise DataIOError(f"{table}: target table has no columns {sorted(missing)}")
+    if not entry["complete"]:
+        log.warning(f"{table}: export is incomplete, importing {len(entry['chunks'])} chunk(s)")
+
+    imported = 0
+    for chunk in entry["chunks"]:
+        # Чанк загружается целиком или никак: любые его id в базе — уже загружен
+        done = await con.fetchval(
+            f"SELECT EXISTS (SELECT 1 FROM {table} WHERE id > $1 AND id <= $2)",
+            chunk["after_id"], chunk["last_id"],
+        )
+        if done:
+            log.info(f"{table}: {chunk['file']} already imported, skipping")
+            continue
+
+        path = in_dir / chunk["file"]
+        async with con.transaction():
+            if manifest["format"] == "csv":
+                status = await con.copy_to_table(
+                    table, source=str(path), columns=columns, format="csv", header=True
+                )
+                rows = _copied(status)
+            else:
+                rows = await _copy_in_jsonl(con, table, columns, path, batch_rows)
+        log.info(f"{table}: {chunk['file']} ({rows} rows)")
+        imported += rows
+
+    await con.execute(SYNC_SEQUENCE_SQL.format(table=table))
+    return imported
+
+
+async def import_tables(
+    con: asyncpg.Connection,
+    in_dir: Path,
+    tables: List[str],
+    batch_rows: int = DEFAULT_BATCH_ROWS,
+) -> Dict[str, int]:
+    """
+    Загрузить выгрузку из in_dir в базу (пропуская уже загруженные чанки).
+
+    Args:
+        con: Соединение с целевой базой (миграции уже применены)
+        in_dir: Каталог выгрузки с manifest.json
+        tables: Таблицы из TABLES; загружаются в порядке внешних ключей
+        batch_rows: Записей в одном copy_records_to_table (для JSONL)
+
+    Returns:
+        Число загруженных в этом запуске строк по таблицам
+    """
+    manifest = _load_manifest(in_dir)
+    if manifest is None:
+        raise DataIOError(f"No {MANIFEST} in {in_dir}")
+
+    version = await current_version(con)
+    if version < manifest["schema_version"]:
+        raise DataIOError(
+            f"Target schema version {version} is older than the export "
+            f"({manifest['schema_version']}); run python -m bot.migrate first"
+        )
+
+    # jsonb в бинарном формате COPY: байт версии и текст JSON
+    await con.set_type_codec(
+        "jsonb",
+        schema="pg_catalog",
+        format="binary",
+        encoder=lambda v: b"\x01" + json.dumps(v, ensure_ascii=False).encode(),
+        decoder=lambda b: json.loads(b[1:]),
+    )
+
+    imported: Dict[str, int] = {}
+    for table in TABLES:
+        if table not in tables:
+            continue
+        if table not in manifest["tables"]:
+            log.warning(f"{table}: not in the export, skipping")
+            continue
+        imported[table] = await _import_table(con, in_dir, manifest, table, batch_rows)
+
+    if imported.get("payments"):
+        await con.execute(REBUILD_OPEN_PAYMENTS_SQL)
+    if any(imported.values()):
+        # загруженные строки старше отметки пересчёта: /stats пересчитается целиком
+        await con.execute("UPDATE stats_refresh_state SET watermark = NULL")
+    return imported
+
+
+async def _run(args: argparse.Namespace, tables: List[str]) -> int:
+    con = await asyncpg.connect(dsn=args.dsn)
+    try:
+        if args.command == "export":
+            counts = await export_tables(
+                con, args.dir, tables, args.format, args.since, args.until, args.chunk_rows
+            )
+        else:
+            counts = await import_tables(con, args.dir, tables, args.batch_rows)
+    except DataIOError as e:
+        log.error(str(e))
+        return 1
+    finally:
+        await con.close()
+
+    summary = ", ".join(f"{t}={n}" for t, n in counts.items()) or "nothing to do"
+    log.info(f"{args.command.capitalize()} finished: {summary}")
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(prog="python -m bot.dataio")
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("--dir", type=Path, required=True, help="export directory")
+    parser.add_argument("--tables", default=",".join(TABLES), help="comma-separated subset of tables")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="file format (export)")
+    parser.add_argument("--since", type=_parse_time, help="rows from this time, inclusive (export)")
+    parser.add_argument("--until", type=_parse_time, help="rows before this time (export)")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="rows per file (export)")
+    parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS, help="rows per COPY batch (jsonl import)")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_PUBLIC_URL"))
+    args = parser.parse_args(argv)
+
+    if not args.dsn:
+        parser.error("Missing required env var: DATABASE_PUBLIC_URL (or pass --dsn)")
+    tables = [t.strip() for t in args.tables.split(",") if t.strip()]
+    unknown = [t for t in tables if t not in TABLES]
+    if unknown:
+        parser.error(f"Unknown tables: {', '.join(unknown)} (known: {', '.join(TABLES)})")
+    if args.chunk_rows <= 0 or args.batch_rows <= 0:
+        parser.error("--chunk-rows and --batch-rows must be positive")
+
+    return asyncio.run(_run(args, tables))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
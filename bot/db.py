@@ -1,15 +1,50 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
-from datetime import datetime
+import os
+import secrets
+import time
+from contextlib import asynccontextmanager
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import replace
+from datetime import date, datetime, timedelta, timezone
 from enum import Enum
-from typing import Optional, List
+from typing import AsyncIterator, Dict, Mapping, Optional, List, Tuple
 
 import asyncpg
 
+from bot.cache import LRUCache, TTLCache
+from bot.constants import D_YOGA, OUTBOX_CHECKOUT_EXPIRED, OUTBOX_PAYMENT_APPROVED, OUTBOX_SUBSCRIPTION_EXPIRED
+from bot.config import DbCacheSettings, DbPoolSettings, DbReplicaSettings, DbSlowQuerySettings
+from bot.invalidation import InvalidationBus
+from bot.metrics import DEFAULT_LATENCY_BUCKETS, REGISTRY
+from bot.migrations import apply_migrations, current_version, latest_version
+from bot.models import (
+    FulfillmentPlan, Order, OutboxMessage, Payment, ProofTotals,
+    RevenueTotal, StatsReport, Subscription, SubscriptionTotals,
+)
+from bot.statements import READ_ONLY_STATEMENTS, STATEMENTS
+
 logger = logging.getLogger(__name__)
 
+# Размер страницы по умолчанию для потоковых обходов подписок
+DEFAULT_BATCH_SIZE = 200
+
+# Начальный курсор keyset-пагинации по (expires_at, id): раньше любой подписки
+_KEYSET_START = datetime(1, 1, 1, tzinfo=timezone.utc)
+
+# Пулы соединений
+PRIMARY = "primary"
+REPLICA = "replica"
+
+# Telegram user ID, от имени которого сейчас выполняются запросы.
+# Выставляется middleware на время обработки апдейта; после записи этот
+# пользователь какое-то время читает только с primary (read-your-writes).
+current_actor: ContextVar[Optional[int]] = ContextVar("db_current_actor", default=None)
+
 
 # Константы для статусов
 class OrderStatus(str, Enum):
@@ -29,171 +64,739 @@ class PaymentStatus(str, Enum):
     CANCELLED = "cancelled"
 
 
+# Платёж можно одобрить только пока он открыт
+APPROVABLE_PAYMENT_STATUSES = frozenset({PaymentStatus.PENDING.value, PaymentStatus.PROOF_SUBMITTED.value})
+
+
 class SubscriptionStatus(str, Enum):
     """Статусы подписок."""
     ACTIVE = "active"
     EXPIRED = "expired"
 
 
-# SQL схема базы данных
-SCHEMA_SQL = """
-CREATE TABLE IF NOT EXISTS users (
-  id BIGSERIAL PRIMARY KEY,
-  tg_user_id BIGINT UNIQUE NOT NULL,
-  username TEXT,
-  first_name TEXT,
-  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-);
-
-CREATE TABLE IF NOT EXISTS orders (
-  id BIGSERIAL PRIMARY KEY,
-  user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-  direction TEXT NOT NULL,
-  payload_json JSONB NOT NULL,
-  status TEXT NOT NULL DEFAULT 'draft',
-  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-);
-
-CREATE TABLE IF NOT EXISTS payments (
-  id BIGSERIAL PRIMARY KEY,
-  order_id BIGINT NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
-  method TEXT NOT NULL,
-  currency TEXT NOT NULL,
-  amount INTEGER NOT NULL,
-  status TEXT NOT NULL DEFAULT 'pending',
-  proof_file_id TEXT,
-  admin_id_approved BIGINT,
-  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-);
-
-CREATE TABLE IF NOT EXISTS subscriptions (
-  id BIGSERIAL PRIMARY KEY,
-  user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-  product TEXT NOT NULL,
-  status TEXT NOT NULL DEFAULT 'active',
-  starts_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-  expires_at TIMESTAMPTZ,
-  last_payment_id BIGINT REFERENCES payments(id),
-  channel_id BIGINT,
-  joined_at TIMESTAMPTZ DEFAULT NOW(),
-  feedback_sent_at TIMESTAMPTZ
-);
-
-CREATE TABLE IF NOT EXISTS channel_access_log (
-  id BIGSERIAL PRIMARY KEY,
-  user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-  channel_key TEXT NOT NULL,
-  invite_link TEXT,
-  granted_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-  revoked_at TIMESTAMPTZ
-);
-
-CREATE TABLE IF NOT EXISTS yoga_feedback (
-  id BIGSERIAL PRIMARY KEY,
-  user_id BIGINT NOT NULL,
-  subscription_id BIGINT NOT NULL,
-  q1_difficulty TEXT,
-  q2_pace TEXT,
-  q3_state TEXT,
-  q4_format TEXT,
-  q5_frequency TEXT,
-  q6_preferences TEXT[],
-  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-  UNIQUE(user_id, subscription_id)
-);
-
--- Индексы
-CREATE INDEX IF NOT EXISTS idx_users_tg_user_id ON users(tg_user_id);
-CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id);
-CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
-CREATE INDEX IF NOT EXISTS idx_payments_order_id ON payments(order_id);
-CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(status);
-CREATE INDEX IF NOT EXISTS idx_subscriptions_user_id ON subscriptions(user_id);
-CREATE INDEX IF NOT EXISTS idx_subscriptions_expires_at ON subscriptions(expires_at);
-CREATE INDEX IF NOT EXISTS idx_subscriptions_channel_id ON subscriptions(channel_id);
-CREATE INDEX IF NOT EXISTS idx_subscriptions_status ON subscriptions(status);
-CREATE INDEX IF NOT EXISTS idx_subscriptions_product ON subscriptions(product);
-CREATE INDEX IF NOT EXISTS idx_yoga_feedback_user_sub ON yoga_feedback(user_id, subscription_id);
-CREATE INDEX IF NOT EXISTS idx_channel_access_log_user ON channel_access_log(user_id, channel_key);
-"""
-
-
 class DatabaseError(Exception):
     """Базовое исключение для ошибок БД."""
     pass
 
 
+class PoolSaturatedError(DatabaseError):
+    """Не удалось получить соединение из пула за acquire_timeout."""
+
+    user_message = "Сервис сейчас перегружен 🙏 Попробуй, пожалуйста, через минуту."
+
+
+# Имена метрик по именованным запросам
+STATEMENT_CALLS = "db_statement_calls_total"
+STATEMENT_DURATION = "db_statement_duration_seconds"
+STATEMENT_ROWS = "db_statement_rows"
+STATEMENT_POOL_WAIT = "db_statement_pool_wait_seconds"
+SLOW_STATEMENTS = "db_slow_statements_total"
+REGISTRY.describe(STATEMENT_CALLS, "Number of executed catalog statements")
+REGISTRY.describe(STATEMENT_DURATION, "Catalog statement latency, including pool acquire")
+REGISTRY.describe(STATEMENT_ROWS, "Rows returned or affected by a catalog statement")
+REGISTRY.describe(STATEMENT_POOL_WAIT, "Time a catalog statement waited for a pool connection")
+REGISTRY.describe(SLOW_STATEMENTS, "Catalog statements slower than the slow-query threshold")
+
+# Точечные запросы по индексу идут за доли миллисекунды: бакеты от 50 мкс
+STATEMENT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005) + DEFAULT_LATENCY_BUCKETS
+
+# Бакеты числа строк: от точечных запросов до пачек задач и архивации
+ROWS_BUCKETS = (0, 1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+# Метрики пула соединений
+POOL_ACQUIRE_WAIT = "db_pool_acquire_wait_seconds"
+POOL_ACQUIRE_TIMEOUTS = "db_pool_acquire_timeouts_total"
+POOL_SIZE = "db_pool_size"
+POOL_IN_USE = "db_pool_in_use"
+POOL_WAITERS = "db_pool_waiters"
+REGISTRY.describe(POOL_ACQUIRE_WAIT, "Time spent waiting for a pool connection")
+REGISTRY.describe(POOL_ACQUIRE_TIMEOUTS, "Acquires that hit the acquire deadline")
+REGISTRY.describe(POOL_SIZE, "Open connections in the pool")
+REGISTRY.describe(POOL_IN_USE, "Connections currently checked out of the pool")
+REGISTRY.describe(POOL_WAITERS, "Callers waiting for a pool connection")
+
+# Реплика
+REPLICA_LAG = "db_replica_lag_seconds"
+REGISTRY.describe(REPLICA_LAG, "Replica replay lag behind primary (-1 if unknown)")
+
+
+def _json_dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+async def _execute(con: asyncpg.Connection, kind: str, sql: str, args: tuple):
+    if kind == "fetchrow":
+        return await con.fetchrow(sql, *args)
+    if kind == "fetch":
+        return await con.fetch(sql, *args)
+    return await con.execute(sql, *args)
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def _fulfillment_payload(plan: FulfillmentPlan) -> dict:
+    """Данные FulfillmentPlan для outbox (jsonb), всё нужное для доставки."""
+    return {
+        "payment_id": plan.payment_id,
+        "order_id": plan.order.id,
+        "direction": plan.order.direction,
+        "user_id": plan.user_id,
+        "tg_user_id": plan.tg_user_id,
+        "plan": plan.plan,
+        "old_product": plan.old_product,
+        "new_product": plan.new_product,
+        "expires_at": _isoformat(plan.expires_at),
+        "is_first_join": plan.is_first_join,
+        "changing_plan": plan.changing_plan,
+    }
+
+
+def _affected(status: str) -> int:
+    """Число строк из статуса команды ("INSERT 0 5", "DELETE 3")."""
+    return int(status.split()[-1])
+
+
+def _rows(kind: str, result) -> int:
+    """Число строк результата: длина fetch, 0/1 для fetchrow, счётчик из статуса execute."""
+    if kind == "fetch":
+        return len(result)
+    if kind == "fetchrow":
+        return 0 if result is None else 1
+    count = result.rsplit(" ", 1)[-1]
+    return int(count) if count.isdigit() else 0
+
+
+def _observe_statement(name: str, status: str, target: str, started: float) -> float:
+    """Записать вызов и латентность запроса; вернуть длительность в секундах."""
+    duration = time.perf_counter() - started
+    REGISTRY.counter(STATEMENT_CALLS, statement=name, status=status, target=target).inc()
+    REGISTRY.histogram(STATEMENT_DURATION, STATEMENT_BUCKETS, statement=name).observe(duration)
+    return duration
+
+
+def _redact(value) -> str:
+    """Форма аргумента запроса без значения: тип и размер."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}[{len(value)}]"
+    if isinstance(value, (list, tuple)):
+        return f"list[{len(value)}]"
+    if isinstance(value, dict):
+        return f"json[{len(value)}]"
+    return type(value).__name__
+
+
+class SlowQueryLog:
+    """
+    Журнал медленных запросов.
+
+    В лог попадают имя запроса, длительность, ожидание пула, число строк и
+    форма аргументов (типы и размеры, без значений — там персональные
+    данные). Один запрос логируется не чаще раза в log_interval_seconds,
+    последние образцы хранятся для /dbstats.
+    """
+
+    def __init__(self, settings: Optional[DbSlowQuerySettings] = None, keep: int = 20):
+        self.settings = settings or DbSlowQuerySettings()
+        self.samples: deque = deque(maxlen=keep)
+        self._logged_at: Dict[str, float] = {}
+
+    def observe(
+            self, name: str, kind: str, target: str,
+            duration: float, wait: float, rows: Optional[int], args: tuple
+    ) -> None:
+        if duration < self.settings.threshold_seconds:
+            return
+        REGISTRY.counter(SLOW_STATEMENTS, statement=name).inc()
+        sample = {
+            "statement": name,
+            "kind": kind,
+            "target": target,
+            "duration": duration,
+            "pool_wait": wait,
+            "rows": rows,
+            "args": ", ".join(_redact(a) for a in args),
+            "at": datetime.now(timezone.utc),
+        }
+        self.samples.append(sample)
+
+        now = time.monotonic()
+        last = self._logged_at.get(name)
+        if last is not None and now - last < self.settings.log_interval_seconds:
+            return
+        self._logged_at[name] = now
+        logger.warning(
+            f"Slow statement {name} ({kind}) on {target}: {duration * 1000:.1f} ms, "
+            f"pool wait {wait * 1000:.1f} ms, rows {'-' if rows is None else rows}, "
+            f"args ({sample['args']})"
+        )
+
+
+class CatalogConnection(asyncpg.Connection):
+    """asyncpg-соединение, которое заранее готовит запросы каталога."""
+
+    async def register_json_codecs(self) -> None:
+        """
+        Кодировать/декодировать json и jsonb на стороне драйвера.
+
+        Значения приходят из БД уже разобранными (dict/list), а параметры
+        передаются как Python-объекты. Должно выполняться до prepare_catalog:
+        кодеки типов фиксируются в prepared statement при подготовке.
+        """
+        for typename in ("json", "jsonb"):
+            await self.set_type_codec(
+                typename, encoder=_json_dumps, decoder=json.loads, schema="pg_catalog"
+            )
+
+    # предупреждение о недоступном кэше asyncpg пишется один раз на процесс
+    _prepare_unsupported_logged = False
+
+    async def prepare_catalog(self, statements: Dict[str, str]) -> None:
+        """
+        Подготовить (PREPARE) все запросы каталога на этом соединении.
+
+        Запросы кладутся во встроенный кэш prepared statements asyncpg
+        (ключ — текст запроса), поэтому последующие fetch/execute с тем же
+        текстом выполняются без повторного разбора на сервере и переживают
+        возврат соединения в пул. Публичный Connection.prepare() не подходит:
+        его PreparedStatement становится недействительным, как только
+        соединение возвращается в пул.
+
+        Наполнить этот кэш можно только приватным _get_statement, поэтому
+        asyncpg закреплён в requirements.txt на проверенных версиях. Если в
+        установленной версии метода нет или у него другая сигнатура,
+        подготовка пропускается: запросы подготовятся при первом выполнении.
+        """
+        get_statement = getattr(self, "_get_statement", None)
+        if get_statement is None:
+            self._log_prepare_unsupported("Connection._get_statement is missing")
+            return
+        for sql in statements.values():
+            try:
+                await get_statement(sql, None)
+            except TypeError as e:
+                self._log_prepare_unsupported(f"Connection._get_statement changed: {e}")
+                return
+
+    @classmethod
+    def _log_prepare_unsupported(cls, reason: str) -> None:
+        if cls._prepare_unsupported_logged:
+            return
+        cls._prepare_unsupported_logged = True
+        logger.warning(
+            f"Statement catalog is not prepared in advance with asyncpg {asyncpg.__version__} "
+            f"({reason}); statements will be prepared on first use"
+        )
+
+
+class Transaction:
+    """
+    Именованные запросы каталога на одном соединении внутри транзакции.
+
+    Создаётся через Database.transaction(). Метрики и логи пишутся так же,
+    как для одиночных запросов.
+    """
+
+    def __init__(self, con: asyncpg.Connection, slow_log: Optional[SlowQueryLog] = None):
+        self._con = con
+        self._slow_log = slow_log
+        self.statements: List[str] = []
+
+    async def _run(self, kind: str, name: str, args: tuple):
+        if name not in STATEMENTS:
+            raise DatabaseError(f"Unknown statement: {name}")
+        self.statements.append(name)
+        started = time.perf_counter()
+        status = "ok"
+        rows = None
+        try:
+            result = await _execute(self._con, kind, STATEMENTS[name], args)
+            rows = _rows(kind, result)
+            REGISTRY.histogram(STATEMENT_ROWS, ROWS_BUCKETS, statement=name).observe(rows)
+            return result
+        except Exception as e:
+            status = "error"
+            logger.error(f"Statement {name} ({kind}) failed in transaction: {type(e).__name__}: {e}")
+            raise DatabaseError(f"Query {name} failed: {e}") from e
+        finally:
+            duration = _observe_statement(name, status, PRIMARY, started)
+            if self._slow_log is not None:
+                # соединение транзакции уже взято: ожидания пула у запроса нет
+                self._slow_log.observe(name, kind, PRIMARY, duration, 0.0, rows, args)
+
+    async def fetchrow(self, name: str, *args) -> Optional[asyncpg.Record]:
+        return await self._run("fetchrow", name, args)
+
+    async def fetch(self, name: str, *args) -> List[asyncpg.Record]:
+        return await self._run("fetch", name, args)
+
+    async def execute(self, name: str, *args) -> str:
+        return await self._run("execute", name, args)
+
+
 class Database:
     """Класс для работы с PostgreSQL базой данных."""
 
-    def __init__(self, dsn: str):
+    def __init__(
+            self,
+            dsn: str,
+            pool_settings: Optional[DbPoolSettings] = None,
+            user_cache_size: int = 10_000,
+            auto_migrate: bool = True,
+            replica_dsn: Optional[str] = None,
+            replica_settings: Optional[DbReplicaSettings] = None,
+            cache_settings: Optional[DbCacheSettings] = None,
+            slow_query_settings: Optional[DbSlowQuerySettings] = None
+    ):
         """
         Инициализация database wrapper.
 
         Args:
             dsn: PostgreSQL connection string
+            pool_settings: Настройки пула соединений (по умолчанию DbPoolSettings())
+            user_cache_size: Размер LRU-кэша tg_user_id -> internal user ID
+            auto_migrate: Применять недостающие миграции при connect()
+            replica_dsn: Connection string реплики для чтений (опционально)
+            replica_settings: Настройки маршрутизации на реплику
+            cache_settings: Настройки кэша заказов и платежей
+            slow_query_settings: Порог и частота логирования медленных запросов
         """
         self._dsn = dsn
+        self._replica_dsn = replica_dsn
+        # application_name соединений пула: по нему уведомления InvalidationBus
+        # о своих записях отличаются от чужих (миграция 0012)
+        self.origin = f"bot-{os.getpid()}-{secrets.token_hex(4)}"
+        self._auto_migrate = auto_migrate
+        self._pool_settings = pool_settings or DbPoolSettings()
+        self._replica_settings = replica_settings or DbReplicaSettings()
         self.pool: Optional[asyncpg.Pool] = None
+        self.replica_pool: Optional[asyncpg.Pool] = None
+        self._waiters: Dict[str, int] = {PRIMARY: 0, REPLICA: 0}
+        # None — отставание неизвестно, чтения идут на primary
+        self._replica_lag: Optional[float] = None
+        # tg_user_id -> monotonic-дедлайн, до которого чтения идут на primary
+        self._sticky: LRUCache[int, float] = LRUCache(user_cache_size)
+        # tg_user_id -> (user_id, (username, first_name) | None)
+        self._users: LRUCache[int, Tuple[int, Optional[Tuple[Optional[str], Optional[str]]]]] = (
+            LRUCache(user_cache_size)
+        )
+        # Read-through кэш заказов/платежей. Промахи читаются с primary, чтобы
+        # в кэш не попала строка, которая на реплике ещё не обновилась.
+        # Записи этого процесса инвалидируют кэш сразу, чужие — уведомлением
+        # LISTEN/NOTIFY (subscribe_invalidation). TTL ограничивает устаревание,
+        # только если шина выключена (DB_INVALIDATION_ENABLED=0).
+        cs = cache_settings or DbCacheSettings()
+        self._orders: TTLCache[int, Order] = TTLCache("orders", cs.size, cs.ttl_seconds)
+        self._payments: TTLCache[int, Payment] = TTLCache("payments", cs.size, cs.ttl_seconds)
+        # владелец заказа не меняется, кэш только ограничивает память
+        self._owners: TTLCache[int, Tuple[int, int]] = TTLCache(
+            "order_owners", cs.size, cs.ttl_seconds
+        )
+        self.slow_log = SlowQueryLog(slow_query_settings)
 
     async def connect(self) -> None:
-        """Создать connection pool и применить схему БД."""
+        """Проверить/применить миграции и создать connection pool."""
         try:
-            self.pool = await asyncpg.create_pool(
-                dsn=self._dsn,
-                min_size=1,
-                max_size=10,
-                command_timeout=60
+            # Миграции проверяем отдельным соединением до создания пула:
+            # запросы каталога подготавливаются при открытии каждого соединения
+            # пула и требуют, чтобы схема уже была актуальной.
+            con = await asyncpg.connect(dsn=self._dsn)
+            try:
+                await self._check_schema(con)
+            finally:
+                await con.close()
+
+            ps = self._pool_settings
+            # Кэш asyncpg должен вмещать весь каталог, иначе подготовленные
+            # при init запросы будут вытесняться.
+            cache_size = ps.statement_cache_size
+            if cache_size < len(STATEMENTS):
+                logger.warning(
+                    f"statement_cache_size={cache_size} is smaller than the statement "
+                    f"catalog ({len(STATEMENTS)}), raising it"
+                )
+                cache_size = len(STATEMENTS)
+
+            self.pool = await self._create_pool(self._dsn, cache_size, self._init_connection)
+            self._register_pool_gauges(PRIMARY, self.pool)
+            await self._warmup(self.pool)
+            logger.info(
+                f"Database connected "
+                f"(pool {ps.min_size}..{ps.max_size}, warm: {self.pool.get_size()}, "
+                f"{len(STATEMENTS)} statements prepared per connection)"
             )
-            async with self.pool.acquire() as con:
-                await con.execute(SCHEMA_SQL)
-            logger.info("Database connected and schema applied")
+
+            if self._replica_dsn:
+                self.replica_pool = await self._create_pool(
+                    self._replica_dsn, cache_size, self._init_replica_connection
+                )
+                self._register_pool_gauges(REPLICA, self.replica_pool)
+                await self._warmup(self.replica_pool)
+                REGISTRY.gauge(
+                    REPLICA_LAG,
+                    fn=lambda: -1.0 if self._replica_lag is None else self._replica_lag
+                )
+                await self.refresh_replica_lag()
+                logger.info(
+                    f"Replica connected ({len(READ_ONLY_STATEMENTS)} read-only statements "
+                    f"prepared per connection, lag: {self._replica_lag}s)"
+                )
+        except DatabaseError as e:
+            logger.error(f"Failed to connect to database: {e}")
+            raise
         except Exception as e:
             logger.error(f"Failed to connect to database: {e}")
             raise DatabaseError(f"Connection failed: {e}") from e
 
+    async def _check_schema(self, con: asyncpg.Connection) -> None:
+        """Применить недостающие миграции; без автомиграции — DatabaseError, если схема отстаёт."""
+        if self._auto_migrate:
+            applied = await apply_migrations(con)
+            if applied:
+                logger.info(f"Applied migrations: {', '.join(m.label for m in applied)}")
+            return
+
+        current, latest = await current_version(con), latest_version()
+        if current < latest:
+            # без актуальной схемы подготовка каталога упадёт на первом же
+            # соединении пула с невнятной ошибкой про отсутствующую таблицу
+            raise DatabaseError(
+                f"Database schema is at version {current}, code expects {latest}. "
+                f"Run `python -m bot.migrate` before starting the bot."
+            )
+
+    async def _create_pool(self, dsn: str, cache_size: int, init) -> asyncpg.Pool:
+        ps = self._pool_settings
+        return await asyncpg.create_pool(
+            dsn=dsn,
+            min_size=ps.min_size,
+            max_size=ps.max_size,
+            command_timeout=ps.command_timeout,
+            max_queries=ps.max_queries,
+            max_inactive_connection_lifetime=ps.max_inactive_connection_lifetime,
+            statement_cache_size=cache_size,
+            connection_class=CatalogConnection,
+            init=init,
+            server_settings={"application_name": self.origin},
+        )
+
+    async def _warmup(self, pool: asyncpg.Pool) -> None:
+        """
+        Открыть и прогреть warmup_size соединений при старте.
+
+        Одновременный acquire заставляет пул открыть соединения (с подготовкой
+        каталога в init), чтобы первые пользователи после деплоя не ждали
+        установку соединений.
+        """
+        target = min(max(self._pool_settings.warmup_size, self._pool_settings.min_size),
+                     self._pool_settings.max_size)
+        if target <= 0:
+            return
+        cons = []
+        try:
+            for _ in range(target):
+                cons.append(await pool.acquire())
+            await asyncio.gather(*(con.fetchval("SELECT 1") for con in cons))
+        finally:
+            for con in cons:
+                await pool.release(con)
+
+    def _register_pool_gauges(self, role: str, pool: asyncpg.Pool) -> None:
+        """Живые gauges пула: значения снимаются в момент чтения метрик."""
+        REGISTRY.gauge(POOL_SIZE, fn=lambda: pool.get_size(), pool=role)
+        REGISTRY.gauge(POOL_IN_USE, fn=lambda: pool.get_size() - pool.get_idle_size(), pool=role)
+        REGISTRY.gauge(POOL_WAITERS, fn=lambda: self._waiters[role], pool=role)
+
+    def pool_stats(self) -> dict:
+        """
+        Текущее состояние пула.
+
+        Returns:
+            Dict с полями size, in_use, idle, waiters, max_size,
+            acquire_wait_p95, acquire_timeouts
+        """
+        self._ensure_pool()
+        wait = REGISTRY.histogram(POOL_ACQUIRE_WAIT, pool=PRIMARY)
+        return {
+            "size": self.pool.get_size(),
+            "in_use": self.pool.get_size() - self.pool.get_idle_size(),
+            "idle": self.pool.get_idle_size(),
+            "waiters": self._waiters[PRIMARY],
+            "max_size": self.pool.get_max_size(),
+            "acquire_wait_p95": wait.quantile(0.95),
+            "acquire_timeouts": REGISTRY.counter(POOL_ACQUIRE_TIMEOUTS, pool=PRIMARY).value,
+        }
+
     async def close(self) -> None:
-        """Закрыть connection pool."""
+        """Закрыть connection pools."""
+        if self.replica_pool:
+            await self.replica_pool.close()
         if self.pool:
             await self.pool.close()
             logger.info("Database connection closed")
 
+    @staticmethod
+    async def _init_connection(con: "CatalogConnection") -> None:
+        """Хук init пула: кодеки json и подготовка запросов каталога на новом соединении."""
+        await con.register_json_codecs()
+        await con.prepare_catalog(STATEMENTS)
+
+    @staticmethod
+    async def _init_replica_connection(con: "CatalogConnection") -> None:
+        """Хук init пула реплики: кодеки json и только читающие запросы."""
+        await con.register_json_codecs()
+        await con.prepare_catalog({name: STATEMENTS[name] for name in READ_ONLY_STATEMENTS})
+
+    @property
+    def has_replica(self) -> bool:
+        return self.replica_pool is not None
+
+    def subscribe_invalidation(self, bus: InvalidationBus) -> None:
+        """
+        Вытеснять из кэшей строки, изменённые другими процессами.
+
+        Свои записи кэши инвалидируют сразу; уведомление о них тоже придёт
+        и лишь вызовет лишний промах.
+        """
+        def evict(*caches):
+            def handler(keys: List[int]) -> None:
+                for cache in caches:
+                    for key in keys:
+                        cache.invalidate(key)
+            return handler
+
+        def flush(*caches):
+            def handler() -> None:
+                for cache in caches:
+                    cache.clear()
+            return handler
+
+        # кэш пользователей — по tg_user_id, его и шлёт триггер users
+        bus.subscribe("users", evict(self._users), flush(self._users))
+        bus.subscribe("orders", evict(self._orders, self._owners), flush(self._orders, self._owners))
+        bus.subscribe("payments", evict(self._payments), flush(self._payments))
+
+    def cache_stats(self) -> Dict[str, dict]:
+        """Статистика кэшей заказов/платежей (для подбора DB_CACHE_SIZE/TTL)."""
+        return {c.name: c.stats() for c in (self._orders, self._payments, self._owners)}
+
+    async def refresh_replica_lag(self) -> Optional[float]:
+        """
+        Обновить оценку отставания реплики (для маршрутизации и метрики).
+
+        Если реплика недоступна, отставание считается неизвестным и все
+        чтения идут на primary, пока следующая проверка не пройдёт.
+
+        Returns:
+            Отставание в секундах или None
+        """
+        if self.replica_pool is None:
+            return None
+        try:
+            async with self._acquire(REPLICA) as con:
+                lag = await con.fetchval(STATEMENTS["replica.lag"])
+        except Exception as e:
+            logger.warning(f"Failed to measure replica lag: {type(e).__name__}: {e}")
+            lag = None
+        else:
+            # NULL: по этому DSN отвечает не реплика, а primary — отставания нет
+            lag = 0.0 if lag is None else max(float(lag), 0.0)
+        self._replica_lag = lag
+        return lag
+
+    def _route(self, name: str, replica: bool) -> str:
+        """
+        Выбрать пул для запроса.
+
+        На реплику уходят только читающие запросы, для которых вызывающий
+        метод разрешил реплику, и только если отставание известно и в
+        пределах max_lag_seconds, а текущий пользователь недавно не писал.
+        """
+        if not replica or self.replica_pool is None or name not in READ_ONLY_STATEMENTS:
+            return PRIMARY
+        lag = self._replica_lag
+        if lag is None or lag > self._replica_settings.max_lag_seconds:
+            return PRIMARY
+        actor = current_actor.get()
+        if actor is not None:
+            until = self._sticky.get(actor)
+            if until is not None and until > time.monotonic():
+                return PRIMARY
+        return REPLICA
+
+    def _mark_write(self, name: str) -> None:
+        """Запомнить, что текущий пользователь только что писал в primary."""
+        if self.replica_pool is None or name in READ_ONLY_STATEMENTS:
+            return
+        actor = current_actor.get()
+        if actor is not None:
+            self._sticky.set(actor, time.monotonic() + self._replica_settings.sticky_seconds)
+
     def _ensure_pool(self) -> None:
         """Проверить, что pool инициализирован."""
         if not self.pool:
             raise DatabaseError("Database pool is not initialized. Call connect() first.")
 
-    async def fetchrow(self, q: str, *args) -> Optional[asyncpg.Record]:
-        """Выполнить запрос и вернуть одну строку."""
+    @asynccontextmanager
+    async def _acquire(self, role: str = PRIMARY) -> AsyncIterator[asyncpg.Connection]:
+        """
+        Взять соединение из пула с дедлайном acquire_timeout.
+
+        Если пул насыщен дольше дедлайна, бросает PoolSaturatedError вместо
+        того, чтобы держать хэндлер до command_timeout.
+        """
         self._ensure_pool()
+        pool = self.replica_pool if role == REPLICA else self.pool
+        self._waiters[role] += 1
+        started = time.perf_counter()
         try:
-            async with self.pool.acquire() as con:
-                return await con.fetchrow(q, *args)
-        except Exception as e:
-            logger.error(f"fetchrow failed: {e}\nQuery: {q}\nArgs: {args}")
-            raise DatabaseError(f"Query failed: {e}") from e
+            con = await pool.acquire(timeout=self._pool_settings.acquire_timeout)
+        except asyncio.TimeoutError as e:
+            REGISTRY.counter(POOL_ACQUIRE_TIMEOUTS, pool=role).inc()
+            logger.warning(
+                f"Pool {role} acquire timed out after {self._pool_settings.acquire_timeout}s "
+                f"(in use: {pool.get_size() - pool.get_idle_size()}, "
+                f"waiters: {self._waiters[role]})"
+            )
+            raise PoolSaturatedError("Connection pool is saturated") from e
+        finally:
+            self._waiters[role] -= 1
+            REGISTRY.histogram(POOL_ACQUIRE_WAIT, pool=role).observe(time.perf_counter() - started)
+        try:
+            yield con
+        finally:
+            await pool.release(con)
 
-    async def fetch(self, q: str, *args) -> List[asyncpg.Record]:
-        """Выполнить запрос и вернуть несколько строк."""
+    async def _run(self, kind: str, name: str, args: tuple, replica: bool = False):
+        """
+        Выполнить именованный запрос из каталога.
+
+        Считает вызовы и латентность по имени запроса. В лог при ошибке
+        попадает только имя запроса — без текста SQL и аргументов.
+        Если реплика не ответила, читающий запрос повторяется на primary.
+        """
         self._ensure_pool()
+        if name not in STATEMENTS:
+            raise DatabaseError(f"Unknown statement: {name}")
+
+        target = self._route(name, replica)
+        started = time.perf_counter()
+        status = "ok"
+        rows = None
+        wait = 0.0
         try:
-            async with self.pool.acquire() as con:
-                return await con.fetch(q, *args)
+            if target == REPLICA:
+                try:
+                    result, wait = await self._execute_on(REPLICA, kind, name, args)
+                    rows = _rows(kind, result)
+                    return result
+                except (OSError, asyncpg.InterfaceError, asyncpg.PostgresConnectionError,
+                        asyncpg.CannotConnectNowError, PoolSaturatedError) as e:
+                    logger.warning(
+                        f"Replica failed on {name}, falling back to primary: {type(e).__name__}: {e}"
+                    )
+                    # до следующей успешной проверки отставания читаем с primary
+                    self._replica_lag = None
+                    target = PRIMARY
+            result, wait = await self._execute_on(PRIMARY, kind, name, args)
+            rows = _rows(kind, result)
+            self._mark_write(name)
+            return result
+        except PoolSaturatedError:
+            status = "saturated"
+            wait = time.perf_counter() - started
+            raise
         except Exception as e:
-            logger.error(f"fetch failed: {e}\nQuery: {q}\nArgs: {args}")
-            raise DatabaseError(f"Query failed: {e}") from e
+            status = "error"
+            logger.error(f"Statement {name} ({kind}) failed: {type(e).__name__}: {e}")
+            raise DatabaseError(f"Query {name} failed: {e}") from e
+        finally:
+            duration = _observe_statement(name, status, target, started)
+            if rows is not None:
+                REGISTRY.histogram(STATEMENT_ROWS, ROWS_BUCKETS, statement=name).observe(rows)
+            self.slow_log.observe(name, kind, target, duration, wait, rows, args)
+
+    async def _execute_on(self, role: str, kind: str, name: str, args: tuple) -> Tuple[object, float]:
+        """Выполнить запрос на соединении пула role; вернуть (результат, ожидание пула)."""
+        requested = time.perf_counter()
+        async with self._acquire(role) as con:
+            wait = time.perf_counter() - requested
+            REGISTRY.histogram(STATEMENT_POOL_WAIT, STATEMENT_BUCKETS, statement=name).observe(wait)
+            return await _execute(con, kind, STATEMENTS[name], args), wait
+
+    async def fetchrow(self, name: str, *args, replica: bool = False) -> Optional[asyncpg.Record]:
+        """Выполнить именованный запрос и вернуть одну строку (replica=True — можно с реплики)."""
+        return await self._run("fetchrow", name, args, replica)
+
+    async def fetch(self, name: str, *args, replica: bool = False) -> List[asyncpg.Record]:
+        """Выполнить именованный запрос и вернуть несколько строк (replica=True — можно с реплики)."""
+        return await self._run("fetch", name, args, replica)
+
+    async def execute(self, name: str, *args) -> str:
+        """Выполнить именованный запрос без возврата данных, вернуть статус."""
+        return await self._run("execute", name, args)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[Transaction]:
+        """
+        Выполнить несколько запросов каталога в одной транзакции на primary.
 
-    async def execute(self, q: str, *args) -> str:
-        """Выполнить запрос без возврата данных."""
-        self._ensure_pool()
+        Исключение внутри блока откатывает транзакцию. Ошибки BEGIN/COMMIT
+        (например, обрыв соединения) поднимаются как DatabaseError.
+        """
         try:
-            async with self.pool.acquire() as con:
-                return await con.execute(q, *args)
-        except Exception as e:
-            logger.error(f"execute failed: {e}\nQuery: {q}\nArgs: {args}")
-            raise DatabaseError(f"Query failed: {e}") from e
+            async with self._acquire(PRIMARY) as con:
+                async with con.transaction():
+                    tx = Transaction(con, self.slow_log)
+                    yield tx
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as e:
+            logger.error(f"Transaction failed: {type(e).__name__}: {e}")
+            raise DatabaseError(f"Transaction failed: {e}") from e
+        for name in tx.statements:
+            if name not in READ_ONLY_STATEMENTS:
+                self._mark_write(name)
+                break
+
+    @staticmethod
+    def statement_stats() -> Dict[str, dict]:
+        """
+        Счётчики и латентность по каждому именованному запросу.
+
+        Returns:
+            Dict имя запроса -> {calls, errors, p50, p95, p99, total_seconds,
+            rows_avg, rows_max_bucket, pool_wait_p95, slow}
+        """
+        stats: Dict[str, dict] = {}
+        for labels, counter in REGISTRY.counters(STATEMENT_CALLS).items():
+            lab = dict(labels)
+            entry = stats.setdefault(lab["statement"], {"calls": 0, "errors": 0})
+            entry["calls"] += counter.value
+            if lab["status"] == "error":
+                entry["errors"] += counter.value
+        for labels, hist in REGISTRY.histograms(STATEMENT_DURATION).items():
+            entry = stats.setdefault(dict(labels)["statement"], {"calls": 0, "errors": 0})
+            entry["p50"] = hist.quantile(0.5)
+            entry["p95"] = hist.quantile(0.95)
+            entry["p99"] = hist.quantile(0.99)
+            entry["total_seconds"] = hist.sum
+        for labels, hist in REGISTRY.histograms(STATEMENT_ROWS).items():
+            entry = stats.setdefault(dict(labels)["statement"], {"calls": 0, "errors": 0})
+            entry["rows_avg"] = hist.sum / hist.count if hist.count else None
+            # верхняя граница самого высокого непустого бакета (None — больше последней)
+            top = max((i for i, c in enumerate(hist.counts) if c), default=None)
+            entry["rows_max_bucket"] = (
+                hist.buckets[top] if top is not None and top < len(hist.buckets) else None
+            )
+        for labels, hist in REGISTRY.histograms(STATEMENT_POOL_WAIT).items():
+            entry = stats.setdefault(dict(labels)["statement"], {"calls": 0, "errors": 0})
+            entry["pool_wait_p95"] = hist.quantile(0.95)
+        for labels, counter in REGISTRY.counters(SLOW_STATEMENTS).items():
+            entry = stats.setdefault(dict(labels)["statement"], {"calls": 0, "errors": 0})
+            entry["slow"] = counter.value
+        return stats
 
     # ==================== Users ====================
 
@@ -206,6 +809,10 @@ class Database:
         """
         Создать или обновить пользователя.
 
+        Один запрос INSERT ... ON CONFLICT: строка переписывается только если
+        username/first_name действительно изменились. Если профиль совпадает с
+        закэшированным, запрос в БД не выполняется вовсе.
+
         Args:
             tg_user_id: Telegram user ID
             username: Telegram username
@@ -214,71 +821,55 @@ class Database:
         Returns:
             Internal user ID
         """
-        row = await self.fetchrow("SELECT id FROM users WHERE tg_user_id=$1", tg_user_id)
-        if row:
-            await self.execute(
-                "UPDATE users SET username=$2, first_name=$3 WHERE tg_user_id=$1",
-                tg_user_id, username, first_name
-            )
-            user_id = int(row["id"])
-            logger.debug(f"Updated user {user_id} (tg_id: {tg_user_id})")
-            return user_id
-
-        row2 = await self.fetchrow(
-            "INSERT INTO users(tg_user_id, username, first_name) VALUES($1,$2,$3) RETURNING id",
-            tg_user_id, username, first_name
-        )
-        user_id = int(row2["id"])
-        logger.info(f"Created new user {user_id} (tg_id: {tg_user_id})")
+        profile = (username, first_name)
+        cached = self._users.get(tg_user_id)
+        if cached and cached[1] == profile:
+            return cached[0]
+
+        row = await self.fetchrow("users.upsert", tg_user_id, username, first_name)
+        if row is None:
+            # Параллельный INSERT того же пользователя завершился после снимка
+            # нашего запроса: повторяем, теперь строка уже видна.
+            row = await self.fetchrow("users.upsert", tg_user_id, username, first_name)
+        if row is None:
+            raise DatabaseError(f"Failed to upsert user with tg_id {tg_user_id}")
+
+        user_id = int(row["id"])
+        self._users.set(tg_user_id, (user_id, profile))
+        if row["inserted"]:
+            logger.info(f"Created new user {user_id} (tg_id: {tg_user_id})")
+        else:
+            logger.debug(f"Upserted user {user_id} (tg_id: {tg_user_id})")
         return user_id
 
     async def get_user_id_by_tg(self, tg_user_id: int) -> Optional[int]:
         """
         Получить internal user ID по Telegram ID.
 
+        Сначала смотрит в LRU-кэш, в БД идёт только при промахе.
+
         Args:
             tg_user_id: Telegram user ID
 
         Returns:
             Internal user ID или None если не найден
         """
-        row = await self.fetchrow("SELECT id FROM users WHERE tg_user_id=$1", tg_user_id)
-        return int(row["id"]) if row else None
-
-    # ==================== Orders ====================
+        cached = self._users.get(tg_user_id)
+        if cached:
+            return cached[0]
 
-    async def create_order(
-            self,
-            user_id: int,
-            direction: str,
-            payload: dict,
-            status: str = OrderStatus.DRAFT
-    ) -> int:
-        """
-        Создать новый заказ.
+        row = await self.fetchrow("users.id_by_tg", tg_user_id)
+        if not row:
+            return None
 
-        Args:
-            user_id: Internal user ID
-            direction: Направление (yoga, english, etc.)
-            payload: Дополнительные данные заказа
-            status: Начальный статус
+        user_id = int(row["id"])
+        # Профиль неизвестен: следующий upsert_user всё равно сходит в БД.
+        self._users.set(tg_user_id, (user_id, None))
+        return user_id
 
-        Returns:
-            Order ID
-        """
-        row = await self.fetchrow(
-            """
-            INSERT INTO orders(user_id, direction, payload_json, status)
-            VALUES($1, $2, $3, $4)
-            RETURNING id
-            """,
-            user_id, direction, json.dumps(payload, ensure_ascii=False), status
-        )
-        order_id = int(row["id"])
-        logger.info(f"Created order {order_id} for user {user_id}, direction: {direction}")
-        return order_id
+    # ==================== Orders ====================
 
-    async def get_order(self, order_id: int) -> Optional[dict]:
+    async def get_order(self, order_id: int) -> Optional[Order]:
         """
         Получить данные заказа.
 
@@ -286,31 +877,36 @@ class Database:
             order_id: Order ID
 
         Returns:
-            Dict с данными заказа или None
+            Order (payload уже разобран) или None
         """
-        row = await self.fetchrow(
-            """
-            SELECT id, user_id, direction, payload_json, status, created_at
-            FROM orders
-            WHERE id=$1
-            """,
-            order_id
-        )
-        return dict(row) if row else None
-
-    async def set_order_status(self, order_id: int, status: str) -> None:
+        order = self._orders.get(order_id)
+        if order is not None:
+            return order
+        row = await self.fetchrow("orders.get", order_id)
+        if row is None:
+            return None
+        order = Order.from_record(row)
+        self._orders.set(order_id, order)
+        return order
+
+    async def get_order_owner(self, order_id: int) -> Optional[dict]:
         """
-        Обновить статус заказа.
+        Получить владельца заказа.
 
         Args:
             order_id: Order ID
-            status: Новый статус
+
+        Returns:
+            Dict с полями user_id, tg_user_id или None
         """
-        await self.execute(
-            "UPDATE orders SET status=$2 WHERE id=$1",
-            order_id, status
-        )
-        logger.info(f"Order {order_id} status changed to {status}")
+        owner = self._owners.get(order_id)
+        if owner is None:
+            row = await self.fetchrow("orders.owner", order_id, replica=True)
+            if row is None:
+                return None
+            owner = (row["user_id"], row["tg_user_id"])
+            self._owners.set(order_id, owner)
+        return {"user_id": owner[0], "tg_user_id": owner[1]}
 
     async def cancel_order(self, order_id: int) -> None:
         """
@@ -320,55 +916,135 @@ class Database:
             order_id: Order ID
         """
         result = await self.execute(
-            """
-            UPDATE orders
-            SET status=$2
-            WHERE id=$1 AND status IN ($3, $4)
-            """,
+            "orders.cancel",
             order_id,
             OrderStatus.CANCELLED,
             OrderStatus.DRAFT,
             OrderStatus.AWAITING_PAYMENT
         )
+        self._orders.invalidate(order_id)
         logger.info(f"Cancelled order {order_id}: {result}")
 
-    # ==================== Payments ====================
+    # ==================== Checkout ====================
 
-    async def create_payment(
+    async def open_checkout(
             self,
-            order_id: int,
+            user_id: int,
+            direction: str,
+            payload: dict,
             method: str,
             currency: str,
             amount: int
-    ) -> int:
+    ) -> dict:
         """
-        Создать новый платёж.
+        Атомарно создать заказ (awaiting_payment) и платёж к нему.
+
+        Оба INSERT и запись в open_payments выполняются одним CTE-запросом,
+        то есть в одной транзакции: заказ без платежа остаться не может. Если
+        у пользователя уже есть незавершённый платёж, ничего не создаётся и
+        возвращается контекст этого платежа (платёж по тому же direction в
+        приоритете).
 
         Args:
-            order_id: Order ID
+            user_id: Internal user ID
+            direction: Направление (yoga, english, etc.)
+            payload: Дополнительные данные заказа
             method: Метод оплаты (rub_card, pix, crypto)
             currency: Валюта (RUB, BRL, USDT)
             amount: Сумма в минимальных единицах
 
         Returns:
-            Payment ID
+            Dict с полями order_id, payment_id, payment_status, direction и
+            created (True если заказ создан, False если найден открытый платёж)
         """
-        row = await self.fetchrow(
-            """
-            INSERT INTO payments(order_id, method, currency, amount)
-            VALUES($1, $2, $3, $4)
-            RETURNING id
-            """,
-            order_id, method, currency, amount
-        )
-        payment_id = int(row["id"])
-        logger.info(
-            f"Created payment {payment_id} for order {order_id}: "
-            f"{amount} {currency} via {method}"
+        args = (
+            user_id,
+            direction,
+            payload,
+            OrderStatus.AWAITING_PAYMENT,
+            method,
+            currency,
+            amount
         )
-        return payment_id
+        try:
+            row = await self.fetchrow("checkout.open", *args)
+        except DatabaseError as e:
+            if not isinstance(e.__cause__, asyncpg.UniqueViolationError):
+                raise
+            # Параллельный checkout того же пользователя успел первым:
+            # повторный запрос найдёт его платёж в open_payments
+            logger.info(f"Concurrent checkout for user {user_id}, re-reading open payment")
+            row = await self.fetchrow("checkout.open", *args)
+        checkout = dict(row)
+        if checkout["created"]:
+            logger.info(
+                f"Opened checkout for user {user_id}: order {checkout['order_id']}, "
+                f"payment {checkout['payment_id']} ({amount} {currency} via {method}, "
+                f"direction: {direction})"
+            )
+        else:
+            logger.info(
+                f"Checkout rejected for user {user_id}: open payment "
+                f"{checkout['payment_id']} (order {checkout['order_id']}) already exists"
+            )
+        return checkout
+
+    async def reap_stale_checkouts(
+            self,
+            before: datetime,
+            batch_size: int = 500,
+            notify: bool = True
+    ) -> int:
+        """
+        Отменить брошенные оформления: заказы draft/awaiting_payment, созданные
+        до before, вместе с их pending-платежами.
+
+        Заказы с присланным чеком или с платежом, изменённым после before, не
+        трогаются. Каждая пачка — отдельная короткая транзакция; с notify в неё
+        же пишется по одному сообщению checkout.expired на пользователя.
 
-    async def get_payment(self, payment_id: int) -> Optional[dict]:
+        Args:
+            before: Граница по created_at заказа и updated_at его платежей
+            batch_size: Заказов на один запрос
+            notify: Поставить пользователям уведомление в outbox
+
+        Returns:
+            Число отменённых заказов
+        """
+        total = 0
+        while True:
+            async with self.transaction() as tx:
+                rows = await tx.fetch("checkout.reap_stale", before, batch_size)
+                if notify and rows:
+                    by_user: Dict[int, List[dict]] = {}
+                    for r in rows:
+                        by_user.setdefault(r["tg_user_id"], []).append(
+                            {"order_id": r["order_id"], "direction": r["direction"]}
+                        )
+                    await tx.execute(
+                        "outbox.enqueue_bulk",
+                        [OUTBOX_CHECKOUT_EXPIRED] * len(by_user),
+                        [{"tg_user_id": tg_user_id, "orders": orders}
+                         for tg_user_id, orders in by_user.items()],
+                        [f"{OUTBOX_CHECKOUT_EXPIRED}:{orders[0]['order_id']}"
+                         for orders in by_user.values()]
+                    )
+
+            for r in rows:
+                self._orders.invalidate(r["order_id"])
+                for payment_id in r["payment_ids"]:
+                    self._payments.invalidate(payment_id)
+            total += len(rows)
+            if len(rows) < batch_size:
+                break
+
+        if total:
+            logger.info(f"Cancelled {total} stale checkout(s) created before {before}")
+        return total
+
+    # ==================== Payments ====================
+
+    async def get_payment(self, payment_id: int) -> Optional[Payment]:
         """
         Получить данные платежа.
 
@@ -376,18 +1052,17 @@ class Database:
             payment_id: Payment ID
 
         Returns:
-            Dict с данными платежа или None
+            Payment или None
         """
-        row = await self.fetchrow(
-            """
-            SELECT id, order_id, method, currency, amount, status,
-                   proof_file_id, admin_id_approved, created_at, updated_at
-            FROM payments
-            WHERE id=$1
-            """,
-            payment_id
-        )
-        return dict(row) if row else None
+        payment = self._payments.get(payment_id)
+        if payment is not None:
+            return payment
+        row = await self.fetchrow("payments.get", payment_id)
+        if row is None:
+            return None
+        payment = Payment.from_record(row)
+        self._payments.set(payment_id, payment)
+        return payment
 
     async def update_payment_proof(self, payment_id: int, proof_file_id: str) -> None:
         """
@@ -398,33 +1073,12 @@ class Database:
             proof_file_id: Telegram file_id скриншота/чека
         """
         await self.execute(
-            """
-            UPDATE payments
-            SET status=$2, proof_file_id=$3, updated_at=NOW()
-            WHERE id=$1
-            """,
+            "payments.set_proof",
             payment_id, PaymentStatus.PROOF_SUBMITTED, proof_file_id
         )
+        self._payments.invalidate(payment_id)
         logger.info(f"Payment {payment_id} proof submitted")
 
-    async def approve_payment(self, payment_id: int, admin_id: int) -> None:
-        """
-        Одобрить платёж.
-
-        Args:
-            payment_id: Payment ID
-            admin_id: ID админа, одобрившего платёж
-        """
-        await self.execute(
-            """
-            UPDATE payments
-            SET status=$2, admin_id_approved=$3, updated_at=NOW()
-            WHERE id=$1
-            """,
-            payment_id, PaymentStatus.PAID, admin_id
-        )
-        logger.info(f"Payment {payment_id} approved by admin {admin_id}")
-
     async def reject_payment(self, payment_id: int, admin_id: int) -> None:
         """
         Отклонить платёж.
@@ -434,138 +1088,122 @@ class Database:
             admin_id: ID админа, отклонившего платёж
         """
         await self.execute(
-            """
-            UPDATE payments
-            SET status=$2, admin_id_approved=$3, updated_at=NOW()
-            WHERE id=$1
-            """,
+            "payments.resolve",
             payment_id, PaymentStatus.REJECTED, admin_id
         )
+        self._payments.invalidate(payment_id)
         logger.info(f"Payment {payment_id} rejected by admin {admin_id}")
 
-    async def cancel_pending_payments_for_order(self, order_id: int) -> None:
-        """
-        Отменить все незавершённые платежи для заказа.
-
-        Args:
-            order_id: Order ID
+    async def approve_and_fulfill(
+            self,
+            payment_id: int,
+            admin_id: int,
+            days: int
+    ) -> Optional[FulfillmentPlan]:
         """
-        result = await self.execute(
-            """
-            UPDATE payments
-            SET status=$2
-            WHERE order_id=$1 AND status IN ($3, $4)
-            """,
-            order_id,
-            PaymentStatus.CANCELLED,
-            PaymentStatus.PENDING,
-            PaymentStatus.PROOF_SUBMITTED
-        )
-        logger.info(f"Cancelled pending payments for order {order_id}: {result}")
+        Подтвердить платёж и выдать по нему подписку одной транзакцией.
 
-    async def pending_payment_exists_for_user(self, tg_user_id: int) -> bool:
-        """
-        Проверить, есть ли у пользователя незавершённые платежи.
+        В той же транзакции в outbox пишется сообщение payment.approved —
+        ссылки и уведомления доставит OutboxDispatcher после коммита.
+        Платёж и его пользователь блокируются до конца транзакции, поэтому
+        второй админ, нажавший "подтвердить" одновременно с первым, дождётся
+        его коммита и получит already_paid=True — подписка продлевается ровно
+        один раз. Отклонённый или отменённый платёж не одобряется: план
+        возвращается с closed_status. Для йоги 4/8 непросроченная подписка продлевается на days
+        дней от текущего срока, иначе создаётся новая от текущего момента.
 
         Args:
-            tg_user_id: Telegram user ID
+            payment_id: Payment ID
+            admin_id: ID админа, одобрившего платёж
+            days: Срок продления подписки на йогу в днях
 
         Returns:
-            True если есть pending/proof_submitted платежи
+            FulfillmentPlan или None, если платёж не найден
         """
-        row = await self.fetchrow(
-            """
-            SELECT 1
-            FROM payments p
-            JOIN orders o ON o.id = p.order_id
-            JOIN users u ON u.id = o.user_id
-            WHERE u.tg_user_id = $1
-              AND p.status IN ($2, $3)
-            LIMIT 1
-            """,
-            tg_user_id,
-            PaymentStatus.PENDING,
-            PaymentStatus.PROOF_SUBMITTED
-        )
-        return row is not None
+        now = datetime.now(timezone.utc)
+        async with self.transaction() as tx:
+            row = await tx.fetchrow("payments.lock_for_approval", payment_id)
+            if row is None:
+                return None
+            order = Order.from_record(row)
+            tg_user_id = row["tg_user_id"]
+            if row["payment_status"] == PaymentStatus.PAID:
+                return FulfillmentPlan(payment_id, order, tg_user_id, already_paid=True)
+            if row["payment_status"] not in APPROVABLE_PAYMENT_STATUSES:
+                # отклонён админом или отменён (сменой способа оплаты, отменой
+                # заказа, автоотменой) — устаревшая кнопка не должна выдавать подписку
+                logger.warning(
+                    f"Payment {payment_id} is {row['payment_status']}, approval by admin {admin_id} ignored"
+                )
+                return FulfillmentPlan(payment_id, order, tg_user_id, closed_status=row["payment_status"])
+
+            await tx.execute(
+                "payments.approve",
+                payment_id, admin_id, PaymentStatus.PAID, order.id, OrderStatus.PAID
+            )
+            order = replace(order, status=OrderStatus.PAID.value)
+
+            plan = order.yoga_plan if order.direction == D_YOGA else None
+            if plan is None:
+                result = FulfillmentPlan(payment_id, order, tg_user_id)
+            else:
+                new_product = f"yoga_{plan}"
+                cur = await tx.fetchrow("subscriptions.latest_unexpired", order.user_id)
+                extending = cur is not None and cur["expires_at"] > now
+                if extending:
+                    expires_at = cur["expires_at"] + timedelta(days=days)
+                    sub_id = cur["id"]
+                    await tx.execute("subscriptions.extend", sub_id, new_product, expires_at, payment_id)
+                else:
+                    expires_at = now + timedelta(days=days)
+                    created = await tx.fetchrow(
+                        "subscriptions.create",
+                        order.user_id, new_product, expires_at, payment_id, None
+                    )
+                    sub_id = created["id"]
+                result = FulfillmentPlan(
+                    payment_id, order, tg_user_id,
+                    plan=plan,
+                    old_product=cur["product"] if cur is not None else None,
+                    new_product=new_product,
+                    expires_at=expires_at,
+                    is_first_join=not extending,
+                    subscription_id=sub_id,
+                )
+
+            await tx.execute(
+                "outbox.enqueue",
+                OUTBOX_PAYMENT_APPROVED,
+                _fulfillment_payload(result),
+                f"{OUTBOX_PAYMENT_APPROVED}:{payment_id}"
+            )
 
+        self._payments.invalidate(payment_id)
+        self._orders.invalidate(order.id)
+        logger.info(
+            f"Payment {payment_id} approved by admin {admin_id}, order {order.id} paid"
+            + (f", subscription {result.subscription_id} until {result.expires_at}"
+               if result.subscription_id is not None else "")
+        )
+        return result
 
-    async def get_pending_payment_context_for_user(
-            self,
-            tg_user_id: int,
-            direction: Optional[str] = None
-    ) -> Optional[dict]:
+    async def cancel_pending_payments_for_order(self, order_id: int) -> None:
         """
-        Получить контекст незавершённого платежа пользователя (конкретный order + payment).
-
-        Возвращает самый свежий платеж со статусом pending/proof_submitted вместе с order_id.
-        Если передан direction, фильтрует по нему.
+        Отменить все незавершённые платежи для заказа.
 
         Args:
-            tg_user_id: Telegram user ID
-            direction: направление (опционально)
-
-        Returns:
-            Dict с полями order_id, payment_id, payment_status, method, currency, amount, direction или None
-        """
-        if direction:
-            row = await self.fetchrow(
-                """
-                SELECT
-                    o.id AS order_id,
-                    o.direction AS direction,
-                    p.id AS payment_id,
-                    p.status AS payment_status,
-                    p.method AS method,
-                    p.currency AS currency,
-                    p.amount AS amount,
-                    p.proof_file_id AS proof_file_id,
-                    p.created_at AS payment_created_at,
-                    p.updated_at AS payment_updated_at
-                FROM payments p
-                JOIN orders o ON o.id = p.order_id
-                JOIN users u ON u.id = o.user_id
-                WHERE u.tg_user_id = $1
-                  AND o.direction = $2
-                  AND p.status IN ($3, $4)
-                ORDER BY p.created_at DESC, p.id DESC
-                LIMIT 1
-                """,
-                tg_user_id,
-                direction,
-                PaymentStatus.PENDING,
-                PaymentStatus.PROOF_SUBMITTED
-            )
-        else:
-            row = await self.fetchrow(
-                """
-                SELECT
-                    o.id AS order_id,
-                    o.direction AS direction,
-                    p.id AS payment_id,
-                    p.status AS payment_status,
-                    p.method AS method,
-                    p.currency AS currency,
-                    p.amount AS amount,
-                    p.proof_file_id AS proof_file_id,
-                    p.created_at AS payment_created_at,
-                    p.updated_at AS payment_updated_at
-                FROM payments p
-                JOIN orders o ON o.id = p.order_id
-                JOIN users u ON u.id = o.user_id
-                WHERE u.tg_user_id = $1
-                  AND p.status IN ($2, $3)
-                ORDER BY p.created_at DESC, p.id DESC
-                LIMIT 1
-                """,
-                tg_user_id,
-                PaymentStatus.PENDING,
-                PaymentStatus.PROOF_SUBMITTED
-            )
-
-        return dict(row) if row else None
+            order_id: Order ID
+        """
+        rows = await self.fetch(
+            "payments.cancel_open_for_order",
+            order_id,
+            PaymentStatus.CANCELLED
+        )
+        for row in rows:
+            self._payments.invalidate(row["id"])
+        logger.info(f"Cancelled {len(rows)} pending payment(s) for order {order_id}")
 
-    async def get_pending_payment_for_order(self, order_id: int) -> Optional[dict]:
+    async def get_pending_payment_for_order(self, order_id: int) -> Optional[Payment]:
         """
         Получить самый свежий незавершённый платеж для конкретного заказа.
 
@@ -573,23 +1211,14 @@ class Database:
             order_id: Order ID
 
         Returns:
-            Dict с данными платежа или None
+            Payment или None
         """
         row = await self.fetchrow(
-            """
-            SELECT id, order_id, method, currency, amount, status,
-                   proof_file_id, admin_id_approved, created_at, updated_at
-            FROM payments
-            WHERE order_id = $1
-              AND status IN ($2, $3)
-            ORDER BY created_at DESC, id DESC
-            LIMIT 1
-            """,
+            "payments.open_for_order",
             order_id,
-            PaymentStatus.PENDING,
-            PaymentStatus.PROOF_SUBMITTED
+            replica=True
         )
-        return dict(row) if row else None
+        return Payment.from_record(row) if row else None
 
 
     # ==================== Subscriptions ====================
@@ -616,11 +1245,7 @@ class Database:
             Subscription ID
         """
         row = await self.fetchrow(
-            """
-            INSERT INTO subscriptions(user_id, product, expires_at, last_payment_id, channel_id)
-            VALUES($1, $2, $3, $4, $5)
-            RETURNING id
-            """,
+            "subscriptions.create",
             user_id, product, expires_at, last_payment_id, channel_id
         )
         sub_id = int(row["id"])
@@ -630,7 +1255,7 @@ class Database:
         )
         return sub_id
 
-    async def get_active_yoga_subscription(self, user_id: int) -> Optional[dict]:
+    async def get_active_yoga_subscription(self, user_id: int) -> Optional[Subscription]:
         """
         Получить активную подписку на йогу.
 
@@ -640,23 +1265,14 @@ class Database:
             user_id: Internal user ID
 
         Returns:
-            Dict с данными подписки или None
+            Subscription или None
         """
         row = await self.fetchrow(
-            """
-            SELECT id, user_id, product, expires_at, last_payment_id, channel_id, status
-            FROM subscriptions
-            WHERE user_id = $1
-              AND product LIKE 'yoga_%'
-              AND status = $2
-              AND (expires_at IS NULL OR expires_at > NOW())
-            ORDER BY expires_at DESC NULLS FIRST, id DESC
-            LIMIT 1
-            """,
+            "subscriptions.active_yoga",
             user_id,
-            SubscriptionStatus.ACTIVE
+            replica=True
         )
-        return dict(row) if row else None
+        return Subscription.from_record(row) if row else None
 
     async def upsert_yoga_subscription(
             self,
@@ -681,12 +1297,7 @@ class Database:
         """
         # Пытаемся найти существующую подписку
         existing = await self.fetchrow(
-            """
-            SELECT id FROM subscriptions
-            WHERE user_id = $1 AND product LIKE 'yoga_%'
-            ORDER BY id DESC
-            LIMIT 1
-            """,
+            "subscriptions.latest_yoga_id",
             user_id
         )
 
@@ -694,12 +1305,7 @@ class Database:
             # Обновляем существующую
             sub_id = int(existing["id"])
             await self.execute(
-                """
-                UPDATE subscriptions
-                SET product = $2, expires_at = $3, last_payment_id = $4,
-                    channel_id = $5, status = $6
-                WHERE id = $1
-                """,
+                "subscriptions.update_yoga",
                 sub_id, product, expires_at, last_payment_id, channel_id,
                 SubscriptionStatus.ACTIVE
             )
@@ -722,30 +1328,41 @@ class Database:
             True если у пользователя ещё не было йога-подписок
         """
         row = await self.fetchrow(
-            "SELECT 1 FROM subscriptions WHERE user_id=$1 AND product LIKE 'yoga_%' LIMIT 1",
+            "subscriptions.any_yoga",
             user_id
         )
         return row is None
 
-    async def expire_subscriptions_due(self) -> List[dict]:
+    async def iter_subscriptions_due(
+            self,
+            batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> AsyncIterator[List[Subscription]]:
         """
-        Получить список подписок, которые истекли.
+        Постранично обойти истекшие активные подписки.
 
-        Returns:
-            List of dicts с данными истекших подписок
-        """
-        rows = await self.fetch(
-            """
-            SELECT s.id, s.user_id, u.tg_user_id, s.product
-            FROM subscriptions s
-            JOIN users u ON u.id = s.user_id
-            WHERE s.status = $1 AND s.expires_at <= NOW()
-            """,
-            SubscriptionStatus.ACTIVE
-        )
-        return [dict(r) for r in rows]
+        Keyset-пагинация по (expires_at, id): каждая страница — отдельный
+        короткий запрос, соединение между страницами не удерживается. Граница
+        "истекла" фиксируется в момент начала обхода, поэтому обход конечен,
+        даже если потребитель тем временем меняет статусы подписок.
+
+        Args:
+            batch_size: Максимальный размер страницы
 
-    async def get_expired_yoga_subscriptions(self, now: datetime) -> List[asyncpg.Record]:
+        Yields:
+            List[Subscription] (id, user_id, tg_user_id, product, expires_at)
+        """
+        now = datetime.now(timezone.utc)
+        cursor: Tuple[datetime, int] = (_KEYSET_START, 0)
+        while True:
+            rows = await self.fetch("subscriptions.due_page", now, *cursor, batch_size)
+            if not rows:
+                return
+            yield [Subscription.from_record(r) for r in rows]
+            if len(rows) < batch_size:
+                return
+            cursor = (rows[-1]["expires_at"], rows[-1]["id"])
+
+    async def get_expired_yoga_subscriptions(self, now: datetime) -> List[Subscription]:
         """
         Получить йога-подписки, истекшие к указанной дате.
 
@@ -753,35 +1370,69 @@ class Database:
             now: Дата для сравнения
 
         Returns:
-            List of records с данными подписок
-        """
-        return await self.fetch(
-            """
-            SELECT s.id, s.channel_id, u.tg_user_id
-            FROM subscriptions s
-            JOIN users u ON u.id = s.user_id
-            WHERE s.product LIKE 'yoga_%'
-              AND s.expires_at <= $1
-              AND s.status = $2
-              AND s.channel_id IS NOT NULL
-            """,
-            now,
-            SubscriptionStatus.ACTIVE
+            List[Subscription] (id, channel_id, tg_user_id)
+        """
+        rows = await self.fetch(
+            "subscriptions.expired_yoga_with_channel",
+            now
         )
+        return [Subscription.from_record(r) for r in rows]
 
-    async def mark_subscription_expired(self, sub_id: int) -> None:
+    async def expire_and_revoke_bulk(
+            self,
+            sub_ids: List[int],
+            channel_keys: Mapping[str, str]
+    ) -> List[Subscription]:
         """
-        Пометить подписку как истекшую.
+        Истечь подписки, отозвать доступ и поставить уведомления в outbox
+        одной транзакцией.
+
+        Для каждой реально истекшей подписки пишется сообщение
+        subscription.expired (удаление из канала и уведомления); повторный
+        прогон свипера по тем же подпискам ничего не дублирует.
 
         Args:
-            sub_id: Subscription ID
+            sub_ids: Subscription IDs
+            channel_keys: Продукт -> ключ канала в channel_access_log
+
+        Returns:
+            List[Subscription] (id, user_id, tg_user_id, product, expires_at)
+            реально истекших подписок
         """
-        await self.execute(
-            "UPDATE subscriptions SET status=$2 WHERE id=$1",
-            sub_id,
-            SubscriptionStatus.EXPIRED
+        if not sub_ids:
+            return []
+        async with self.transaction() as tx:
+            rows = await tx.fetch("subscriptions.expire_bulk", list(sub_ids))
+            expired = [Subscription.from_record(r) for r in rows]
+
+            revokes = [(sub.user_id, channel_keys[sub.product])
+                       for sub in expired if sub.product in channel_keys]
+            if revokes:
+                await tx.execute(
+                    "channel_access.revoke_bulk",
+                    [user_id for user_id, _ in revokes],
+                    [key for _, key in revokes]
+                )
+
+            if expired:
+                await tx.execute(
+                    "outbox.enqueue_bulk",
+                    [OUTBOX_SUBSCRIPTION_EXPIRED] * len(expired),
+                    [{
+                        "sub_id": sub.id,
+                        "user_id": sub.user_id,
+                        "tg_user_id": sub.tg_user_id,
+                        "product": sub.product,
+                        "expires_at": _isoformat(sub.expires_at),
+                    } for sub in expired],
+                    [f"{OUTBOX_SUBSCRIPTION_EXPIRED}:{sub.id}" for sub in expired]
+                )
+
+        logger.info(
+            f"Expired {len(expired)} of {len(sub_ids)} subscriptions, "
+            f"revoked {len(revokes)} channel accesses"
         )
-        logger.info(f"Subscription {sub_id} marked as expired")
+        return expired
 
     # ==================== Channel Access ====================
 
@@ -800,39 +1451,18 @@ class Database:
             invite_link: Invite link (опционально)
         """
         await self.execute(
-            """
-            INSERT INTO channel_access_log(user_id, channel_key, invite_link)
-            VALUES($1, $2, $3)
-            """,
+            "channel_access.grant",
             user_id, channel_key, invite_link
         )
         logger.info(f"Logged channel access for user {user_id}, channel: {channel_key}")
 
-    async def log_channel_revoke(self, user_id: int, channel_key: str) -> None:
-        """
-        Залогировать отзыв доступа к каналу.
-
-        Args:
-            user_id: Internal user ID
-            channel_key: Ключ канала
-        """
-        await self.execute(
-            """
-            UPDATE channel_access_log
-            SET revoked_at = NOW()
-            WHERE user_id = $1 AND channel_key = $2 AND revoked_at IS NULL
-            """,
-            user_id, channel_key
-        )
-        logger.info(f"Logged channel revoke for user {user_id}, channel: {channel_key}")
-
     # ==================== Yoga Feedback ====================
 
     async def get_subscriptions_expiring_between(
             self,
             start: datetime,
             end: datetime
-    ) -> List[asyncpg.Record]:
+    ) -> List[Subscription]:
         """
         Получить подписки на йогу, истекающие в заданном временном окне.
 
@@ -841,23 +1471,46 @@ class Database:
             end: Конец временного окна
 
         Returns:
-            List of records с подписками
-        """
-        return await self.fetch(
-            """
-            SELECT s.id, s.user_id, s.product, s.expires_at, s.feedback_sent_at,
-                   u.tg_user_id
-            FROM subscriptions s
-            JOIN users u ON u.id = s.user_id
-            WHERE s.product LIKE 'yoga_%'
-              AND s.status = $1
-              AND s.expires_at BETWEEN $2 AND $3
-            ORDER BY s.expires_at ASC
-            """,
-            SubscriptionStatus.ACTIVE,
+            List[Subscription] с подписками
+        """
+        rows = await self.fetch(
+            "subscriptions.expiring_between",
             start,
-            end
+            end,
+            replica=True
         )
+        return [Subscription.from_record(r) for r in rows]
+
+    async def iter_subscriptions_expiring_between(
+            self,
+            start: datetime,
+            end: datetime,
+            batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> AsyncIterator[List[Subscription]]:
+        """
+        Постранично обойти йога-подписки, истекающие в заданном окне.
+
+        Keyset-пагинация по (expires_at, id), начиная с курсора (start, 0).
+
+        Args:
+            start: Начало временного окна
+            end: Конец временного окна
+            batch_size: Максимальный размер страницы
+
+        Yields:
+            List[Subscription] (как get_subscriptions_expiring_between)
+        """
+        cursor: Tuple[datetime, int] = (start, 0)
+        while True:
+            rows = await self.fetch(
+                "subscriptions.expiring_between_page", *cursor, end, batch_size, replica=True
+            )
+            if not rows:
+                return
+            yield [Subscription.from_record(r) for r in rows]
+            if len(rows) < batch_size:
+                return
+            cursor = (rows[-1]["expires_at"], rows[-1]["id"])
 
     async def mark_feedback_sent(self, sub_id: int) -> None:
         """
@@ -867,12 +1520,12 @@ class Database:
             sub_id: Subscription ID
         """
         await self.execute(
-            "UPDATE subscriptions SET feedback_sent_at = NOW() WHERE id = $1",
+            "subscriptions.mark_feedback_sent",
             sub_id
         )
         logger.info(f"Marked feedback sent for subscription {sub_id}")
 
-    async def get_subscription_feedback_status(self, sub_id: int) -> Optional[dict]:
+    async def get_subscription_feedback_status(self, sub_id: int) -> Optional[Subscription]:
         """
         Получить статус отправки feedback для подписки.
 
@@ -880,10 +1533,216 @@ class Database:
             sub_id: Subscription ID
 
         Returns:
-            Dict с полями feedback_sent_at или None
+            Subscription (id, feedback_sent_at) или None
         """
         row = await self.fetchrow(
-            "SELECT id, feedback_sent_at FROM subscriptions WHERE id = $1",
-            sub_id
+            "subscriptions.feedback_status",
+            sub_id,
+            replica=True
+        )
+        return Subscription.from_record(row) if row else None
+    # ==================== Archive ====================
+
+    async def archive_closed_orders(self, before: datetime, batch_size: int = 1000) -> Tuple[int, int]:
+        """
+        Перенести в archive отменённые заказы и закрытые платежи старше before.
+
+        Сначала отменённые заказы вместе с их платежами, затем оставшиеся
+        cancelled/rejected платежи. Каждая пачка — отдельная короткая
+        транзакция, чтобы не держать блокировки на горячих таблицах.
+
+        Args:
+            before: Граница по created_at заказа / updated_at платежа
+            batch_size: Строк на один запрос
+
+        Returns:
+            (перенесено заказов, перенесено отдельных платежей)
+        """
+        orders = 0
+        while True:
+            moved = _affected(await self.execute("archive.orders", before, batch_size))
+            orders += moved
+            if moved < batch_size:
+                break
+
+        payments = 0
+        while True:
+            moved = _affected(await self.execute("archive.payments", before, batch_size))
+            payments += moved
+            if moved < batch_size:
+                break
+
+        if orders or payments:
+            # в кэше могли остаться перенесённые записи
+            self._orders.clear()
+            self._payments.clear()
+        logger.info(f"Archived {orders} cancelled orders and {payments} closed payments older than {before}")
+        return orders, payments
+
+    async def ensure_partitions(self, months_ahead: int) -> int:
+        """
+        Создать недостающие месячные партиции channel_access_log.
+
+        Returns:
+            Число созданных партиций
+        """
+        row = await self.fetchrow("archive.ensure_partitions", months_ahead)
+        created = int(row["created"])
+        if created:
+            logger.info(f"Created {created} channel_access_log partition(s)")
+        return created
+
+    async def detach_old_partitions(self, keep_months: int) -> int:
+        """
+        Отсоединить в схему archive партиции channel_access_log старше
+        keep_months месяцев, в которых не осталось неотозванных доступов.
+
+        Returns:
+            Число отсоединённых партиций
+        """
+        row = await self.fetchrow("archive.detach_partitions", keep_months)
+        archived = int(row["archived"])
+        if archived:
+            logger.info(f"Moved {archived} channel_access_log partition(s) to archive")
+        return archived
+
+    # ==================== FSM Storage ====================
+
+    async def purge_fsm_storage(self, ttl_seconds: float, batch_size: int = 1000) -> int:
+        """
+        Удалить состояния FSM без изменений дольше ttl_seconds.
+
+        Args:
+            ttl_seconds: TTL состояния (FsmStorageSettings.ttl_seconds)
+            batch_size: Строк на один запрос
+
+        Returns:
+            Число удалённых состояний
+        """
+        deleted = 0
+        while True:
+            removed = _affected(await self.execute("fsm.purge", ttl_seconds, batch_size))
+            deleted += removed
+            if removed < batch_size:
+                break
+        if deleted:
+            logger.info(f"Purged {deleted} expired FSM state(s)")
+        return deleted
+
+    # ==================== Stats ====================
+
+    async def refresh_daily_stats(self, tz: str, overlap_seconds: float = 600.0) -> int:
+        """
+        Пересчитать дневные агрегаты за дни, изменившиеся с прошлого запуска.
+
+        Args:
+            tz: Часовой пояс, в котором считаются дни
+            overlap_seconds: Насколько заходить назад от прошлого запуска,
+                чтобы учесть транзакции, закоммиченные после него
+
+        Returns:
+            Число пересчитанных дней
+        """
+        row = await self.fetchrow("stats.refresh", tz, overlap_seconds)
+        days = int(row["days"])
+        if days:
+            logger.info(f"Refreshed daily stats for {days} day(s)")
+        return days
+
+    async def stats_report(self, since: date, until: date) -> StatsReport:
+        """
+        Итоги по дневным агрегатам (можно с реплики).
+
+        Args:
+            since: Первый день периода
+            until: День после последнего дня периода
+
+        Returns:
+            StatsReport
+        """
+        state = await self.fetchrow("stats.state", replica=True)
+        revenue = await self.fetch("stats.revenue", since, until, replica=True)
+        subscriptions = await self.fetch("stats.subscriptions", since, until, replica=True)
+        proofs = await self.fetchrow("stats.proofs", since, until, replica=True)
+        return StatsReport(
+            since=since,
+            until=until,
+            tz=state["tz"] if state else None,
+            refreshed_at=state["refreshed_at"] if state else None,
+            revenue=[RevenueTotal.from_record(r) for r in revenue],
+            subscriptions=[SubscriptionTotals.from_record(r) for r in subscriptions],
+            proofs=ProofTotals.from_record(proofs),
         )
-        return dict(row) if row else None
\ No newline at end of file
+
+    # ==================== Outbox ====================
+
+    async def claim_outbox(self, limit: int, lease_seconds: float) -> List[OutboxMessage]:
+        """
+        Забрать пачку готовых к доставке сообщений outbox.
+
+        Сообщения закрепляются за вызывающим на lease_seconds: если за это
+        время их не отметить доставленными или отложенными, их заберёт
+        следующий claim.
+
+        Args:
+            limit: Максимум сообщений
+            lease_seconds: Время аренды
+
+        Returns:
+            List[OutboxMessage] (attempts уже учитывает текущую попытку)
+        """
+        rows = await self.fetch("outbox.claim", limit, float(lease_seconds))
+        return [OutboxMessage.from_record(r) for r in rows]
+
+    async def renew_outbox_lease(self, message_id: int, attempts: int, lease_seconds: float) -> bool:
+        """
+        Продлить аренду сообщения outbox перед его доставкой.
+
+        Args:
+            message_id: ID сообщения
+            attempts: attempts из claim_outbox (метка аренды)
+            lease_seconds: Новое время аренды, от текущего момента
+
+        Returns:
+            False, если аренда уже потеряна: сообщение забрал другой воркер
+            или его статус изменился
+        """
+        status = await self.execute("outbox.renew", message_id, attempts, float(lease_seconds))
+        return _affected(status) == 1
+
+    async def complete_outbox_step(self, message_id: int, step: str) -> None:
+        """Отметить шаг обработчика сообщения outbox выполненным."""
+        await self.execute("outbox.step_done", message_id, step)
+
+    async def complete_outbox(self, message_id: int, attempts: int) -> bool:
+        """
+        Отметить сообщение outbox доставленным.
+
+        Args:
+            message_id: ID сообщения
+            attempts: attempts из claim_outbox (метка аренды)
+
+        Returns:
+            False, если аренда потеряна и отметка не записана
+        """
+        return _affected(await self.execute("outbox.done", message_id, attempts)) == 1
+
+    async def retry_outbox(self, message_id: int, attempts: int, delay: float, error: str) -> bool:
+        """Отложить повтор доставки на delay секунд; False, если аренда потеряна."""
+        status = await self.execute("outbox.retry", message_id, attempts, float(delay), error)
+        return _affected(status) == 1
+
+    async def bury_outbox(self, message_id: int, attempts: int, error: str) -> bool:
+        """Прекратить попытки доставки (status=dead); False, если аренда потеряна."""
+        return _affected(await self.execute("outbox.dead", message_id, attempts, error)) == 1
+
+    async def purge_outbox(self, before: datetime) -> int:
+        """
+        Удалить доставленные и dead сообщения, обработанные раньше before.
+
+        Returns:
+            Число удалённых сообщений
+        """
+        deleted = _affected(await self.execute("outbox.purge", before))
+        logger.info(f"Purged {deleted} outbox messages processed before {before}")
+        return deleted
@@ -1,15 +1,14 @@
 from __future__ import annotations
-from aiogram import Router
 from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 
 from bot.states.states import AstroFlow
 from bot.keyboards.keyboards import astrology_spheres_kb, astrology_format_kb, payment_method_kb
 from bot.constants import D_ASTRO
+from bot.handlers.dispatch import callbacks
 
-router = Router()
 
-@router.callback_query(lambda c: c.data == "dir:astrology")
+@callbacks.on("dir", "astrology", arity=1)
 async def astro_start(call: CallbackQuery, state: FSMContext):
     await state.clear()
     await state.update_data(direction=D_ASTRO)
@@ -17,7 +16,7 @@ async def astro_start(call: CallbackQuery, state: FSMContext):
     await call.message.edit_text("Выбери сферу:", reply_markup=astrology_spheres_kb())
     await call.answer()
 
-@router.callback_query(AstroFlow.sphere, lambda c: c.data.startswith("as_sphere:"))
+@callbacks.on("as_sphere", state=AstroFlow.sphere)
 async def astro_sphere(call: CallbackQuery, state: FSMContext, cfg):
     sphere = call.data.split(":",1)[1]
     await state.update_data(sphere=sphere)
@@ -25,7 +24,7 @@ async def astro_sphere(call: CallbackQuery, state: FSMContext, cfg):
     await call.message.edit_text("Выбери формат:", reply_markup=astrology_format_kb(cfg))
     await call.answer()
 
-@router.callback_query(AstroFlow.fmt, lambda c: c.data.startswith("as_fmt:"))
+@callbacks.on("as_fmt", state=AstroFlow.fmt)
 async def astro_format(call: CallbackQuery, state: FSMContext, cfg):
     fmt = call.data.split(":",1)[1]
     if fmt == "one":
@@ -0,0 +1,199 @@
+"""
+Диспетчеризация callback-кнопок по пространству имён и сообщений по состоянию FSM.
+
+callback_data кнопок бота имеет вид "<namespace>:<arg>:<arg>..." ("pay_m:lang:pix",
+"adm_ok:42", "menu"). Вместо цепочки фильтров lambda c: c.data.startswith(...),
+которые aiogram проверяет по очереди в каждом роутере, callback_data
+разбирается один раз и обработчик ищется в словаре:
+
+    @callbacks.on("pay_m")                          # любой pay_m:...
+    @callbacks.on("menu", arity=0)                  # ровно "menu"
+    @callbacks.on("dir", "english", "chinese", arity=1)  # ровно dir:english и dir:chinese
+    @callbacks.on("y_plan", state=YogaFlow.plan)    # только в состоянии YogaFlow.plan
+
+Обработчики получают те же аргументы, что и обычные обработчики aiogram
+(call, state, db, cfg, bot...), плюс callback_args — аргументы после
+namespace. Кнопки без обработчика проходят дальше по роутерам aiogram.
+
+Сообщения, которые ждут только в определённом состоянии (ответ на
+знакомство, фото чека), регистрируются в messages по состояниям:
+
+    @messages.on(YogaFlow.wait_intro, when=lambda m: m.text is not None)
+
+Состояние читает FSMContextMiddleware один раз на апдейт; сообщение в
+состоянии без обработчиков не доходит ни до одного из них.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.fsm.state import State
+from aiogram.types import CallbackQuery, Message
+
+CallbackArgs = Tuple[str, ...]
+
+
+def parse_callback_data(data: Optional[str]) -> Tuple[str, CallbackArgs]:
+    """ "pay_m:lang:pix" -> ("pay_m", ("lang", "pix")); "menu" -> ("menu", ())."""
+    if not data:
+        return "", ()
+    namespace, *args = data.split(":")
+    return namespace, tuple(args)
+
+
+@dataclass(frozen=True)
+class _Route:
+    handler: CallableObject
+    # None — в любом состоянии
+    state: Optional[str]
+    # сколько аргументов после namespace (None — сколько угодно)
+    arity: Optional[int] = None
+
+    def accepts(self, raw_state: Optional[str], args: CallbackArgs) -> bool:
+        return (self.state is None or self.state == raw_state) and (
+            self.arity is None or self.arity == len(args)
+        )
+
+
+class CallbackRouter(Router):
+    """
+    Роутер aiogram с одним обработчиком callback_query, который выбирает
+    обработчик по (namespace, первый аргумент) или по namespace.
+    """
+
+    def __init__(self, *, name: Optional[str] = None):
+        super().__init__(name=name)
+        # (namespace, первый аргумент или None) -> маршруты; несколько — только
+        # для разных состояний FSM
+        self._routes: Dict[Tuple[str, Optional[str]], List[_Route]] = {}
+        self.callback_query.register(self._dispatch, self._match)
+
+    def on(
+            self,
+            namespace: str,
+            *first_args: str,
+            state: Optional[State] = None,
+            arity: Optional[int] = None
+    ) -> Callable:
+        """
+        Зарегистрировать обработчик кнопок с данным namespace.
+
+        Args:
+            namespace: Часть callback_data до первого ":"
+            first_args: Значения первого аргумента, для которых вызывать
+                обработчик (пусто — для любого)
+            state: Состояние FSM, в котором кнопка действует (None — в любом)
+            arity: Точное число аргументов после namespace; кнопки с другим
+                числом не доходят до обработчика (None — любое)
+        """
+        if arity is not None and first_args and arity < 1:
+            raise ValueError("arity must count the first argument")
+
+        def decorator(callback: Callable) -> Callable:
+            route = _Route(CallableObject(callback), state.state if state is not None else None, arity)
+            for first in first_args or (None,):
+                routes = self._routes.setdefault((namespace, first), [])
+                if any(r.state == route.state and r.arity == route.arity for r in routes):
+                    raise ValueError(
+                        f"Callback {namespace}:{first or '*'} already has a handler"
+                        + (f" for state {route.state}" if route.state else "")
+                    )
+                # маршруты с состоянием проверяются раньше маршрута без состояния
+                routes.append(route)
+                routes.sort(key=lambda r: r.state is None)
+            return callback
+        return decorator
+
+    def resolve(self, data: Optional[str], raw_state: Optional[str]) -> Optional[Tuple[_Route, CallbackArgs]]:
+        """
+        Найти маршрут для callback_data в текущем состоянии FSM.
+
+        Returns:
+            (маршрут, аргументы после namespace) или None
+        """
+        namespace, args = parse_callback_data(data)
+        candidates = (self._routes.get((namespace, args[0])) if args else None) or ()
+        for routes in (candidates, self._routes.get((namespace, None), ())):
+            for route in routes:
+                if route.accepts(raw_state, args):
+                    return route, args
+        return None
+
+    async def _match(self, call: CallbackQuery, raw_state: Optional[str] = None) -> Any:
+        # raw_state уже прочитан FSMContextMiddleware: отдельного запроса к хранилищу нет
+        found = self.resolve(call.data, raw_state)
+        if found is None:
+            return False
+        route, args = found
+        return {"callback_route": route, "callback_args": args}
+
+    @staticmethod
+    async def _dispatch(call: CallbackQuery, callback_route: _Route, **kwargs: Any) -> Any:
+        return await callback_route.handler.call(call, **kwargs)
+
+
+@dataclass(frozen=True)
+class _MessageRoute:
+    handler: CallableObject
+    # дополнительное условие на сообщение (например, только текст)
+    when: Optional[Callable[[Message], bool]]
+
+
+class StateRouter(Router):
+    """
+    Роутер aiogram с одним обработчиком message, который выбирает обработчик
+    по текущему состоянию FSM.
+    """
+
+    def __init__(self, *, name: Optional[str] = None):
+        super().__init__(name=name)
+        # состояние -> маршруты в порядке регистрации
+        self._routes: Dict[str, List[_MessageRoute]] = {}
+        self.message.register(self._dispatch, self._match)
+
+    def on(self, *states: Union[State, str], when: Optional[Callable[[Message], bool]] = None) -> Callable:
+        """
+        Зарегистрировать обработчик сообщений в данных состояниях.
+
+        Args:
+            states: Состояния FSM (State или строка "Group:name")
+            when: Условие на сообщение; если не выполнено, проверяется
+                следующий обработчик этого состояния
+        """
+        if not states:
+            raise ValueError("At least one state is required")
+
+        def decorator(callback: Callable) -> Callable:
+            route = _MessageRoute(CallableObject(callback), when)
+            for state in states:
+                key = state.state if isinstance(state, State) else state
+                self._routes.setdefault(key, []).append(route)
+            return callback
+        return decorator
+
+    def resolve(self, message: Message, raw_state: Optional[str]) -> Optional[_MessageRoute]:
+        """Найти обработчик сообщения в состоянии raw_state."""
+        if raw_state is None:
+            return None
+        for route in self._routes.get(raw_state, ()):
+            if route.when is None or route.when(message):
+                return route
+        return None
+
+    async def _match(self, message: Message, raw_state: Optional[str] = None) -> Any:
+        route = self.resolve(message, raw_state)
+        if route is None:
+            return False
+        return {"message_route": route}
+
+    @staticmethod
+    async def _dispatch(message: Message, message_route: _MessageRoute, **kwargs: Any) -> Any:
+        return await message_route.handler.call(message, **kwargs)
+
+
+# Общие для всех модулей handlers: один поиск по словарю на кнопку или сообщение
+callbacks = CallbackRouter(name="callbacks")
+messages = StateRouter(name="messages")
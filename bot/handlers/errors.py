@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+import logging
+
+from aiogram import Router
+from aiogram.filters import ExceptionTypeFilter
+from aiogram.types import ErrorEvent
+
+from bot.db import PoolSaturatedError
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+
+@router.errors(ExceptionTypeFilter(PoolSaturatedError))
+async def pool_saturated(event: ErrorEvent):
+    """Пул БД перегружен: быстро отвечаем пользователю вместо зависшего хэндлера."""
+    update = event.update
+    text = PoolSaturatedError.user_message
+    logger.warning(f"Update {update.update_id} dropped: database pool saturated")
+    try:
+        if update.callback_query:
+            await update.callback_query.answer(text, show_alert=True)
+        elif update.message:
+            await update.message.answer(text)
+    except Exception as e:
+        logger.error(f"Failed to send pool saturation notice: {e}")
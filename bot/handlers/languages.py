@@ -1,18 +1,17 @@
 from __future__ import annotations
-from aiogram import Router
 from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 
 from bot.states.states import LangFlow
 from bot.keyboards.keyboards import lang_goal_kb, lang_level_kb, lang_freq_kb, lang_product_kb, payment_method_kb
 from bot.constants import D_ENGLISH, D_CHINESE
+from bot.handlers.dispatch import callbacks
 
-router = Router()
 
 def _dir_title(direction: str) -> str:
     return "Английский" if direction == D_ENGLISH else "Китайский"
 
-@router.callback_query(lambda c: c.data in ("dir:english","dir:chinese"))
+@callbacks.on("dir", "english", "chinese", arity=1)
 async def choose_language_dir(call: CallbackQuery, state: FSMContext):
     direction = call.data.split(":",1)[1]
     await state.clear()
@@ -21,7 +20,7 @@ async def choose_language_dir(call: CallbackQuery, state: FSMContext):
     await call.message.edit_text(f"Выбрано: *{_dir_title(direction)}*\n\nВыбери цель:", reply_markup=lang_goal_kb())
     await call.answer()
 
-@router.callback_query(LangFlow.goal, lambda c: c.data.startswith("lg_goal:"))
+@callbacks.on("lg_goal", state=LangFlow.goal)
 async def lang_goal(call: CallbackQuery, state: FSMContext):
     goal = call.data.split(":",1)[1]
     await state.update_data(goal=goal)
@@ -29,7 +28,7 @@ async def lang_goal(call: CallbackQuery, state: FSMContext):
     await call.message.edit_text("Уровень:", reply_markup=lang_level_kb())
     await call.answer()
 
-@router.callback_query(LangFlow.level, lambda c: c.data.startswith("lg_level:"))
+@callbacks.on("lg_level", state=LangFlow.level)
 async def lang_level(call: CallbackQuery, state: FSMContext):
     level = call.data.split(":",1)[1]
     await state.update_data(level=level)
@@ -37,7 +36,7 @@ async def lang_level(call: CallbackQuery, state: FSMContext):
     await call.message.edit_text("Частота занятий:", reply_markup=lang_freq_kb())
     await call.answer()
 
-@router.callback_query(LangFlow.freq, lambda c: c.data.startswith("lg_freq:"))
+@callbacks.on("lg_freq", state=LangFlow.freq)
 async def lang_freq(call: CallbackQuery, state: FSMContext, cfg):
     freq = call.data.split(":",1)[1]
     await state.update_data(freq=freq)
@@ -50,7 +49,7 @@ async def lang_freq(call: CallbackQuery, state: FSMContext, cfg):
     )
     await call.answer()
 
-@router.callback_query(LangFlow.product, lambda c: c.data.startswith("lg_prod:"))
+@callbacks.on("lg_prod", state=LangFlow.product)
 async def lang_product(call: CallbackQuery, state: FSMContext, cfg):
     prod = call.data.split(":",1)[1]
     data = await state.get_data()
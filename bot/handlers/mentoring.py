@@ -1,15 +1,14 @@
 from __future__ import annotations
-from aiogram import Router
 from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 
 from bot.states.states import MentorFlow
 from bot.keyboards.keyboards import mentoring_kb, payment_method_kb
 from bot.constants import D_MENTOR
+from bot.handlers.dispatch import callbacks
 
-router = Router()
 
-@router.callback_query(lambda c: c.data == "dir:mentoring")
+@callbacks.on("dir", "mentoring", arity=1)
 async def mentor_start(call: CallbackQuery, state: FSMContext, cfg):
     await state.clear()
     await state.update_data(direction=D_MENTOR)
@@ -17,7 +16,7 @@ async def mentor_start(call: CallbackQuery, state: FSMContext, cfg):
     await call.message.edit_text("Выбери план менторства:", reply_markup=mentoring_kb(cfg))
     await call.answer()
 
-@router.callback_query(MentorFlow.plan, lambda c: c.data.startswith("m_plan:"))
+@callbacks.on("m_plan", state=MentorFlow.plan)
 async def mentor_plan(call: CallbackQuery, state: FSMContext, cfg):
     plan = call.data.split(":",1)[1]
     if plan == "week":
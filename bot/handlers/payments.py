@@ -1,13 +1,10 @@
 from __future__ import annotations
 
-import json
 import logging
 from typing import Union
 
-from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
-from aiogram.filters import StateFilter
 
 from bot.keyboards.keyboards import payment_wait_kb, payment_method_kb
 from bot.states.states import LangFlow, YogaFlow, AstroFlow, MentorFlow
@@ -17,10 +14,11 @@ from bot.constants import (
     D_ENGLISH, D_CHINESE, D_YOGA, D_ASTRO, D_MENTOR,
     PAY_RUB_CARD, PAY_PIX, PAY_CRYPTO,
     C_RUB, C_BRL, C_USDT,
+    DIRECTION_TITLES,
 )
+from bot.handlers.dispatch import callbacks, messages
 
 logger = logging.getLogger(__name__)
-router = Router()
 
 # Константы для валидации
 ALLOWED_PAYMENT_METHODS = {PAY_RUB_CARD, PAY_PIX, PAY_CRYPTO}
@@ -38,14 +36,6 @@ PAYMENT_METHOD_CURRENCIES = {
     PAY_CRYPTO: C_USDT
 }
 
-DIRECTION_TITLES = {
-    D_ENGLISH: "Английский",
-    D_CHINESE: "Китайский",
-    D_YOGA: "Йога",
-    D_ASTRO: "Астрология",
-    D_MENTOR: "Менторство",
-}
-
 # Маппинг префиксов на состояния
 PREFIX_TO_STATE = {
     "lang": LangFlow.wait_proof,
@@ -144,19 +134,7 @@ def _parse_callback_data(callback_data: str, expected_parts: int) -> list[str] |
     return None
 
 
-def _safe_parse_json(json_str: str | dict, order_id: int = None) -> dict:
-    """Безопасно распарсить JSON, вернуть пустой dict при ошибке."""
-    if isinstance(json_str, dict):
-        return json_str
-
-    try:
-        return json.loads(json_str)
-    except (json.JSONDecodeError, TypeError) as e:
-        logger.error(f"Invalid JSON in order {order_id}: {e}")
-        return {}
-
-
-@router.callback_query(lambda c: c.data.startswith("pay_m:"))
+@callbacks.on("pay_m")
 async def pick_payment_method(call: CallbackQuery, state: FSMContext, db, cfg):
     """Обработка выбора метода оплаты."""
     # Парсим callback_data
@@ -184,9 +162,6 @@ async def pick_payment_method(call: CallbackQuery, state: FSMContext, db, cfg):
         logger.warning(f"Unknown prefix: {prefix}")
         return
 
-    # Проверка существующих платежей (и даём пользователю понятные кнопки, а не "ну ты там разберись")
-    # Важно: делаем это ПОСЛЕ проверки state.direction (ниже), чтобы продолжить именно нужный продукт.
-
     # Получаем или создаём пользователя
     try:
         uid = await _ensure_user(db, call)
@@ -203,44 +178,6 @@ async def pick_payment_method(call: CallbackQuery, state: FSMContext, db, cfg):
         logger.warning(f"No direction in state for user {call.from_user.id}")
         return
 
-    # Если уже есть незавершённый платеж по этому направлению, показываем способы его завершить/отменить.
-    try:
-        if await db.pending_payment_exists_for_user(call.from_user.id):
-            ctx = None
-            get_ctx = getattr(db, "get_pending_payment_context_for_user", None)
-            if get_ctx:
-                try:
-                    ctx = await get_ctx(call.from_user.id, direction=direction)
-                except TypeError:
-                    # если сигнатура без direction
-                    ctx = await get_ctx(call.from_user.id)
-
-            if ctx and ctx.get("order_id"):
-                order_id = int(ctx["order_id"])
-                days_hint = ""
-                # Небольшая подсказка, если это proof_submitted
-                if str(ctx.get("payment_status")) == "proof_submitted":
-                    days_hint = "\n\nТвой чек уже отправлен на проверку. Можно просто дождаться ответа админа."
-                await call.message.edit_text(
-                    "У тебя уже есть незавершённый платеж по этому продукту. "
-                    "Выбери, что сделать дальше:" + days_hint,
-                    reply_markup=_pending_payment_actions_kb(order_id),
-                )
-                await call.answer()
-                return
-
-            # fallback: есть pending, но не смогли понять какой именно
-            await call.answer(
-                "У тебя уже есть неоплаченный/непроверенный платеж. Сначала заверши его.",
-                show_alert=True
-            )
-            return
-    except Exception as e:
-        logger.error(f"Error checking pending payments for user {call.from_user.id}: {e}")
-        await call.answer("Ошибка проверки платежей. Попробуй позже.", show_alert=True)
-        return
-
-
     # Валидация суммы
     try:
         amount = int(data["amount"])
@@ -257,25 +194,17 @@ async def pick_payment_method(call: CallbackQuery, state: FSMContext, db, cfg):
     # Собираем payload
     payload = _build_payload(direction, data)
 
-    # Создаём заказ и платёж в БД
+    # Создаём заказ и платёж одним запросом. Если уже есть незавершённый платеж,
+    # БД ничего не создаёт и возвращает его контекст.
     try:
-        order_id = await db.create_order(
+        checkout = await db.open_checkout(
             user_id=uid,
             direction=direction,
             payload=payload,
-            status="awaiting_payment"
-        )
-        payment_id = await db.create_payment(
-            order_id=order_id,
             method=method,
             currency=currency,
             amount=amount
         )
-
-        logger.info(
-            f"Created order {order_id} and payment {payment_id} "
-            f"for user {call.from_user.id} (direction: {direction}, method: {method})"
-        )
     except Exception as e:
         logger.error(f"Failed to create order/payment for user {call.from_user.id}: {e}")
         await call.answer(
@@ -284,6 +213,35 @@ async def pick_payment_method(call: CallbackQuery, state: FSMContext, db, cfg):
         )
         return
 
+    if not checkout["created"]:
+        # Если незавершённый платеж по этому направлению — показываем способы его завершить/отменить.
+        if checkout["direction"] == direction:
+            days_hint = ""
+            # Небольшая подсказка, если это proof_submitted
+            if str(checkout["payment_status"]) == "proof_submitted":
+                days_hint = "\n\nТвой чек уже отправлен на проверку. Можно просто дождаться ответа админа."
+            await call.message.edit_text(
+                "У тебя уже есть незавершённый платеж по этому продукту. "
+                "Выбери, что сделать дальше:" + days_hint,
+                reply_markup=_pending_payment_actions_kb(int(checkout["order_id"])),
+            )
+            await call.answer()
+            return
+
+        # fallback: есть pending по другому направлению
+        await call.answer(
+            "У тебя уже есть неоплаченный/непроверенный платеж. Сначала заверши его.",
+            show_alert=True
+        )
+        return
+
+    order_id = int(checkout["order_id"])
+    payment_id = int(checkout["payment_id"])
+    logger.info(
+        f"Created order {order_id} and payment {payment_id} "
+        f"for user {call.from_user.id} (direction: {direction}, method: {method})"
+    )
+
     # Обновляем state
     await state.update_data(
         order_id=order_id,
@@ -356,8 +314,8 @@ async def _handle_proof_photo(message: Message, state: FSMContext, db, cfg, bot)
         if not order or not pay:
             raise ValueError("Order or payment not found")
 
-        direction = order["direction"]
-        payload = _safe_parse_json(order["payload_json"], order_id)
+        direction = order.direction
+        payload = order.payload
 
     except Exception as e:
         logger.error(f"Failed to get order/payment data for notification: {e}")
@@ -372,9 +330,9 @@ async def _handle_proof_photo(message: Message, state: FSMContext, db, cfg, bot)
         card = format_order_card(
             direction_title=_direction_title(direction),
             payload=payload,
-            amount=pay["amount"],
-            currency=pay["currency"],
-            method=_method_title(pay["method"]),
+            amount=pay.amount,
+            currency=pay.currency,
+            method=_method_title(pay.method),
             user_line=user_line,
         )
     except Exception as e:
@@ -383,8 +341,8 @@ async def _handle_proof_photo(message: Message, state: FSMContext, db, cfg, bot)
             f"Новый платёж #{payment_id}\n"
             f"Пользователь: {user_line}\n"
             f"Направление: {_direction_title(direction)}\n"
-            f"Сумма: {pay['amount']} {pay['currency']}\n"
-            f"Метод: {_method_title(pay['method'])}"
+            f"Сумма: {pay.amount} {pay.currency}\n"
+            f"Метод: {_method_title(pay.method)}"
         )
 
     # Уведомляем админов
@@ -408,7 +366,7 @@ async def _handle_proof_photo(message: Message, state: FSMContext, db, cfg, bot)
 # Единый хендлер для всех состояний wait_proof
 
 
-@router.callback_query(lambda c: c.data.startswith("pay_resume:"))
+@callbacks.on("pay_resume")
 async def resume_pending_payment(call: CallbackQuery, state: FSMContext, db, cfg):
     """Продолжить конкретный незавершённый платеж (показать инструкции и дать загрузить чек)."""
     parts = _parse_callback_data(call.data, 2)
@@ -434,13 +392,13 @@ async def resume_pending_payment(call: CallbackQuery, state: FSMContext, db, cfg
             await call.answer("Не найден незавершённый платеж для этого заказа", show_alert=True)
             return
 
-        method = pay.get("method")
-        currency = pay.get("currency")
-        payment_id = int(pay["id"]) if pay.get("id") else None
+        method = pay.method
+        currency = pay.currency
+        payment_id = pay.id
 
         # обновляем state, чтобы обработчик чека писал proof в правильный payment_id
         await state.update_data(
-            direction=order.get("direction"),
+            direction=order.direction,
             order_id=order_id,
             payment_id=payment_id,
             pay_method=method,
@@ -455,7 +413,7 @@ async def resume_pending_payment(call: CallbackQuery, state: FSMContext, db, cfg
         )
 
         # ставим корректное FSM состояние ожидания proof
-        prefix = _prefix_from_direction(order.get("direction"))
+        prefix = _prefix_from_direction(order.direction)
         new_state = PREFIX_TO_STATE.get(prefix)
         if new_state:
             await state.set_state(new_state)
@@ -465,21 +423,19 @@ async def resume_pending_payment(call: CallbackQuery, state: FSMContext, db, cfg
         logger.error(f"Failed to resume pending payment for order {order_id}: {e}")
         await call.answer("Не получилось продолжить оплату. Попробуй позже.", show_alert=True)
 
-@router.message(
-    StateFilter(
-        LangFlow.wait_proof,
-        YogaFlow.wait_proof,
-        AstroFlow.wait_proof,
-        MentorFlow.wait_proof
-    ),
-    F.photo
+@messages.on(
+    LangFlow.wait_proof,
+    YogaFlow.wait_proof,
+    AstroFlow.wait_proof,
+    MentorFlow.wait_proof,
+    when=lambda m: m.photo is not None
 )
 async def receive_proof_photo(message: Message, state: FSMContext, db, cfg, bot):
     """Обработка фото-чека от пользователя (для всех направлений)."""
     await _handle_proof_photo(message, state, db, cfg, bot)
 
 
-@router.callback_query(lambda c: c.data.startswith("pay_change:"))
+@callbacks.on("pay_change")
 async def pay_change(call: CallbackQuery, state: FSMContext, db, cfg):
     """Изменение способа оплаты для существующего заказа."""
     parts = _parse_callback_data(call.data, 2)
@@ -502,7 +458,7 @@ async def pay_change(call: CallbackQuery, state: FSMContext, db, cfg):
         await call.answer("Ошибка получения заказа", show_alert=True)
         return
 
-    if not order or order["status"] == "paid":
+    if not order or order.status == "paid":
         await call.answer("Этот заказ уже обработан", show_alert=True)
         return
 
@@ -514,11 +470,11 @@ async def pay_change(call: CallbackQuery, state: FSMContext, db, cfg):
         await call.answer("Ошибка проверки доступа", show_alert=True)
         return
 
-    if int(order["user_id"]) != int(uid):
+    if order.user_id != int(uid):
         await call.answer("Нет доступа", show_alert=True)
         logger.warning(
             f"User {call.from_user.id} tried to access order {order_id} "
-            f"owned by user {order['user_id']}"
+            f"owned by user {order.user_id}"
         )
         return
 
@@ -532,7 +488,7 @@ async def pay_change(call: CallbackQuery, state: FSMContext, db, cfg):
         return
 
     # Определяем prefix на основе direction
-    direction = order.get("direction", "")
+    direction = order.direction
     if direction in (D_ENGLISH, D_CHINESE):
         prefix = "lang"
     elif direction == D_YOGA:
@@ -555,7 +511,7 @@ async def pay_change(call: CallbackQuery, state: FSMContext, db, cfg):
         await call.answer("Ошибка обновления сообщения", show_alert=True)
 
 
-@router.callback_query(lambda c: c.data.startswith("order_cancel:"))
+@callbacks.on("order_cancel")
 async def order_cancel(call: CallbackQuery, state: FSMContext, db):
     """Отмена заказа пользователем."""
     parts = _parse_callback_data(call.data, 2)
@@ -578,7 +534,7 @@ async def order_cancel(call: CallbackQuery, state: FSMContext, db):
         await call.answer("Ошибка получения заказа", show_alert=True)
         return
 
-    if not order or order["status"] == "paid":
+    if not order or order.status == "paid":
         await call.answer("Этот заказ уже обработан", show_alert=True)
         return
 
@@ -590,11 +546,11 @@ async def order_cancel(call: CallbackQuery, state: FSMContext, db):
         await call.answer("Ошибка проверки доступа", show_alert=True)
         return
 
-    if int(order["user_id"]) != int(uid):
+    if order.user_id != int(uid):
         await call.answer("Нет доступа", show_alert=True)
         logger.warning(
             f"User {call.from_user.id} tried to cancel order {order_id} "
-            f"owned by user {order['user_id']}"
+            f"owned by user {order.user_id}"
         )
         return
 
@@ -1,24 +1,24 @@
 from aiogram import Router
 from aiogram.types import CallbackQuery
 
+# Модули регистрируют кнопки в callbacks и сообщения в messages при импорте
+from bot.handlers import astrology, languages, mentoring, payments, yoga  # noqa: F401
+from bot.handlers.dispatch import callbacks, messages
 from bot.handlers.start_menu import router as start_router
-from bot.handlers.languages import router as lang_router
-from bot.handlers.yoga import router as yoga_router
-from bot.handlers.astrology import router as astro_router
-from bot.handlers.mentoring import router as mentor_router
-from bot.handlers.payments import router as pay_router
 from bot.handlers.admin import router as admin_router
 from bot.handlers.yoga_feedback import router as yoga_feedback_router
+from bot.handlers.errors import router as errors_router
 
 router = Router()
 
 
+# все callback-кнопки: один разбор callback_data и поиск по словарю
+router.include_router(callbacks)
 router.include_router(start_router)
-router.include_router(yoga_router)
-router.include_router(yoga_feedback_router)
-router.include_router(lang_router)
-router.include_router(astro_router)
-router.include_router(mentor_router)
-router.include_router(pay_router)
+# до messages: в ожидании знакомства текст забирает yoga_intro_catcher,
+# включая команды админа
 router.include_router(admin_router)
-
+# сообщения в состояниях FSM: один поиск по состоянию, прочитанному middleware
+router.include_router(messages)
+router.include_router(yoga_feedback_router)
+router.include_router(errors_router)
@@ -4,6 +4,7 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 
 from bot.keyboards.keyboards import main_menu_kb
+from bot.handlers.dispatch import callbacks
 
 router = Router()
 
@@ -40,7 +41,7 @@ async def cmd_menu(message: Message):
         "Я задам пару вопросов и подберу формат взаимодейтсвия для тебя ✨",
     reply_markup=main_menu_kb())
 
-@router.callback_query(lambda c: c.data == "menu")
+@callbacks.on("menu", arity=0)
 async def cb_menu(call: CallbackQuery):
     await call.message.edit_text("✨ Приветствую тебя! ✨\n"
         "Добро пожаловать в пространство знаний, гармонии и вдохновения.\n"
@@ -1,6 +1,5 @@
 from __future__ import annotations
 import html
-from aiogram import Router
 from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
@@ -9,8 +8,8 @@ from aiogram.types import Message
 from bot.states.states import YogaFlow
 from bot.keyboards.keyboards import yoga_plan_kb, payment_method_kb
 from bot.constants import D_YOGA, YOGA_4, YOGA_8, YOGA_10IND
+from bot.handlers.dispatch import callbacks, messages
 
-router = Router()
 
 def _get_yoga_channel_id(cfg, plan) -> int | None:
     """Возвращает chat_id для публикации по тарифу йоги (4/8) или персональный (если задан)."""
@@ -34,7 +33,7 @@ def _get_yoga_channel_id(cfg, plan) -> int | None:
 
     return None
 
-@router.callback_query(lambda c: c.data == "dir:yoga")
+@callbacks.on("dir", "yoga", arity=1)
 async def yoga_start(call: CallbackQuery, state: FSMContext, cfg):
     await state.clear()
     await state.update_data(direction=D_YOGA)
@@ -42,7 +41,7 @@ async def yoga_start(call: CallbackQuery, state: FSMContext, cfg):
     await call.message.edit_text("Выбери абонемент йоги:", reply_markup=yoga_plan_kb(cfg))
     await call.answer()
 
-@router.callback_query(YogaFlow.plan, lambda c: c.data.startswith("y_plan:"))
+@callbacks.on("y_plan", state=YogaFlow.plan)
 async def yoga_plan(call: CallbackQuery, state: FSMContext, cfg):
     plan = call.data.split(":",1)[1]
     if plan == YOGA_4:
@@ -63,14 +62,12 @@ async def yoga_plan(call: CallbackQuery, state: FSMContext, cfg):
     )
     await call.answer()
 
-@router.message(lambda m: m.text is not None)
+# "WAIT_YOGA_INTRO" — то же состояние, сохранённое до появления YogaFlow.wait_intro
+@messages.on(YogaFlow.wait_intro, "WAIT_YOGA_INTRO", when=lambda m: m.text is not None)
 async def yoga_intro_catcher(message: Message, state: FSMContext, db, cfg, bot):
     if message.chat.type != "private":
         return
 
-    if (await state.get_state()) != "WAIT_YOGA_INTRO":
-        return
-
     data = await state.get_data()
     plan = data.get("yoga_intro_plan")
     payment_id = data.get("yoga_intro_payment_id")
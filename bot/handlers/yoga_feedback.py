@@ -20,6 +20,7 @@ from bot.keyboards.yoga_feedback_kb import (
     freq_kb,
     types_kb,
 )
+from bot.handlers.dispatch import callbacks
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -165,7 +166,7 @@ async def _send_start_question(target, state: FSMContext):
     await state.set_state(YogaFeedback.q1_difficulty)
 
 
-@router.callback_query(lambda c: c.data == "yoga_feedback_start")
+@callbacks.on("yoga_feedback_start", arity=0)
 async def start_feedback_cb(call: CallbackQuery, state: FSMContext):
     """Начать анкету обратной связи (через callback)."""
     await _send_start_question(call.message, state)
@@ -217,7 +218,7 @@ async def _process_step(
         await call.answer("Ошибка обновления", show_alert=True)
 
 
-@router.callback_query(lambda c: c.data.startswith("yf_q1"))
+@callbacks.on("yf_q1")
 async def q1(call: CallbackQuery, state: FSMContext):
     """Обработать ответ на вопрос 1 (сложность)."""
     await _process_step(
@@ -228,7 +229,7 @@ async def q1(call: CallbackQuery, state: FSMContext):
     )
 
 
-@router.callback_query(lambda c: c.data.startswith("yf_q2"))
+@callbacks.on("yf_q2")
 async def q2(call: CallbackQuery, state: FSMContext):
     """Обработать ответ на вопрос 2 (темп)."""
     await _process_step(
@@ -239,7 +240,7 @@ async def q2(call: CallbackQuery, state: FSMContext):
     )
 
 
-@router.callback_query(lambda c: c.data.startswith("yf_q3"))
+@callbacks.on("yf_q3")
 async def q3(call: CallbackQuery, state: FSMContext):
     """Обработать ответ на вопрос 3 (ощущения)."""
     await _process_step(
@@ -250,7 +251,7 @@ async def q3(call: CallbackQuery, state: FSMContext):
     )
 
 
-@router.callback_query(lambda c: c.data.startswith("yf_q4"))
+@callbacks.on("yf_q4")
 async def q4(call: CallbackQuery, state: FSMContext):
     """Обработать ответ на вопрос 4 (формат)."""
     await _process_step(
@@ -261,7 +262,7 @@ async def q4(call: CallbackQuery, state: FSMContext):
     )
 
 
-@router.callback_query(lambda c: c.data.startswith("yf_q5"))
+@callbacks.on("yf_q5")
 async def q5(call: CallbackQuery, state: FSMContext):
     """Обработать ответ на вопрос 5 (частота)."""
     await _process_step(
@@ -272,7 +273,7 @@ async def q5(call: CallbackQuery, state: FSMContext):
     )
 
 
-@router.callback_query(lambda c: c.data.startswith("yf_q6"))
+@callbacks.on("yf_q6")
 async def finish(call: CallbackQuery, state: FSMContext, bot, cfg):
     """Завершить анкету, отправить результаты админам."""
     # Парсим последний ответ
@@ -319,7 +320,7 @@ async def finish(call: CallbackQuery, state: FSMContext, bot, cfg):
     await call.answer()
 
 
-@router.callback_query(lambda c: c.data == "yoga_renew:pay")
+@callbacks.on("yoga_renew", "pay", arity=1)
 async def yoga_renew_pay(call: CallbackQuery, state: FSMContext, db, cfg):
     """Продлить подписку на тот же тариф."""
     # Получаем ID пользователя
@@ -349,7 +350,7 @@ async def yoga_renew_pay(call: CallbackQuery, state: FSMContext, db, cfg):
         await call.answer("Ошибка получения подписки", show_alert=True)
         return
 
-    product = sub["product"]
+    product = sub.product
     logger.info(f"User {uid} renewing subscription for product: {product}")
 
     # Получаем информацию о продукте
@@ -382,7 +383,7 @@ async def yoga_renew_pay(call: CallbackQuery, state: FSMContext, db, cfg):
         await call.answer("Ошибка показа методов оплаты", show_alert=True)
 
 
-@router.callback_query(lambda c: c.data == "yoga_renew:change")
+@callbacks.on("yoga_renew", "change", arity=1)
 async def yoga_renew_change(call: CallbackQuery, state: FSMContext, cfg):
     """Начать процесс смены тарифа."""
     await state.update_data(direction="yoga", flow="renew_change")
@@ -398,7 +399,7 @@ async def yoga_renew_change(call: CallbackQuery, state: FSMContext, cfg):
         await call.answer("Ошибка показа тарифов", show_alert=True)
 
 
-@router.callback_query(lambda c: c.data.startswith("yoga_renew_pick:"))
+@callbacks.on("yoga_renew_pick")
 async def yoga_renew_pick(call: CallbackQuery, state: FSMContext, cfg):
     """Обработать выбор нового тарифа при смене подписки."""
     # Безопасно парсим product
@@ -0,0 +1,208 @@
+"""
+Шина инвалидации кэшей на LISTEN/NOTIFY.
+
+Триггеры из миграции 0007 после UPDATE/DELETE в users, orders, payments и
+subscriptions шлют в канал cache_invalidation ключи изменённых строк
+("orders:1,2,3"; для users — tg_user_id), триггеры fsm_storage (0011) —
+user_id изменённых состояний FSM. InvalidationBus слушает канал на
+одном выделенном соединении и передаёт ключи подписчикам — кэшам, которые
+вытесняют эти записи. Так изменения из другого экземпляра бота или ручные
+правки в БД видны сразу, а не по истечении TTL.
+
+Начиная с миграции 0012 к ключам дописывается application_name сессии,
+сделавшей изменение ("orders:1,2,3@bot-..."). Подписчик с skip_origin не
+получает уведомлений о записях, сделанных под этим именем, — то есть о
+записях своего процесса.
+
+Уведомления, отправленные, пока соединения нет, теряются. Поэтому после
+каждого подключения (и переподключения) подписчики сбрасываются целиком.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import asyncpg
+
+from bot.config import InvalidationSettings
+from bot.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "cache_invalidation"
+TABLES = ("users", "orders", "payments", "subscriptions", "fsm_storage")
+
+EvictHandler = Callable[[List[int]], None]
+FlushHandler = Callable[[], None]
+
+INVALIDATION_MESSAGES = "cache_invalidation_messages_total"
+INVALIDATION_FLUSHES = "cache_invalidation_flushes_total"
+INVALIDATION_CONNECTED = "cache_invalidation_connected"
+REGISTRY.describe(INVALIDATION_MESSAGES, "Invalidation notifications received by table")
+REGISTRY.describe(INVALIDATION_FLUSHES, "Full cache flushes after (re)connecting the listener")
+REGISTRY.describe(INVALIDATION_CONNECTED, "1 if the LISTEN connection is up")
+
+
+@dataclass(frozen=True)
+class _Subscriber:
+    table: str
+    evict: EvictHandler
+    flush: FlushHandler
+    skip_origin: Optional[str] = None
+
+
+class InvalidationBus:
+    """Одно LISTEN-соединение и подписчики по таблицам."""
+
+    def __init__(self, dsn: str, settings: Optional[InvalidationSettings] = None):
+        """
+        Args:
+            dsn: PostgreSQL connection string (primary: NOTIFY не реплицируется)
+            settings: Heartbeat и паузы переподключения (по умолчанию InvalidationSettings())
+        """
+        self._dsn = dsn
+        self._settings = settings or InvalidationSettings()
+        self._subscribers: Dict[str, List[_Subscriber]] = {t: [] for t in TABLES}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        # будит цикл при потере соединения или остановке
+        self._wakeup = asyncio.Event()
+        self._connected = False
+        REGISTRY.gauge(INVALIDATION_CONNECTED, fn=lambda: int(self._connected))
+
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
+    def subscribe(
+            self,
+            table: str,
+            evict: EvictHandler,
+            flush: FlushHandler,
+            skip_origin: Optional[str] = None
+    ) -> None:
+        """
+        Подписаться на изменения таблицы.
+
+        Args:
+            table: Одна из TABLES
+            evict: Вызывается со списком ключей изменённых или удалённых строк
+            flush: Вызывается, когда уведомления могли быть пропущены — кэш
+                нужно сбросить целиком
+            skip_origin: Не передавать evict изменения, сделанные сессиями с
+                этим application_name (Database.origin — свои записи)
+        """
+        if table not in self._subscribers:
+            raise ValueError(f"Unknown table {table!r}, expected one of {', '.join(TABLES)}")
+        self._subscribers[table].append(_Subscriber(table, evict, flush, skip_origin))
+
+    async def start(self) -> None:
+        """Запустить фоновое соединение LISTEN."""
+        if self._task is not None:
+            return
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run(), name="cache-invalidation")
+
+    async def stop(self) -> None:
+        """Закрыть соединение и остановить переподключения."""
+        if self._task is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def _on_notification(self, con, pid: int, channel: str, payload: str) -> None:
+        table, _, keys = payload.partition(":")
+        subscribers = self._subscribers.get(table)
+        if subscribers is None:
+            return
+        # ключи — только цифры и запятые, всё после "@" — источник изменения
+        keys, _, origin = keys.partition("@")
+        REGISTRY.counter(INVALIDATION_MESSAGES, table=table).inc()
+        try:
+            parsed = [int(k) for k in keys.split(",")]
+        except ValueError:
+            logger.warning(f"Malformed invalidation payload for {table}, flushing its caches")
+            self._flush(subscribers)
+            return
+        for sub in subscribers:
+            if origin and sub.skip_origin == origin:
+                continue
+            try:
+                sub.evict(parsed)
+            except Exception as e:
+                logger.error(f"Invalidation handler for {table} failed: {type(e).__name__}: {e}")
+
+    def _flush(self, subscribers: List[_Subscriber]) -> None:
+        for sub in subscribers:
+            try:
+                sub.flush()
+            except Exception as e:
+                logger.error(f"Flush handler for {sub.table} failed: {type(e).__name__}: {e}")
+
+    def _flush_all(self) -> None:
+        REGISTRY.counter(INVALIDATION_FLUSHES).inc()
+        for subscribers in self._subscribers.values():
+            self._flush(subscribers)
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self) -> None:
+        s = self._settings
+        delay = s.reconnect_min_seconds
+        while not self._stopping.is_set():
+            con: Optional[asyncpg.Connection] = None
+            self._wakeup.clear()
+            try:
+                con = await asyncpg.connect(dsn=self._dsn, timeout=s.heartbeat_seconds)
+                con.add_termination_listener(lambda _: self._wakeup.set())
+                await con.add_listener(CHANNEL, self._on_notification)
+                self._connected = True
+                delay = s.reconnect_min_seconds
+                # изменения до LISTEN могли пройти мимо: кэши сбрасываются
+                self._flush_all()
+                logger.info(f"Listening for cache invalidations on {CHANNEL}")
+                await self._heartbeat(con)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                logger.warning(f"Cache invalidation listener failed: {type(e).__name__}: {e}")
+            finally:
+                self._connected = False
+                if con is not None:
+                    await self._close(con)
+
+            if not self._stopping.is_set():
+                logger.info(f"Reconnecting cache invalidation listener in {delay:g}s")
+                await self._sleep(delay)
+                delay = min(delay * 2, s.reconnect_max_seconds)
+
+    async def _heartbeat(self, con: asyncpg.Connection) -> None:
+        """
+        Ждать до остановки или потери соединения. Полуоткрытое соединение
+        (сеть пропала без RST) ловится периодическим запросом с таймаутом.
+        """
+        s = self._settings
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=s.heartbeat_seconds)
+            except asyncio.TimeoutError:
+                await con.execute("SELECT 1", timeout=s.heartbeat_seconds)
+                continue
+            if not self._stopping.is_set():
+                logger.warning("Cache invalidation listener connection lost")
+            return
+
+    @staticmethod
+    async def _close(con: asyncpg.Connection) -> None:
+        if con.is_closed():
+            return
+        try:
+            await asyncio.wait_for(con.close(), timeout=5)
+        except Exception:
+            con.terminate()
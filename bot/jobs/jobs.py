@@ -13,10 +13,16 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from bot.constants import YOGA_4, YOGA_8, YOGA_10IND
-from bot.services.access import kick_user
 
 logger = logging.getLogger(__name__)
 
+# Ключ канала в channel_access_log для каждого йога-продукта
+REVOKE_CHANNEL_KEYS = {
+    YOGA_4: "yoga_4",
+    YOGA_8: "yoga_8",
+    YOGA_10IND: "yoga_individual",
+}
+
 # Бразильский часовой пояс (Рио-де-Жанейро)
 # Важно: используем IANA timezone, чтобы не ловить сюрпризы, если когда-нибудь вернут DST.
 if ZoneInfo:
@@ -30,93 +36,23 @@ def add_jobs(scheduler: AsyncIOScheduler, *, bot: Bot, db, cfg) -> None:
 
     async def sweep_expired_yoga() -> None:
         """
-        Отозвать доступ к йога-каналам для истекших подписок.
+        Истечь подписки и поставить отзыв доступа к йога-каналам в outbox.
 
         Выполняется ежедневно в указанное время.
         """
         try:
-            due = await db.expire_subscriptions_due()
-            if not due:
-                logger.debug("No expired yoga subscriptions found")
-                return
-
-            logger.info(f"Processing {len(due)} expired yoga subscriptions")
-
-            for sub in due:
-                try:
-                    tg_user_id = int(sub["tg_user_id"])
-                    product = sub["product"]
-                    user_id = sub["user_id"]
-                    sub_id = int(sub["id"])
-
-                    # Определяем канал и отзываем доступ
-                    if product == YOGA_4:
-                        await kick_user(bot, cfg.yoga_channel_4_id, tg_user_id)
-                        await db.log_channel_revoke(user_id, "yoga_4")
-                        logger.info(f"Revoked yoga_4 access for user {tg_user_id}")
-                    elif product == YOGA_8:
-                        await kick_user(bot, cfg.yoga_channel_8_id, tg_user_id)
-                        await db.log_channel_revoke(user_id, "yoga_8")
-                        logger.info(f"Revoked yoga_8 access for user {tg_user_id}")
-                    elif product == YOGA_10IND:
-                        # Индивидуальный формат может не использовать групповой канал
-                        await db.log_channel_revoke(user_id, "yoga_individual")
-                        logger.info(f"Logged revoke for yoga_individual user {tg_user_id}")
-
-                    # Помечаем подписку как истекшую
-                    await db.mark_subscription_expired(sub_id)
-
-                    # Уведомляем админов (после успешной обработки)
-                    expires_at_val = sub.get("expires_at")
-                    if isinstance(expires_at_val, datetime):
-                        expires_at_text = expires_at_val.astimezone(BRAZIL_TZ).strftime("%d.%m.%Y %H:%M")
-                    else:
-                        # Если из БД пришла строка/что-то ещё, просто покажем как есть
-                        expires_at_text = str(expires_at_val) if expires_at_val is not None else "unknown"
-
-                    if product in (YOGA_4, YOGA_8):
-                        channel_id = cfg.yoga_channel_4_id if product == YOGA_4 else cfg.yoga_channel_8_id
-                        channel_tag = "yoga_4" if product == YOGA_4 else "yoga_8"
-                        admin_text = (
-                            "🚫 Удаление из канала\n"
-                            f"• tg_id: {tg_user_id}\n"
-                            f"• user_id: {user_id}\n"
-                            f"• продукт: {channel_tag}\n"
-                            f"• канал: {channel_id}\n"
-                            f"• expires_at (Rio): {expires_at_text}\n"
-                            f"• sub_id: {sub_id}"
-                        )
-                    else:
-                        # Индивидуальный формат может не иметь группового канала
-                        admin_text = (
-                            "⏳ Подписка истекла (без канала)\n"
-                            f"• tg_id: {tg_user_id}\n"
-                            f"• user_id: {user_id}\n"
-                            f"• продукт: {product}\n"
-                            f"• expires_at (Rio): {expires_at_text}\n"
-                            f"• sub_id: {sub_id}"
-                        )
+            total = 0
+            async for due in db.iter_subscriptions_due(cfg.jobs_batch_size):
+                logger.info(f"Processing {len(due)} expired yoga subscriptions")
 
-                    for admin_id in getattr(cfg, "ADMIN_IDS", []):
-                        try:
-                            await bot.send_message(admin_id, admin_text)
-                        except Exception as e:
-                            logger.warning(f"Failed to notify admin {admin_id}: {e}")
+                # Истечение, отзыв доступа и сообщения outbox — одной транзакцией
+                # на страницу; удаление из канала и уведомления доставит
+                # OutboxDispatcher (bot/services/fulfillment.py)
+                await db.expire_and_revoke_bulk([sub.id for sub in due], REVOKE_CHANNEL_KEYS)
+                total += len(due)
 
-                    # Уведомляем пользователя
-                    try:
-                        await bot.send_message(
-                            tg_user_id,
-                            "⏳ Доступ к йоге закончился. Нажми /menu чтобы продлить."
-                        )
-                    except Exception as e:
-                        logger.warning(
-                            f"Failed to notify user {tg_user_id} about expired yoga access: {e}"
-                        )
-
-                except Exception as e:
-                    logger.error(f"Failed to process expired subscription {sub.get('id')}: {e}")
-                    continue
+            if not total:
+                logger.debug("No expired yoga subscriptions found")
 
         except Exception as e:
             logger.error(f"Failed to sweep expired yoga subscriptions: {e}")
@@ -145,68 +81,71 @@ def add_jobs(scheduler: AsyncIOScheduler, *, bot: Bot, db, cfg) -> None:
                 f"{tomorrow_start} and {tomorrow_end}"
             )
 
-            # Получаем подписки, истекающие завтра
-            rows = await db.get_subscriptions_expiring_between(
+            # Читаем подписки, истекающие завтра, страницами и шлём опросники
+            # по мере чтения, не дожидаясь полной выборки
+            total = 0
+            async for rows in db.iter_subscriptions_expiring_between(
                 tomorrow_start,
-                tomorrow_end
-            )
+                tomorrow_end,
+                cfg.jobs_batch_size
+            ):
+                logger.info(f"Processing {len(rows)} yoga subscriptions expiring tomorrow")
 
-            if not rows:
-                logger.debug("No yoga subscriptions expiring tomorrow")
-                return
+                for row in rows:
+                    try:
+                        tg_user_id = row.tg_user_id
+                        sub_id = row.id
+                        product = row.product or "yoga"
+
+                        # Проверяем, не отправляли ли уже опросник
+                        if row.feedback_sent_at:
+                            logger.debug(
+                                f"Feedback already sent for subscription {sub_id}, skipping"
+                            )
+                            continue
+
+                        # Формируем сообщение с кнопкой для запуска опроса
+                        message_text = (
+                            "🧘‍♀️ Наш месяц практик подходит к завершению 🤍\n\n"
+                            "Спасибо, что были в этом пространстве!\n\n"
+                            "📋 Мы будем очень благодарны за обратную связь.\n"
+                            "Это поможет сделать практики ещё лучше ✨\n\n"
+                            "👇 Нажмите кнопку ниже, чтобы ответить на несколько вопросов"
+                        )
 
-            logger.info(f"Found {len(rows)} yoga subscriptions expiring tomorrow")
+                        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                            [InlineKeyboardButton(
+                                text="📝 Оставить отзыв",
+                                callback_data="yoga_feedback_start"
+                            )]
+                        ])
 
-            for row in rows:
-                try:
-                    tg_user_id = int(row["tg_user_id"])
-                    sub_id = int(row["id"])
-                    product = row.get("product", "yoga")
+                        # Отправляем сообщение
+                        await bot.send_message(
+                            chat_id=tg_user_id,
+                            text=message_text,
+                            reply_markup=keyboard
+                        )
+
+                        # Помечаем, что опросник отправлен
+                        await db.mark_feedback_sent(sub_id)
+
+                        logger.info(
+                            f"Sent feedback reminder to user {tg_user_id} "
+                            f"for subscription {sub_id} ({product})"
+                        )
 
-                    # Проверяем, не отправляли ли уже опросник
-                    if row.get("feedback_sent_at"):
-                        logger.debug(
-                            f"Feedback already sent for subscription {sub_id}, skipping"
+                    except Exception as e:
+                        logger.error(
+                            f"Failed to send feedback reminder for subscription "
+                            f"{row.id}: {e}"
                         )
                         continue
 
-                    # Формируем сообщение с кнопкой для запуска опроса
-                    message_text = (
-                        "🧘‍♀️ Наш месяц практик подходит к завершению 🤍\n\n"
-                        "Спасибо, что были в этом пространстве!\n\n"
-                        "📋 Мы будем очень благодарны за обратную связь.\n"
-                        "Это поможет сделать практики ещё лучше ✨\n\n"
-                        "👇 Нажмите кнопку ниже, чтобы ответить на несколько вопросов"
-                    )
-
-                    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(
-                            text="📝 Оставить отзыв",
-                            callback_data="yoga_feedback_start"
-                        )]
-                    ])
-
-                    # Отправляем сообщение
-                    await bot.send_message(
-                        chat_id=tg_user_id,
-                        text=message_text,
-                        reply_markup=keyboard
-                    )
-
-                    # Помечаем, что опросник отправлен
-                    await db.mark_feedback_sent(sub_id)
-
-                    logger.info(
-                        f"Sent feedback reminder to user {tg_user_id} "
-                        f"for subscription {sub_id} ({product})"
-                    )
-
-                except Exception as e:
-                    logger.error(
-                        f"Failed to send feedback reminder for subscription "
-                        f"{row.get('id')}: {e}"
-                    )
-                    continue
+                total += len(rows)
+
+            if not total:
+                logger.debug("No yoga subscriptions expiring tomorrow")
 
         except Exception as e:
             logger.error(f"Failed to send yoga feedback reminders: {e}")
@@ -237,3 +176,126 @@ def add_jobs(scheduler: AsyncIOScheduler, *, bot: Bot, db, cfg) -> None:
         replace_existing=True,
     )
     logger.info("Scheduled yoga_feedback_reminder job at 06:00 America/Sao_Paulo")
+
+    async def purge_outbox() -> None:
+        """Удалить доставленные сообщения outbox старше retention_days."""
+        try:
+            before = datetime.now(timezone.utc) - timedelta(days=cfg.outbox.retention_days)
+            await db.purge_outbox(before)
+        except Exception as e:
+            logger.error(f"Failed to purge outbox: {e}")
+
+    scheduler.add_job(
+        purge_outbox,
+        trigger="cron",
+        hour=3,
+        minute=30,
+        timezone="UTC",
+        id="outbox_purge",
+        replace_existing=True,
+    )
+    logger.info("Scheduled outbox_purge job at 03:30 UTC")
+
+    async def archive_history() -> None:
+        """
+        Держать горячие таблицы маленькими: партиции channel_access_log на
+        месяцы вперёд, перенос старых отменённых заказов/платежей и старых
+        партиций журнала доступа в схему archive.
+        """
+        settings = cfg.archive
+        try:
+            await db.ensure_partitions(settings.partitions_ahead)
+        except Exception as e:
+            logger.error(f"Failed to create channel_access_log partitions: {e}")
+        try:
+            before = datetime.now(timezone.utc) - timedelta(days=settings.after_days)
+            await db.archive_closed_orders(before, settings.batch_size)
+        except Exception as e:
+            logger.error(f"Failed to archive closed orders: {e}")
+        try:
+            await db.detach_old_partitions(settings.channel_access_keep_months)
+        except Exception as e:
+            logger.error(f"Failed to archive channel_access_log partitions: {e}")
+
+    scheduler.add_job(
+        archive_history,
+        trigger="cron",
+        hour=4,
+        minute=0,
+        timezone="UTC",
+        id="archive_history",
+        replace_existing=True,
+    )
+    logger.info("Scheduled archive_history job at 04:00 UTC")
+
+    async def reap_stale_checkouts() -> None:
+        """
+        Отменить заказы, которые так и не оплатили: иначе незавершённый
+        платёж не даёт пользователю оформить что-то ещё.
+        """
+        settings = cfg.checkout_reaper
+        try:
+            before = datetime.now(timezone.utc) - timedelta(hours=settings.max_age_hours)
+            await db.reap_stale_checkouts(before, settings.batch_size, settings.notify)
+        except Exception as e:
+            logger.error(f"Failed to cancel stale checkouts: {e}")
+
+    if cfg.checkout_reaper.max_age_hours > 0:
+        scheduler.add_job(
+            reap_stale_checkouts,
+            trigger="interval",
+            minutes=cfg.checkout_reaper.interval_minutes,
+            id="checkout_reaper",
+            replace_existing=True,
+        )
+        logger.info(
+            f"Scheduled checkout_reaper job every {cfg.checkout_reaper.interval_minutes} min "
+            f"(checkouts older than {cfg.checkout_reaper.max_age_hours:g}h)"
+        )
+
+    if cfg.fsm_storage.backend == "postgres":
+        async def purge_fsm_storage() -> None:
+            """Удалить брошенные состояния FSM (старше FSM_TTL_HOURS)."""
+            try:
+                await db.purge_fsm_storage(cfg.fsm_storage.ttl_seconds, cfg.archive.batch_size)
+            except Exception as e:
+                logger.error(f"Failed to purge FSM storage: {e}")
+
+        scheduler.add_job(
+            purge_fsm_storage,
+            trigger="cron",
+            minute=15,
+            timezone="UTC",
+            id="fsm_purge",
+            replace_existing=True,
+        )
+        logger.info("Scheduled fsm_purge job hourly at :15")
+
+    async def refresh_stats() -> None:
+        """Пересчитать дневные агрегаты (/stats) за дни, изменившиеся с прошлого запуска."""
+        try:
+            await db.refresh_daily_stats(cfg.tz, cfg.stats.overlap_seconds)
+        except Exception as e:
+            logger.error(f"Failed to refresh daily stats: {e}")
+
+    scheduler.add_job(
+        refresh_stats,
+        trigger="interval",
+        minutes=cfg.stats.refresh_minutes,
+        next_run_time=datetime.now(timezone.utc),
+        id="stats_refresh",
+        replace_existing=True,
+    )
+    logger.info(f"Scheduled stats_refresh job every {cfg.stats.refresh_minutes} min")
+
+    # Оценка отставания реплики: по ней Database решает, можно ли читать
+    # с реплики, и её же видно в метрике db_replica_lag_seconds
+    if db.has_replica:
+        scheduler.add_job(
+            db.refresh_replica_lag,
+            trigger="interval",
+            seconds=cfg.db_replica.lag_refresh_seconds,
+            id="replica_lag",
+            replace_existing=True,
+        )
+        logger.info(f"Scheduled replica_lag job every {cfg.db_replica.lag_refresh_seconds:g}s")
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import bisect
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Границы бакетов по умолчанию (секунды): от 1 мс до 10 с
+DEFAULT_LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Counter:
+    """Монотонно растущий счётчик."""
+
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class Gauge:
+    """Мгновенное значение: задаётся явно или вычисляется функцией при чтении."""
+
+    __slots__ = ("_value", "_fn")
+
+    def __init__(self, fn: Optional[Callable[[], float]] = None) -> None:
+        self._value = 0.0
+        self._fn = fn
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self._value -= amount
+
+    @property
+    def value(self) -> float:
+        if self._fn is not None:
+            return self._fn()
+        return self._value
+
+
+class Histogram:
+    """Гистограмма с фиксированными бакетами (как в Prometheus)."""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS) -> None:
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        # последний элемент — бакет +Inf
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля по бакетам (линейная интерполяция внутри бакета)."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, c in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else lower
+            if c and seen + c >= rank:
+                return lower + (upper - lower) * ((rank - seen) / c)
+            seen += c
+            lower = upper
+        return lower
+
+
+class MetricsRegistry:
+    """Реестр in-process метрик с метками."""
+
+    def __init__(self) -> None:
+        self._counters: Dict[str, Dict[LabelKey, Counter]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, Gauge]] = {}
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def counter(self, name: str, **labels: object) -> Counter:
+        series = self._counters.setdefault(name, {})
+        key = _label_key(labels)
+        metric = series.get(key)
+        if metric is None:
+            metric = series[key] = Counter()
+        return metric
+
+    def gauge(self, name: str, fn: Optional[Callable[[], float]] = None, **labels: object) -> Gauge:
+        """
+        Вернуть gauge; если передан fn, значение вычисляется при каждом чтении.
+        Повторная регистрация с fn заменяет функцию (например, после переподключения).
+        """
+        series = self._gauges.setdefault(name, {})
+        key = _label_key(labels)
+        metric = series.get(key)
+        if metric is None:
+            metric = series[key] = Gauge(fn)
+        elif fn is not None:
+            metric._fn = fn
+        return metric
+
+    def histogram(
+            self,
+            name: str,
+            buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS,
+            **labels: object
+    ) -> Histogram:
+        series = self._histograms.setdefault(name, {})
+        key = _label_key(labels)
+        metric = series.get(key)
+        if metric is None:
+            metric = series[key] = Histogram(buckets)
+        return metric
+
+    def counters(self, name: str) -> Dict[LabelKey, Counter]:
+        return dict(self._counters.get(name, {}))
+
+    def histograms(self, name: str) -> Dict[LabelKey, Histogram]:
+        return dict(self._histograms.get(name, {}))
+
+    def gauges(self, name: str) -> Dict[LabelKey, Gauge]:
+        return dict(self._gauges.get(name, {}))
+
+    def render(self) -> str:
+        """Отрендерить все метрики в текстовом формате Prometheus."""
+        lines: List[str] = []
+
+        def fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+            pairs = list(key) + ([extra] if extra else [])
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        for name, series in sorted(self._counters.items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for key, c in series.items():
+                lines.append(f"{name}{fmt_labels(key)} {c.value}")
+
+        for name, series in sorted(self._gauges.items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, g in series.items():
+                lines.append(f"{name}{fmt_labels(key)} {g.value}")
+
+        for name, series in sorted(self._histograms.items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, h in series.items():
+                cumulative = 0
+                for bound, c in zip(h.buckets, h.counts):
+                    cumulative += c
+                    lines.append(f"{name}_bucket{fmt_labels(key, ('le', repr(bound)))} {cumulative}")
+                lines.append(f"{name}_bucket{fmt_labels(key, ('le', '+Inf'))} {h.count}")
+                lines.append(f"{name}_sum{fmt_labels(key)} {h.sum}")
+                lines.append(f"{name}_count{fmt_labels(key)} {h.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Глобальный реестр процесса
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,2 @@
+from .db_actor import DbActorMiddleware
+from .fsm_flush import FsmFlushMiddleware
@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from bot.db import current_actor
+
+
+class DbActorMiddleware(BaseMiddleware):
+    """
+    Привязать запросы к БД к пользователю, чей апдейт сейчас обрабатывается.
+
+    Database по этому значению направляет чтения пользователя на primary
+    сразу после его записи (read-your-writes при чтениях с реплики).
+    Регистрируется как outer middleware на dp.update, после
+    UserContextMiddleware aiogram, который кладёт event_from_user.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        user: User | None = data.get("event_from_user")
+        token = current_actor.set(user.id if user else None)
+        try:
+            return await handler(event, data)
+        finally:
+            current_actor.reset(token)
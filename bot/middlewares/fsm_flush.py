@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+
+class FsmFlushMiddleware(BaseMiddleware):
+    """
+    Записать изменения FSM, накопленные за обработку апдейта, одним запросом.
+
+    Регистрируется как outer middleware на dp.update для хранилищ с
+    отложенной записью (PostgresStorage). Ошибка записи не роняет апдейт:
+    изменения остаются в очереди хранилища и уйдут фоновой записью.
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            try:
+                await self._storage.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush FSM storage after update: {e}")
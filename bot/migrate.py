@@ -0,0 +1,73 @@
+"""
+Применение миграций схемы БД отдельно от запуска бота.
+
+    python -m bot.migrate            # применить все недостающие миграции
+    python -m bot.migrate status     # показать текущую и последнюю версии
+    python -m bot.migrate up --target 3
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+import asyncpg
+from dotenv import load_dotenv
+
+from bot.migrations import apply_migrations, current_version, load_migrations
+
+log = logging.getLogger(__name__)
+
+
+async def _status(dsn: str) -> int:
+    con = await asyncpg.connect(dsn=dsn)
+    try:
+        current = await current_version(con)
+    finally:
+        await con.close()
+
+    for m in load_migrations():
+        mark = "x" if m.version <= current else " "
+        kind = "" if m.transactional else " (no-transaction)"
+        print(f"[{mark}] {m.label}{kind}")
+    return 0
+
+
+async def _up(dsn: str, target: int | None) -> int:
+    con = await asyncpg.connect(dsn=dsn)
+    try:
+        applied = await apply_migrations(con, target=target)
+        version = await current_version(con)
+    finally:
+        await con.close()
+
+    if applied:
+        log.info(f"Applied {len(applied)} migration(s): {', '.join(m.label for m in applied)}")
+    else:
+        log.info("Schema is up to date")
+    log.info(f"Schema version: {version}")
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(prog="python -m bot.migrate")
+    parser.add_argument("command", nargs="?", default="up", choices=("up", "status"))
+    parser.add_argument("--target", type=int, default=None, help="migrate up to this version")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_PUBLIC_URL"))
+    args = parser.parse_args(argv)
+
+    if not args.dsn:
+        parser.error("Missing required env var: DATABASE_PUBLIC_URL (or pass --dsn)")
+
+    if args.command == "status":
+        return asyncio.run(_status(args.dsn))
+    return asyncio.run(_up(args.dsn, args.target))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
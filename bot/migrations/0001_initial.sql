@@ -0,0 +1,82 @@
+-- Исходная схема: таблицы и индексы, которые раньше применялись на каждом старте.
+
+CREATE TABLE IF NOT EXISTS users (
+  id BIGSERIAL PRIMARY KEY,
+  tg_user_id BIGINT UNIQUE NOT NULL,
+  username TEXT,
+  first_name TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS orders (
+  id BIGSERIAL PRIMARY KEY,
+  user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  direction TEXT NOT NULL,
+  payload_json JSONB NOT NULL,
+  status TEXT NOT NULL DEFAULT 'draft',
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS payments (
+  id BIGSERIAL PRIMARY KEY,
+  order_id BIGINT NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+  method TEXT NOT NULL,
+  currency TEXT NOT NULL,
+  amount INTEGER NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',
+  proof_file_id TEXT,
+  admin_id_approved BIGINT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS subscriptions (
+  id BIGSERIAL PRIMARY KEY,
+  user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  product TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'active',
+  starts_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  expires_at TIMESTAMPTZ,
+  last_payment_id BIGINT REFERENCES payments(id),
+  channel_id BIGINT,
+  joined_at TIMESTAMPTZ DEFAULT NOW(),
+  feedback_sent_at TIMESTAMPTZ
+);
+
+CREATE TABLE IF NOT EXISTS channel_access_log (
+  id BIGSERIAL PRIMARY KEY,
+  user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  channel_key TEXT NOT NULL,
+  invite_link TEXT,
+  granted_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  revoked_at TIMESTAMPTZ
+);
+
+CREATE TABLE IF NOT EXISTS yoga_feedback (
+  id BIGSERIAL PRIMARY KEY,
+  user_id BIGINT NOT NULL,
+  subscription_id BIGINT NOT NULL,
+  q1_difficulty TEXT,
+  q2_pace TEXT,
+  q3_state TEXT,
+  q4_format TEXT,
+  q5_frequency TEXT,
+  q6_preferences TEXT[],
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  UNIQUE(user_id, subscription_id)
+);
+
+-- Индексы
+CREATE INDEX IF NOT EXISTS idx_users_tg_user_id ON users(tg_user_id);
+CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
+CREATE INDEX IF NOT EXISTS idx_payments_order_id ON payments(order_id);
+CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(status);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_user_id ON subscriptions(user_id);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_expires_at ON subscriptions(expires_at);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_channel_id ON subscriptions(channel_id);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_status ON subscriptions(status);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_product ON subscriptions(product);
+CREATE INDEX IF NOT EXISTS idx_yoga_feedback_user_sub ON yoga_feedback(user_id, subscription_id);
+CREATE INDEX IF NOT EXISTS idx_channel_access_log_user ON channel_access_log(user_id, channel_key);
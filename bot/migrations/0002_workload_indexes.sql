@@ -0,0 +1,59 @@
+-- migrate: no-transaction
+-- Частичные и составные индексы под реальные запросы Database.
+-- Индексы строятся CONCURRENTLY, чтобы не блокировать запись работающему боту.
+-- Проверка планов: bench/query_plans.py
+
+-- Активная йога-подписка пользователя (get_active_yoga_subscription):
+-- range scan по user_id сразу в порядке ORDER BY ... LIMIT 1.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_subscriptions_yoga_active
+  ON subscriptions(user_id, expires_at DESC NULLS FIRST, id DESC)
+  INCLUDE (product, last_payment_id, channel_id)
+  WHERE status = 'active' AND product LIKE 'yoga_%';
+
+-- Последняя/любая йога-подписка пользователя (upsert_yoga_subscription,
+-- is_first_yoga_subscription): index-only scan.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_subscriptions_yoga_user
+  ON subscriptions(user_id, id DESC)
+  WHERE product LIKE 'yoga_%';
+
+-- Свипер и напоминания: активные подписки по сроку окончания.
+-- (expires_at, id) — ещё и ключ для keyset-пагинации.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_subscriptions_active_expires
+  ON subscriptions(expires_at, id)
+  INCLUDE (user_id, product, channel_id, feedback_sent_at)
+  WHERE status = 'active';
+
+-- Незавершённые платежи (pending / proof_submitted) — малая доля таблицы.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_open
+  ON payments(order_id, created_at DESC, id DESC)
+  INCLUDE (status)
+  WHERE status IN ('pending', 'proof_submitted');
+
+-- Заказы пользователя с направлением — для join users -> orders -> payments.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_user_direction
+  ON orders(user_id, direction);
+
+-- Ещё не отозванные доступы к каналам (log_channel_revoke).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_channel_access_log_open
+  ON channel_access_log(user_id, channel_key)
+  WHERE revoked_at IS NULL;
+
+-- Индексы, которые новые полностью заменяют или дублируют ограничения:
+-- idx_users_tg_user_id и idx_yoga_feedback_user_sub дублируют UNIQUE-ограничения,
+-- idx_orders_user_id — префикс idx_orders_user_direction,
+-- idx_payments_status / idx_subscriptions_expires_at / idx_channel_access_log_user
+-- заменены частичными индексами выше, а status/product у подписок
+-- слишком низкоселективны, чтобы индексировать их отдельно.
+DROP INDEX CONCURRENTLY IF EXISTS idx_users_tg_user_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_yoga_feedback_user_sub;
+DROP INDEX CONCURRENTLY IF EXISTS idx_orders_user_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_payments_status;
+DROP INDEX CONCURRENTLY IF EXISTS idx_subscriptions_expires_at;
+DROP INDEX CONCURRENTLY IF EXISTS idx_channel_access_log_user;
+DROP INDEX CONCURRENTLY IF EXISTS idx_subscriptions_status;
+DROP INDEX CONCURRENTLY IF EXISTS idx_subscriptions_product;
+
+ANALYZE users;
+ANALYZE orders;
+ANALYZE payments;
+ANALYZE subscriptions;
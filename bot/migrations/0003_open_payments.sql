@@ -0,0 +1,36 @@
+-- Проекция незавершённых платежей: не больше одной строки на (пользователь, направление).
+-- Поддерживается теми же запросами, что меняют payments (см. bot/statements.py),
+-- поэтому проверка "есть ли у пользователя незавершённый платёж" — поиск по PK
+-- вместо join payments -> orders -> users.
+
+CREATE TABLE IF NOT EXISTS open_payments (
+  tg_user_id BIGINT NOT NULL,
+  direction TEXT NOT NULL,
+  order_id BIGINT NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+  payment_id BIGINT NOT NULL UNIQUE REFERENCES payments(id) ON DELETE CASCADE,
+  status TEXT NOT NULL,
+  method TEXT NOT NULL,
+  currency TEXT NOT NULL,
+  amount INTEGER NOT NULL,
+  proof_file_id TEXT,
+  created_at TIMESTAMPTZ NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL,
+  PRIMARY KEY (tg_user_id, direction)
+);
+
+CREATE INDEX IF NOT EXISTS idx_open_payments_order_id ON open_payments(order_id);
+
+-- Заполнение из существующих данных: самый свежий открытый платёж на (пользователь, направление)
+INSERT INTO open_payments(
+  tg_user_id, direction, order_id, payment_id, status,
+  method, currency, amount, proof_file_id, created_at, updated_at
+)
+SELECT DISTINCT ON (u.tg_user_id, o.direction)
+       u.tg_user_id, o.direction, o.id, p.id, p.status,
+       p.method, p.currency, p.amount, p.proof_file_id, p.created_at, p.updated_at
+FROM payments p
+JOIN orders o ON o.id = p.order_id
+JOIN users u ON u.id = o.user_id
+WHERE p.status IN ('pending', 'proof_submitted')
+ORDER BY u.tg_user_id, o.direction, p.created_at DESC, p.id DESC
+ON CONFLICT DO NOTHING;
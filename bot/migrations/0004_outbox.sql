@@ -0,0 +1,28 @@
+-- Транзакционный outbox: побочные эффекты в Telegram (сообщения, ссылки,
+-- удаление из каналов) записываются в той же транзакции, что и изменение
+-- состояния, а доставляет их OutboxDispatcher (bot/outbox.py) с повторами.
+CREATE TABLE IF NOT EXISTS outbox (
+  id BIGSERIAL PRIMARY KEY,
+  kind TEXT NOT NULL,
+  payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+  -- повторная запись того же события (ретрай транзакции, второй свипер) игнорируется
+  idempotency_key TEXT NOT NULL UNIQUE,
+  status TEXT NOT NULL DEFAULT 'pending', -- pending / done / dead
+  attempts INTEGER NOT NULL DEFAULT 0,
+  -- раньше этого момента сообщение не выбирается: отложенный повтор или
+  -- аренда воркером, который его сейчас доставляет
+  available_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  last_error TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  processed_at TIMESTAMPTZ
+);
+
+-- Очередь к доставке: малая доля таблицы, выбирается в порядке available_at
+CREATE INDEX IF NOT EXISTS idx_outbox_pending
+  ON outbox(available_at, id)
+  WHERE status = 'pending';
+
+-- Очистка доставленных сообщений по сроку
+CREATE INDEX IF NOT EXISTS idx_outbox_processed
+  ON outbox(processed_at)
+  WHERE status <> 'pending';
@@ -0,0 +1,147 @@
+-- Ограничение роста горячих таблиц.
+--
+-- channel_access_log разбивается на месячные партиции по granted_at. Старые
+-- месяцы, в которых не осталось неотозванных доступов, отсоединяются в схему
+-- archive (archive_channel_access_partitions), поэтому частичный индекс
+-- idx_channel_access_log_open и сама таблица не растут со временем.
+--
+-- Отменённые заказы и закрытые (cancelled/rejected) платежи старше N дней
+-- переносятся в archive.orders / archive.payments запросами archive.* из
+-- bot/statements.py (ежедневная задача archival).
+--
+-- Перенос channel_access_log выполняется одной транзакцией и на время
+-- копирования блокирует таблицу: журнал пишется редко, простоя бот не заметит.
+
+CREATE SCHEMA IF NOT EXISTS archive;
+
+-- Колонки повторяют orders/payments в том же порядке (перенос идёт через
+-- SELECT *), archived_at заполняется по умолчанию. Миграции, добавляющие
+-- колонки в orders/payments, должны добавлять их и сюда.
+CREATE TABLE IF NOT EXISTS archive.orders (
+  LIKE orders INCLUDING DEFAULTS,
+  archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS archive.payments (
+  LIKE payments INCLUDING DEFAULTS,
+  archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_archive_orders_id ON archive.orders(id);
+CREATE INDEX IF NOT EXISTS idx_archive_payments_order_id ON archive.payments(order_id);
+
+-- ==================== channel_access_log по месяцам ====================
+
+ALTER TABLE channel_access_log RENAME TO channel_access_log_unpartitioned;
+ALTER TABLE channel_access_log_unpartitioned
+  RENAME CONSTRAINT channel_access_log_pkey TO channel_access_log_unpartitioned_pkey;
+ALTER INDEX IF EXISTS idx_channel_access_log_open RENAME TO idx_channel_access_log_open_unpartitioned;
+
+CREATE TABLE channel_access_log (
+  id BIGINT NOT NULL DEFAULT nextval('channel_access_log_id_seq'),
+  user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  channel_key TEXT NOT NULL,
+  invite_link TEXT,
+  granted_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  revoked_at TIMESTAMPTZ,
+  PRIMARY KEY (id, granted_at)
+) PARTITION BY RANGE (granted_at);
+
+ALTER SEQUENCE channel_access_log_id_seq OWNED BY channel_access_log.id;
+
+-- Ещё не отозванные доступы (channel_access.revoke / revoke_bulk)
+CREATE INDEX idx_channel_access_log_open
+  ON channel_access_log(user_id, channel_key)
+  WHERE revoked_at IS NULL;
+
+-- Страховка на случай, если задача не создала партицию заранее.
+-- Пока в ней есть строки, партицию на их месяц создать нельзя.
+CREATE TABLE channel_access_log_default PARTITION OF channel_access_log DEFAULT;
+
+-- Создать партицию на месяц, начинающийся в month_start (UTC), если её нет.
+CREATE OR REPLACE FUNCTION create_channel_access_partition(month_start TIMESTAMP)
+RETURNS BOOLEAN
+LANGUAGE plpgsql AS $$
+DECLARE
+  lo TIMESTAMP := date_trunc('month', month_start);
+  part_name TEXT := format('channel_access_log_%s', to_char(lo, 'YYYY_MM'));
+BEGIN
+  IF to_regclass(part_name) IS NOT NULL THEN
+    RETURN FALSE;
+  END IF;
+  EXECUTE format(
+    'CREATE TABLE %I PARTITION OF channel_access_log FOR VALUES FROM (%L) TO (%L)',
+    part_name, lo AT TIME ZONE 'UTC', (lo + INTERVAL '1 month') AT TIME ZONE 'UTC'
+  );
+  RETURN TRUE;
+END
+$$;
+
+-- Создать партиции с текущего месяца на months_ahead месяцев вперёд.
+CREATE OR REPLACE FUNCTION ensure_channel_access_partitions(months_ahead INTEGER)
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+  this_month TIMESTAMP := date_trunc('month', NOW() AT TIME ZONE 'UTC');
+  created INTEGER := 0;
+BEGIN
+  FOR i IN 0..months_ahead LOOP
+    IF create_channel_access_partition(this_month + make_interval(months => i)) THEN
+      created := created + 1;
+    END IF;
+  END LOOP;
+  RETURN created;
+END
+$$;
+
+-- Отсоединить в схему archive месячные партиции старше keep_months,
+-- в которых не осталось неотозванных доступов.
+CREATE OR REPLACE FUNCTION archive_channel_access_partitions(keep_months INTEGER)
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+  cutoff TIMESTAMP := date_trunc('month', NOW() AT TIME ZONE 'UTC') - make_interval(months => keep_months);
+  part RECORD;
+  has_open BOOLEAN;
+  archived INTEGER := 0;
+BEGIN
+  FOR part IN
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE i.inhparent = 'channel_access_log'::regclass
+      AND n.nspname = current_schema()
+      AND c.relname ~ '^channel_access_log_\d{4}_\d{2}$'
+    ORDER BY c.relname
+  LOOP
+    -- верхняя граница партиции — начало следующего месяца
+    CONTINUE WHEN to_date(right(part.relname, 7), 'YYYY_MM')::timestamp
+                  + INTERVAL '1 month' > cutoff;
+    EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I WHERE revoked_at IS NULL)', part.relname)
+      INTO has_open;
+    CONTINUE WHEN has_open;
+    EXECUTE format('ALTER TABLE channel_access_log DETACH PARTITION %I', part.relname);
+    EXECUTE format('ALTER TABLE %I SET SCHEMA archive', part.relname);
+    archived := archived + 1;
+  END LOOP;
+  RETURN archived;
+END
+$$;
+
+-- Партиции под существующие данные и на несколько месяцев вперёд
+SELECT create_channel_access_partition(m)
+FROM generate_series(
+  date_trunc('month', (SELECT MIN(granted_at) FROM channel_access_log_unpartitioned) AT TIME ZONE 'UTC'),
+  date_trunc('month', NOW() AT TIME ZONE 'UTC'),
+  INTERVAL '1 month'
+) AS m;
+SELECT ensure_channel_access_partitions(3);
+
+INSERT INTO channel_access_log(id, user_id, channel_key, invite_link, granted_at, revoked_at)
+SELECT id, user_id, channel_key, invite_link, granted_at, revoked_at
+FROM channel_access_log_unpartitioned;
+
+DROP TABLE channel_access_log_unpartitioned;
+
+ANALYZE channel_access_log;
@@ -0,0 +1,26 @@
+-- migrate: no-transaction
+-- Индексы под ежедневный перенос закрытых заказов и платежей в archive
+-- (запросы archive.orders / archive.payments). Частичные индексы содержат
+-- только то, что ещё не перенесено, и не растут со временем.
+
+-- Отменённые заказы по возрасту
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_cancelled
+  ON orders(created_at, id)
+  WHERE status = 'cancelled';
+
+-- Закрытые платежи по возрасту
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_closed
+  ON payments(updated_at, id)
+  WHERE status IN ('cancelled', 'rejected');
+
+-- Проверка FK subscriptions.last_payment_id при удалении платежей:
+-- без индекса каждое удаление читало бы subscriptions целиком.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_subscriptions_last_payment
+  ON subscriptions(last_payment_id)
+  WHERE last_payment_id IS NOT NULL;
+
+-- Статус заказа слишком низкоселективен, а горячие запросы идут по id/user_id
+DROP INDEX CONCURRENTLY IF EXISTS idx_orders_status;
+
+ANALYZE orders;
+ANALYZE payments;
@@ -0,0 +1,60 @@
+-- Уведомления об изменениях для шины инвалидации кэшей (bot/invalidation.py).
+--
+-- После UPDATE/DELETE в users, orders, payments и subscriptions триггер уровня
+-- оператора шлёт в канал cache_invalidation ключи изменённых строк:
+-- "<таблица>:<ключ>,<ключ>,...". Ключ — то, по чему строки кэшируются
+-- (для users — tg_user_id, для остальных — id). Массовые изменения дают одно
+-- уведомление на 300 ключей, чтобы не упереться в лимит NOTIFY в 8000 байт.
+--
+-- INSERT не отслеживается: кэши хранят только найденные строки, новая
+-- строка не может в них устареть. Уведомления доставляются после COMMIT.
+
+CREATE OR REPLACE FUNCTION notify_cache_invalidation()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+DECLARE
+  chunk TEXT;
+BEGIN
+  FOR chunk IN EXECUTE format(
+    'SELECT string_agg(k, '','') FROM ('
+    '  SELECT k, (row_number() OVER () - 1) / 300 AS grp'
+    '  FROM (SELECT DISTINCT %I::text AS k FROM changed_rows) d'
+    ') s GROUP BY grp',
+    TG_ARGV[0]
+  )
+  LOOP
+    PERFORM pg_notify('cache_invalidation', TG_TABLE_NAME || ':' || chunk);
+  END LOOP;
+  RETURN NULL;
+END
+$$;
+
+-- Таблица переходов допускается только у триггера на одно событие,
+-- поэтому UPDATE и DELETE — отдельные триггеры.
+CREATE TRIGGER users_invalidate_update AFTER UPDATE ON users
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('tg_user_id');
+CREATE TRIGGER users_invalidate_delete AFTER DELETE ON users
+  REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('tg_user_id');
+
+CREATE TRIGGER orders_invalidate_update AFTER UPDATE ON orders
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('id');
+CREATE TRIGGER orders_invalidate_delete AFTER DELETE ON orders
+  REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('id');
+
+CREATE TRIGGER payments_invalidate_update AFTER UPDATE ON payments
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('id');
+CREATE TRIGGER payments_invalidate_delete AFTER DELETE ON payments
+  REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('id');
+
+CREATE TRIGGER subscriptions_invalidate_update AFTER UPDATE ON subscriptions
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('id');
+CREATE TRIGGER subscriptions_invalidate_delete AFTER DELETE ON subscriptions
+  REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('id');
@@ -0,0 +1,13 @@
+-- migrate: no-transaction
+-- Индексы для refresh_daily_stats (миграция 0008): поиск изменившихся
+-- платежей и пересчёт одного дня — диапазоны по времени вместо полного скана.
+
+-- Изменения с прошлого запуска и выручка за день оплаты
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_updated_at
+  ON payments(updated_at);
+
+-- Платежи, созданные за день (чеки присланы / подтверждены)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_created_at
+  ON payments(created_at);
+
+ANALYZE payments;
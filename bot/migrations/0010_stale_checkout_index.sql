@@ -0,0 +1,9 @@
+-- migrate: no-transaction
+-- Индекс под отмену брошенных оформлений (запрос checkout.reap_stale):
+-- незавершённые заказы по возрасту. Частичный — содержит только заказы,
+-- ещё ожидающие оплаты, и не растёт со временем.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_unpaid
+  ON orders(created_at, id)
+  WHERE status IN ('draft', 'awaiting_payment');
+
+ANALYZE orders;
@@ -0,0 +1,28 @@
+-- Состояние FSM aiogram (bot/storage/postgres.py): переживает деплой и
+-- падение процесса и общее для всех экземпляров бота.
+--
+-- key — ключ aiogram (бот, чат, пользователь, тред, destiny), user_id —
+-- для инвалидации кэша в других процессах. Строки без активности дольше
+-- TTL считаются истёкшими и удаляются задачей fsm_purge.
+
+CREATE TABLE IF NOT EXISTS fsm_storage (
+  key TEXT PRIMARY KEY,
+  user_id BIGINT NOT NULL,
+  state TEXT,
+  data JSONB NOT NULL DEFAULT '{}',
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at ON fsm_storage(updated_at);
+
+-- Кэш хранилища помнит и отсутствие строки, поэтому в отличие от таблиц
+-- из 0007 отслеживается и INSERT
+CREATE TRIGGER fsm_storage_invalidate_insert AFTER INSERT ON fsm_storage
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('user_id');
+CREATE TRIGGER fsm_storage_invalidate_update AFTER UPDATE ON fsm_storage
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('user_id');
+CREATE TRIGGER fsm_storage_invalidate_delete AFTER DELETE ON fsm_storage
+  REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('user_id');
@@ -0,0 +1,29 @@
+-- Источник изменения в уведомлениях шины инвалидации (bot/invalidation.py).
+--
+-- К ключам дописывается application_name сессии, сделавшей изменение:
+-- "<таблица>:<ключ>,<ключ>,...@<application_name>". Пул Database задаёт
+-- application_name с идентификатором процесса, и подписчик может не
+-- реагировать на собственные записи: хранилище FSM уже держит записанное
+-- состояние в кэше и не должно терять его из-за своего же уведомления.
+-- Сессии без application_name шлют ключи без суффикса, как раньше.
+
+CREATE OR REPLACE FUNCTION notify_cache_invalidation()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+DECLARE
+  chunk TEXT;
+  origin TEXT := COALESCE('@' || NULLIF(current_setting('application_name', true), ''), '');
+BEGIN
+  FOR chunk IN EXECUTE format(
+    'SELECT string_agg(k, '','') FROM ('
+    '  SELECT k, (row_number() OVER () - 1) / 300 AS grp'
+    '  FROM (SELECT DISTINCT %I::text AS k FROM changed_rows) d'
+    ') s GROUP BY grp',
+    TG_ARGV[0]
+  )
+  LOOP
+    PERFORM pg_notify('cache_invalidation', TG_TABLE_NAME || ':' || chunk || origin);
+  END LOOP;
+  RETURN NULL;
+END
+$$;
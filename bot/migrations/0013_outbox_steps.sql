@@ -0,0 +1,6 @@
+-- Выполненные шаги сообщения outbox (OutboxDispatcher.run_step).
+--
+-- Обработчик с несколькими побочными эффектами (ссылка-приглашение,
+-- приветствие, анкета знакомства) отмечает каждый выполненный шаг, и при
+-- повторной доставке того же сообщения уже сделанные шаги пропускаются.
+ALTER TABLE outbox ADD COLUMN IF NOT EXISTS completed_steps TEXT[] NOT NULL DEFAULT '{}';
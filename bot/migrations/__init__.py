@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import logging
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent
+
+# Ключ advisory lock: одновременно мигрирует только один процесс (бот или CLI)
+ADVISORY_LOCK_KEY = 7_160_001
+
+# Миграции с этой строкой выполняются вне транзакции, по одному запросу
+# (нужно для CREATE INDEX CONCURRENTLY). Запросы разделяются ";" в конце строки.
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+_FILENAME_RE = re.compile(r"^(\d{4})_([a-z0-9_]+)\.sql$")
+
+# Имя индекса в CREATE [UNIQUE] INDEX CONCURRENTLY [IF NOT EXISTS] <имя>
+_CONCURRENT_INDEX_RE = re.compile(
+    r"^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# Индекс, оставшийся INVALID после прерванной или упавшей сборки CONCURRENTLY
+INVALID_INDEX_SQL = """
+SELECT format('%I.%I', n.nspname, c.relname)
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relname = $1 AND NOT i.indisvalid AND pg_table_is_visible(c.oid)
+"""
+
+SCHEMA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+  version INTEGER PRIMARY KEY,
+  name TEXT NOT NULL,
+  applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+"""
+
+
+class MigrationError(Exception):
+    """Ошибка применения миграции."""
+    pass
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    sql: str
+    transactional: bool
+
+    @property
+    def label(self) -> str:
+        return f"{self.version:04d}_{self.name}"
+
+
+def load_migrations() -> List[Migration]:
+    """Прочитать все миграции из пакета, отсортированные по версии."""
+    migrations: List[Migration] = []
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        m = _FILENAME_RE.match(path.name)
+        if not m:
+            raise MigrationError(f"Bad migration file name: {path.name}")
+        sql = path.read_text(encoding="utf-8")
+        migrations.append(Migration(
+            version=int(m.group(1)),
+            name=m.group(2),
+            sql=sql,
+            transactional=NO_TRANSACTION_MARKER not in sql,
+        ))
+
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise MigrationError(f"Duplicate migration versions: {versions}")
+    return migrations
+
+
+def latest_version() -> int:
+    migrations = load_migrations()
+    return migrations[-1].version if migrations else 0
+
+
+def _split_statements(sql: str) -> List[str]:
+    """Разбить нетранзакционную миграцию на отдельные запросы."""
+    statements: List[str] = []
+    buf: List[str] = []
+    for line in sql.splitlines():
+        buf.append(line)
+        if line.rstrip().endswith(";"):
+            stmt = "\n".join(buf).strip()
+            buf = []
+            if _has_code(stmt):
+                statements.append(stmt)
+    tail = "\n".join(buf).strip()
+    if _has_code(tail):
+        statements.append(tail)
+    return statements
+
+
+def _has_code(sql: str) -> bool:
+    return any(
+        line.strip() and not line.strip().startswith("--")
+        for line in sql.splitlines()
+    )
+
+
+async def current_version(con: asyncpg.Connection) -> int:
+    """Текущая версия схемы (0, если миграции ещё не применялись)."""
+    exists = await con.fetchval("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not exists:
+        return 0
+    return int(await con.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version"))
+
+
+async def _apply(con: asyncpg.Connection, migration: Migration) -> None:
+    logger.info(f"Applying migration {migration.label}")
+    if migration.transactional:
+        async with con.transaction():
+            await con.execute(migration.sql)
+            await con.execute(
+                "INSERT INTO schema_version(version, name) VALUES($1, $2)",
+                migration.version, migration.name
+            )
+        return
+
+    # CREATE INDEX CONCURRENTLY и т.п. нельзя выполнять в транзакции.
+    # Запросы таких миграций должны быть идемпотентными (IF NOT EXISTS),
+    # чтобы прерванную миграцию можно было просто перезапустить.
+    for stmt in _split_statements(migration.sql):
+        await _drop_invalid_index(con, stmt)
+        await con.execute(stmt)
+    await con.execute(
+        "INSERT INTO schema_version(version, name) VALUES($1, $2)",
+        migration.version, migration.name
+    )
+
+
+async def _drop_invalid_index(con: asyncpg.Connection, stmt: str) -> None:
+    """
+    Удалить INVALID-индекс, который собирается построить stmt.
+
+    Прерванный CREATE INDEX CONCURRENTLY оставляет индекс в состоянии
+    INVALID: IF NOT EXISTS его пропустил бы, и миграция записалась бы
+    применённой с неработающим индексом.
+    """
+    m = _CONCURRENT_INDEX_RE.search(stmt)
+    if not m:
+        return
+    invalid = await con.fetchval(INVALID_INDEX_SQL, m.group(1))
+    if invalid is not None:
+        logger.warning(f"Dropping invalid index {invalid} left by an interrupted build")
+        await con.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {invalid}")
+
+
+async def apply_migrations(
+        con: asyncpg.Connection,
+        target: Optional[int] = None
+) -> List[Migration]:
+    """
+    Применить недостающие миграции до target (по умолчанию до последней).
+
+    Если схема уже актуальна, выходит сразу, не беря блокировок.
+    Иначе берёт advisory lock, перечитывает версию (её мог поднять другой
+    процесс) и применяет миграции по порядку.
+
+    Args:
+        con: Выделенное соединение (не из пула приложения)
+        target: Версия, до которой мигрировать
+
+    Returns:
+        Список применённых миграций
+    """
+    migrations = load_migrations()
+    if target is None:
+        target = migrations[-1].version if migrations else 0
+
+    if await current_version(con) >= target:
+        return []
+
+    await con.execute("SELECT pg_advisory_lock($1)", ADVISORY_LOCK_KEY)
+    try:
+        await con.execute(SCHEMA_VERSION_SQL)
+        current = await current_version(con)
+        applied: List[Migration] = []
+        for migration in migrations:
+            if migration.version <= current or migration.version > target:
+                continue
+            try:
+                await _apply(con, migration)
+            except Exception as e:
+                raise MigrationError(f"Migration {migration.label} failed: {e}") from e
+            applied.append(migration)
+        return applied
+    finally:
+        await con.execute("SELECT pg_advisory_unlock($1)", ADVISORY_LOCK_KEY)
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, FrozenSet, List, Mapping, Optional
+
+# Типизированные записи, которые возвращает Database.
+#
+# payload_json приходит из asyncpg уже разобранным (кодек jsonb регистрируется
+# на каждом соединении пула), поэтому здесь нет разбора строк.
+
+# Ключи payload, в которых может лежать название йога-тарифа
+_YOGA_PLAN_KEYS = ("Тариф", "План", "Абонемент", "Yoga plan", "yoga_plan", "plan", "product", "Продукт")
+
+
+@dataclass(frozen=True, slots=True)
+class Order:
+    id: int
+    user_id: int
+    direction: str
+    payload: Mapping[str, Any]
+    status: str
+    created_at: datetime
+
+    @classmethod
+    def from_record(cls, row: Mapping[str, Any]) -> "Order":
+        return cls(
+            id=row["id"],
+            user_id=row["user_id"],
+            direction=row["direction"],
+            payload=row["payload_json"] or {},
+            status=row["status"],
+            created_at=row["created_at"],
+        )
+
+    @property
+    def yoga_plan(self) -> Optional[int]:
+        """4 или 8 практик в месяц, если тариф удаётся определить по payload."""
+        for key in _YOGA_PLAN_KEYS:
+            raw = self.payload.get(key)
+            if not raw:
+                continue
+            s = str(raw).lower()
+            if "8" in s:
+                return 8
+            if "4" in s:
+                return 4
+        return None
+
+
+@dataclass(frozen=True, slots=True)
+class Payment:
+    id: int
+    order_id: int
+    method: str
+    currency: str
+    amount: int
+    status: str
+    proof_file_id: Optional[str]
+    admin_id_approved: Optional[int]
+    created_at: datetime
+    updated_at: datetime
+
+    @classmethod
+    def from_record(cls, row: Mapping[str, Any]) -> "Payment":
+        return cls(**row)
+
+
+@dataclass(frozen=True, slots=True)
+class Subscription:
+    """
+    Подписка. Запросы выбирают разные наборы колонок, поэтому всё,
+    кроме id, необязательно; tg_user_id заполняется запросами с join на users.
+    """
+    id: int
+    user_id: Optional[int] = None
+    product: Optional[str] = None
+    status: Optional[str] = None
+    expires_at: Optional[datetime] = None
+    last_payment_id: Optional[int] = None
+    channel_id: Optional[int] = None
+    feedback_sent_at: Optional[datetime] = None
+    tg_user_id: Optional[int] = None
+
+    @classmethod
+    def from_record(cls, row: Mapping[str, Any]) -> "Subscription":
+        return cls(**row)
+
+
+@dataclass(frozen=True, slots=True)
+class FulfillmentPlan:
+    """
+    Результат Database.approve_and_fulfill: что уже записано в БД и что
+    осталось сделать хэндлеру (ссылки, сообщения, кик из старого канала).
+
+    plan/new_product/expires_at заполнены только для йоги 4/8 — по ним
+    продлевается или создаётся подписка. closed_status задан, если платёж
+    уже отклонён или отменён и одобрить его нельзя — в БД ничего не менялось.
+    """
+    payment_id: int
+    order: Order
+    tg_user_id: int
+    already_paid: bool = False
+    closed_status: Optional[str] = None
+    plan: Optional[int] = None
+    old_product: Optional[str] = None
+    new_product: Optional[str] = None
+    expires_at: Optional[datetime] = None
+    is_first_join: bool = False
+    subscription_id: Optional[int] = None
+
+    @property
+    def user_id(self) -> int:
+        return self.order.user_id
+
+    @property
+    def changing_plan(self) -> bool:
+        return bool(self.old_product) and self.old_product != self.new_product
+
+
+@dataclass(frozen=True, slots=True)
+class OutboxMessage:
+    """Сообщение outbox, выданное воркеру на доставку."""
+    id: int
+    kind: str
+    payload: Mapping[str, Any]
+    idempotency_key: str
+    attempts: int
+    # шаги обработчика, выполненные при прошлых попытках
+    completed_steps: FrozenSet[str] = frozenset()
+
+    @classmethod
+    def from_record(cls, row: Mapping[str, Any]) -> "OutboxMessage":
+        return cls(**{**row, "completed_steps": frozenset(row["completed_steps"])})
+
+
+@dataclass(frozen=True, slots=True)
+class RevenueTotal:
+    """Оплаченные платежи за период по направлению, методу и валюте."""
+    direction: str
+    method: str
+    currency: str
+    payments: int
+    amount: int
+
+    @classmethod
+    def from_record(cls, row: Mapping[str, Any]) -> "RevenueTotal":
+        return cls(**row)
+
+
+@dataclass(frozen=True, slots=True)
+class SubscriptionTotals:
+    """Новые, продлённые и истёкшие подписки продукта за период."""
+    product: str
+    new: int
+    renewed: int
+    expired: int
+
+    @classmethod
+    def from_record(cls, row: Mapping[str, Any]) -> "SubscriptionTotals":
+        return cls(**row)
+
+
+@dataclass(frozen=True, slots=True)
+class ProofTotals:
+    """Платежи, созданные за период: сколько прислали чек, подтверждено, отклонено."""
+    payments: int
+    proofs_submitted: int
+    approved: int
+    rejected: int
+
+    @classmethod
+    def from_record(cls, row: Mapping[str, Any]) -> "ProofTotals":
+        return cls(**row)
+
+
+@dataclass(frozen=True, slots=True)
+class StatsReport:
+    """Отчёт по дневным агрегатам за дни [since, until) в часовом поясе tz."""
+    since: date
+    until: date
+    tz: Optional[str]
+    refreshed_at: Optional[datetime]
+    revenue: List[RevenueTotal]
+    subscriptions: List[SubscriptionTotals]
+    proofs: ProofTotals
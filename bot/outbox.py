@@ -0,0 +1,202 @@
+"""
+Доставка побочных эффектов из таблицы outbox.
+
+Изменения состояния (подтверждение платежа, истечение подписки) пишут
+сообщение в outbox той же транзакцией, а OutboxDispatcher после коммита
+доставляет его: воркеры забирают пачки через SKIP LOCKED, вызывают
+обработчик по kind и отмечают результат. Неудачи повторяются с
+экспоненциальной задержкой, после max_attempts сообщение помечается dead.
+
+Доставка "как минимум один раз": если процесс упадёт между вызовом Bot API
+и отметкой done, сообщение будет доставлено повторно после истечения аренды.
+Перед каждым сообщением пачки аренда продлевается; сообщение, которое уже
+забрал другой воркер, пропускается. Обработчик с несколькими побочными
+эффектами оборачивает каждый в run_step, и повтор не выполняет уже
+сделанные шаги заново.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from bot.config import OutboxSettings
+from bot.metrics import REGISTRY
+from bot.models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+OutboxHandler = Callable[[OutboxMessage], Awaitable[None]]
+
+OUTBOX_MESSAGES = "outbox_messages_total"
+OUTBOX_DELIVERY = "outbox_delivery_seconds"
+REGISTRY.describe(OUTBOX_MESSAGES, "Outbox messages processed by kind and result (done/retry/dead)")
+REGISTRY.describe(OUTBOX_DELIVERY, "Outbox handler latency")
+
+
+class OutboxDispatcher:
+    """Пул воркеров, разбирающих outbox."""
+
+    def __init__(self, db, settings: Optional[OutboxSettings] = None):
+        """
+        Args:
+            db: Database
+            settings: Настройки воркеров и повторов (по умолчанию OutboxSettings())
+        """
+        self._db = db
+        self._settings = settings or OutboxSettings()
+        self._handlers: Dict[str, OutboxHandler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+
+    def register(self, kind: str, handler: OutboxHandler) -> None:
+        """Назначить обработчик для сообщений вида kind."""
+        self._handlers[kind] = handler
+
+    async def start(self) -> None:
+        """Запустить воркеров."""
+        if self._tasks:
+            return
+        self._stopping.clear()
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"outbox-worker-{i}")
+            for i in range(self._settings.workers)
+        ]
+        logger.info(
+            f"Outbox dispatcher started: {self._settings.workers} worker(s), "
+            f"kinds: {', '.join(sorted(self._handlers))}"
+        )
+
+    async def stop(self) -> None:
+        """
+        Остановить воркеров: текущее сообщение доставляется до конца,
+        остаток пачки возвращается в очередь по истечении аренды.
+        """
+        if not self._tasks:
+            return
+        self._stopping.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Outbox dispatcher stopped")
+
+    def _backoff(self, attempts: int) -> float:
+        s = self._settings
+        return min(s.backoff_max, s.backoff_base * 2 ** max(attempts - 1, 0))
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _worker(self, index: int) -> None:
+        s = self._settings
+        while not self._stopping.is_set():
+            try:
+                batch = await self._db.claim_outbox(s.batch_size, s.lease_seconds)
+            except Exception as e:
+                logger.error(f"Outbox worker {index} failed to claim messages: {e}")
+                await self._sleep(s.poll_interval)
+                continue
+
+            if not batch:
+                await self._sleep(s.poll_interval)
+                continue
+
+            for message in batch:
+                if self._stopping.is_set():
+                    break
+                if await self._renew_lease(message):
+                    await self.process(message)
+
+    async def _renew_lease(self, message: OutboxMessage) -> bool:
+        # Аренда бралась на всю пачку; пока доставлялись предыдущие сообщения,
+        # она могла истечь, и сообщение мог забрать другой воркер
+        try:
+            renewed = await self._db.renew_outbox_lease(
+                message.id, message.attempts, self._settings.lease_seconds
+            )
+        except Exception as e:
+            logger.error(f"Failed to renew lease of outbox message {message.id}: {e}")
+            return False
+        if not renewed:
+            logger.warning(f"Outbox message {message.id} ({message.kind}) lease lost, skipping")
+        return renewed
+
+    async def run_step(self, message: OutboxMessage, step: str, action: Callable[[], Awaitable[None]]) -> None:
+        """
+        Выполнить шаг обработчика, если он не был выполнен при прошлой попытке.
+
+        Шаг отмечается выполненным сразу после action; если action или отметка
+        упадёт, исключение уходит в обработчик, и повтор начнётся с этого шага.
+
+        Args:
+            message: Доставляемое сообщение
+            step: Имя шага, уникальное в пределах обработчика
+            action: Побочный эффект шага
+        """
+        if step in message.completed_steps:
+            logger.info(f"Outbox message {message.id} ({message.kind}): step {step!r} already done")
+            return
+        await action()
+        await self._db.complete_outbox_step(message.id, step)
+
+    async def process(self, message: OutboxMessage) -> str:
+        """
+        Доставить одно сообщение и записать результат.
+
+        Returns:
+            "done", "retry" или "dead"
+        """
+        s = self._settings
+        handler = self._handlers.get(message.kind)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f"No outbox handler for kind {message.kind!r}")
+            await handler(message)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if message.attempts >= s.max_attempts:
+                result = "dead"
+                logger.error(
+                    f"Outbox message {message.id} ({message.kind}) gave up after "
+                    f"{message.attempts} attempts: {error}"
+                )
+                await self._record(self._db.bury_outbox(message.id, message.attempts, error), message)
+            else:
+                # Telegram сам говорит, сколько ждать при флуд-контроле
+                delay = getattr(e, "retry_after", None) or self._backoff(message.attempts)
+                result = "retry"
+                logger.warning(
+                    f"Outbox message {message.id} ({message.kind}) attempt "
+                    f"{message.attempts} failed, retry in {delay:g}s: {error}"
+                )
+                await self._record(self._db.retry_outbox(message.id, message.attempts, delay, error), message)
+        else:
+            result = "done"
+            await self._record(self._db.complete_outbox(message.id, message.attempts), message)
+        finally:
+            REGISTRY.histogram(OUTBOX_DELIVERY, kind=message.kind).observe(
+                time.perf_counter() - started
+            )
+
+        REGISTRY.counter(OUTBOX_MESSAGES, kind=message.kind, result=result).inc()
+        return result
+
+    @staticmethod
+    async def _record(update: Awaitable[bool], message: OutboxMessage) -> None:
+        # Если отметка не записалась, сообщение вернётся после истечения аренды
+        try:
+            recorded = await update
+        except Exception as e:
+            logger.error(f"Failed to record outbox message {message.id} result: {e}")
+            return
+        if not recorded:
+            # аренда истекла во время обработчика: результатом распоряжается
+            # воркер, забравший сообщение заново
+            logger.warning(
+                f"Outbox message {message.id} ({message.kind}) lease lost during delivery, "
+                f"result of attempt {message.attempts} not recorded"
+            )
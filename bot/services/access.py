@@ -1,7 +1,5 @@
 from __future__ import annotations
 
-import json
-
 from aiogram import Bot
 from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 from datetime import timedelta
@@ -22,33 +20,6 @@ async def kick_user(bot: Bot, chat_id: int, tg_user_id: int) -> None:
         return
 
 
-def _extract_yoga_plan(payload) -> Optional[int]:
-    """
-    Returns 4 or 8 if can detect, else None.
-    payload может быть dict или json-string.
-    """
-    if isinstance(payload, str):
-        try:
-            payload = json.loads(payload)
-        except Exception:
-            return None
-    if not isinstance(payload, dict):
-        return None
-
-    # ВАЖНО: у тебя payload сейчас хранится с РУССКИМИ ключами: "Тариф"
-    v = payload.get("Тариф") or payload.get("План") or payload.get("Абонемент") or payload.get("product") or payload.get("plan")
-    if not v:
-        return None
-    s = str(v).lower()
-
-    # подстрой под свои названия, но суть такая:
-    if "8" in s:
-        return 8
-    if "4" in s:
-        return 4
-    return None
-
-
 def _yoga_channel_id(cfg, plan: int) -> Optional[int]:
     if plan == 4:
         return cfg.yoga_channel_4_id
@@ -0,0 +1,321 @@
+"""
+Доставка побочных эффектов оплаты, истечения подписок и отмены брошенных
+заказов (обработчики outbox).
+
+Обработчик бросает исключение, если доставку стоит повторить; ошибки,
+которые повтор не исправит (пользователь заблокировал бота), только
+логируются. Уведомления админам идут последними и не роняют обработчик,
+чтобы повтор не отправил их второй раз.
+"""
+from __future__ import annotations
+
+import html
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+from bot.constants import (
+    D_YOGA,
+    DIRECTION_TITLES,
+    OUTBOX_CHECKOUT_EXPIRED,
+    OUTBOX_PAYMENT_APPROVED,
+    OUTBOX_SUBSCRIPTION_EXPIRED,
+    YOGA_4,
+    YOGA_8,
+    YOGA_10IND,
+)
+from bot.models import OutboxMessage
+from bot.outbox import OutboxDispatcher
+from bot.services.access import kick_user
+from bot.states.states import YogaFlow
+
+try:
+    from zoneinfo import ZoneInfo
+    BRAZIL_TZ = ZoneInfo("America/Sao_Paulo")
+except Exception:  # pragma: no cover
+    BRAZIL_TZ = timezone(timedelta(hours=-3))
+
+logger = logging.getLogger(__name__)
+
+# Шаг обработчика outbox: (имя, побочный эффект), см. OutboxDispatcher.run_step
+Step = Callable[[str, Callable[[], Awaitable[None]]], Awaitable[None]]
+
+WELCOME_YOGA_TEXT = (
+    "Добро пожаловать 🤍\n\n"
+    "💰 <b>Оплата прошла успешно</b> — вы в закрытой группе йога‑практик 🧘‍♀️\n\n"
+    "🫶🏼 Здесь вас ждёт регулярная поддержка, мягкая работа с телом и состоянием, "
+    "а главное — пространство для себя без спешки и давления.\n\n"
+    "✅ Все анонсы практик, ссылки и важная информация будут появляться в группе."
+    "▫️ Практики проходят регулярно в этой группе\n"
+    "▫️ Все записи сохраняются\n"
+    "▫️ Можно заниматься в удобное время\n"
+    "Доступ: в течение 1 месяца\n"
+)
+
+
+def _fmt_date(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).strftime("%d.%m.%Y")
+
+
+def _parse_dt(value) -> datetime | None:
+    return datetime.fromisoformat(value) if value else None
+
+
+async def _kick_from_channel(bot: Bot, channel_id: int, tg_id: int) -> None:
+    try:
+        await bot.ban_chat_member(channel_id, tg_id)
+        await bot.unban_chat_member(channel_id, tg_id)
+    except Exception:
+        pass
+
+
+async def _start_yoga_intro(bot: Bot, storage: BaseStorage, *, tg_user_id: int, plan_label: str, payment_id: int):
+    """Запускает сбор знакомства для йоги: переводит пользователя в YogaFlow.wait_intro и просит ответ."""
+    user_ctx = FSMContext(
+        storage=storage,
+        key=StorageKey(bot_id=bot.id, chat_id=tg_user_id, user_id=tg_user_id),
+    )
+    await user_ctx.clear()
+    await user_ctx.set_state(YogaFlow.wait_intro)
+    await user_ctx.update_data(yoga_intro_plan=plan_label, yoga_intro_payment_id=payment_id)
+
+    await bot.send_message(
+        chat_id=tg_user_id,
+        text=(
+            "✅ <b>Оплата подтверждена</b> 🤍\n\n"
+            "🧘‍♀️ <b>Сегодня - знакомимся! </b>\n"
+            "Напишите:\n"
+            "1️⃣ Имя \n"
+            "2️⃣ Из какого города/страны \n"
+            "3️⃣ Как вы чувствуете свое тело на данный момент? Занимались ли вы когда-нибудь йогой? "
+            "Я передам это Ольге и опубликую в канале."
+        ),
+        parse_mode="HTML",
+    )
+
+
+async def _send_payment_confirmation(bot: Bot, storage: BaseStorage, cfg, data: dict, step: Step) -> None:
+    """
+    Сообщения пользователю после подтверждения оплаты (бывший хвост admin_approve).
+
+    Каждый побочный эффект — отдельный шаг step: повтор доставки не шлёт
+    вторую ссылку и приветствие и не сбрасывает уже начатое знакомство.
+    """
+    tg_user_id = data["tg_user_id"]
+    payment_id = data["payment_id"]
+    plan = data["plan"]
+
+    async def send_contact_olga() -> None:
+        await bot.send_message(
+            chat_id=tg_user_id,
+            text=(
+                "✅ <b>Оплата подтверждена</b>\n\n"
+                "Спасибо! Мы получили подтверждение оплаты.\n\n"
+                "💬 В ближайшее время с вами свяжется <b>Ольга</b>.\n"
+                "Если вы долго не получаете ответа, вы можете написать ей напрямую:\n\n"
+                f"👉 <b>{cfg.olga_telegram}</b>"
+            ),
+            parse_mode="HTML",
+        )
+
+    if data["direction"] == D_YOGA and plan is None:
+        await step("confirmation", send_contact_olga)
+        await step("intro", lambda: _start_yoga_intro(
+            bot, storage, tg_user_id=tg_user_id, plan_label="индивидуально", payment_id=payment_id
+        ))
+        return
+
+    if data["direction"] != D_YOGA:
+        await step("confirmation", send_contact_olga)
+        return
+
+    new_channel_id = cfg.yoga_channel_4_id if plan == 4 else cfg.yoga_channel_8_id
+    cur_product = data["old_product"]
+    new_expires = _parse_dt(data["expires_at"])
+    is_first_join = data["is_first_join"]
+
+    async def send_invite(tariff: str, group: str) -> None:
+        invite = await bot.create_chat_invite_link(
+            chat_id=new_channel_id,
+            name=f"yoga{plan}:{tg_user_id}:{payment_id}",
+            member_limit=1,
+            expire_date=datetime.now(timezone.utc) + timedelta(days=2),
+        )
+        await bot.send_message(
+            chat_id=tg_user_id,
+            text=(
+                "✅ <b>Оплата подтверждена</b>\n\n"
+                f"🧘 {tariff}: <b>{plan} практик/мес</b>\n"
+                f"⏳ Доступ до: <b>{_fmt_date(new_expires)}</b>\n\n"
+                f"Вот ссылка для входа в {group}:\n\n"
+                f"🔗 {invite.invite_link}\n\n"
+                f"Если ссылка не открывается — напишите Ольге {cfg.olga_telegram}."
+            ),
+            parse_mode="HTML",
+        )
+
+    async def welcome() -> None:
+        await step("welcome", lambda: bot.send_message(tg_user_id, WELCOME_YOGA_TEXT, parse_mode="HTML"))
+        await step("intro", lambda: _start_yoga_intro(
+            bot, storage, tg_user_id=tg_user_id, plan_label=str(plan), payment_id=payment_id
+        ))
+
+    if data["changing_plan"]:
+        old_plan = 4 if "4" in str(cur_product) else 8 if "8" in str(cur_product) else None
+        old_channel_id = cfg.yoga_channel_4_id if old_plan == 4 else cfg.yoga_channel_8_id if old_plan == 8 else None
+        if old_channel_id:
+            await step("kick_old", lambda: _kick_from_channel(bot, old_channel_id, tg_user_id))
+
+        await step("invite", lambda: send_invite("Ваш новый тариф", "нужную группу"))
+
+        if is_first_join:
+            await welcome()
+
+    elif is_first_join:
+        await step("invite", lambda: send_invite("Тариф", "закрытую группу"))
+        await welcome()
+
+    else:
+        await step("confirmation", lambda: bot.send_message(
+            chat_id=tg_user_id,
+            text=(
+                "✅ <b>Оплата подтверждена</b>\n\n"
+                f"Доступ в группу продлён до: <b>{_fmt_date(new_expires)}</b> 🤍\n\n"
+                "Если вы долго не получаете ответа, вы можете написать Ольге напрямую:\n"
+                f"👉 <b>{cfg.olga_telegram}</b>"
+            ),
+            parse_mode="HTML",
+        ))
+
+
+async def _notify_admins_payment_approved(bot: Bot, cfg, data: dict) -> None:
+    tg_user_id = data["tg_user_id"]
+    try:
+        chat = await bot.get_chat(tg_user_id)
+        user_name = chat.full_name
+        if chat.username:
+            user_name += f" (@{chat.username})"
+    except Exception:
+        user_name = str(tg_user_id)
+
+    safe_user_name = html.escape(user_name)
+
+    for admin_id in getattr(cfg, "admin_ids", []):
+        try:
+            await bot.send_message(
+                chat_id=admin_id,
+                text=(
+                    "✅ <b>Оплата подтверждена</b>\n"
+                    f"👤 Пользователь: <b>{safe_user_name}</b>\n"
+                    f"🧾 Payment ID: <code>{data['payment_id']}</code>"
+                ),
+                parse_mode="HTML",
+            )
+        except Exception as e:
+            logger.warning(f"Failed to notify admin {admin_id} about payment {data['payment_id']}: {e}")
+
+
+async def _notify_admins_subscription_expired(bot: Bot, cfg, data: dict) -> None:
+    product = data["product"]
+    tg_user_id = data["tg_user_id"]
+    expires_at = _parse_dt(data["expires_at"])
+    if expires_at is not None:
+        expires_at_text = expires_at.astimezone(BRAZIL_TZ).strftime("%d.%m.%Y %H:%M")
+    else:
+        expires_at_text = "unknown"
+
+    if product in (YOGA_4, YOGA_8):
+        channel_id = cfg.yoga_channel_4_id if product == YOGA_4 else cfg.yoga_channel_8_id
+        channel_tag = "yoga_4" if product == YOGA_4 else "yoga_8"
+        admin_text = (
+            "🚫 Удаление из канала\n"
+            f"• tg_id: {tg_user_id}\n"
+            f"• user_id: {data['user_id']}\n"
+            f"• продукт: {channel_tag}\n"
+            f"• канал: {channel_id}\n"
+            f"• expires_at (Rio): {expires_at_text}\n"
+            f"• sub_id: {data['sub_id']}"
+        )
+    else:
+        # Индивидуальный формат может не иметь группового канала
+        admin_text = (
+            "⏳ Подписка истекла (без канала)\n"
+            f"• tg_id: {tg_user_id}\n"
+            f"• user_id: {data['user_id']}\n"
+            f"• продукт: {product}\n"
+            f"• expires_at (Rio): {expires_at_text}\n"
+            f"• sub_id: {data['sub_id']}"
+        )
+
+    for admin_id in cfg.admin_ids:
+        try:
+            await bot.send_message(admin_id, admin_text)
+        except Exception as e:
+            logger.warning(f"Failed to notify admin {admin_id}: {e}")
+
+
+def _checkout_expired_text(orders: list) -> str:
+    titles = [DIRECTION_TITLES.get(o["direction"], o["direction"]) for o in orders]
+    if len(titles) == 1:
+        head = f"⌛ Заказ «{titles[0]}» отменён: оплата так и не поступила."
+    else:
+        head = "⌛ Заказы отменены, оплата так и не поступила: " + ", ".join(f"«{t}»" for t in titles) + "."
+    return head + "\nЕсли ещё актуально — оформи заново через /menu."
+
+
+def register_outbox_handlers(dispatcher: OutboxDispatcher, *, bot: Bot, cfg, storage: BaseStorage) -> None:
+    """Зарегистрировать обработчики outbox для оплаты, истечения подписок и брошенных заказов."""
+
+    async def payment_approved(message: OutboxMessage) -> None:
+        data = message.payload
+
+        async def step(name: str, action: Callable[[], Awaitable[None]]) -> None:
+            await dispatcher.run_step(message, name, action)
+
+        try:
+            await _send_payment_confirmation(bot, storage, cfg, data, step)
+        except TelegramForbiddenError as e:
+            logger.warning(f"User {data['tg_user_id']} blocked the bot, payment {data['payment_id']}: {e}")
+        await step("admins", lambda: _notify_admins_payment_approved(bot, cfg, data))
+
+    async def subscription_expired(message: OutboxMessage) -> None:
+        data = message.payload
+        tg_user_id = data["tg_user_id"]
+        product = data["product"]
+
+        # Определяем канал и отзываем доступ
+        if product == YOGA_4:
+            await kick_user(bot, cfg.yoga_channel_4_id, tg_user_id)
+            logger.info(f"Revoked yoga_4 access for user {tg_user_id}")
+        elif product == YOGA_8:
+            await kick_user(bot, cfg.yoga_channel_8_id, tg_user_id)
+            logger.info(f"Revoked yoga_8 access for user {tg_user_id}")
+        elif product == YOGA_10IND:
+            # Индивидуальный формат может не использовать групповой канал
+            logger.info(f"Logged revoke for yoga_individual user {tg_user_id}")
+
+        try:
+            await bot.send_message(
+                tg_user_id,
+                "⏳ Доступ к йоге закончился. Нажми /menu чтобы продлить."
+            )
+        except TelegramForbiddenError as e:
+            logger.warning(f"Failed to notify user {tg_user_id} about expired yoga access: {e}")
+
+        await _notify_admins_subscription_expired(bot, cfg, data)
+
+    async def checkout_expired(message: OutboxMessage) -> None:
+        data = message.payload
+        try:
+            await bot.send_message(data["tg_user_id"], _checkout_expired_text(data["orders"]))
+        except TelegramForbiddenError as e:
+            logger.warning(f"Failed to notify user {data['tg_user_id']} about expired checkout: {e}")
+
+    dispatcher.register(OUTBOX_PAYMENT_APPROVED, payment_approved)
+    dispatcher.register(OUTBOX_SUBSCRIPTION_EXPIRED, subscription_expired)
+    dispatcher.register(OUTBOX_CHECKOUT_EXPIRED, checkout_expired)
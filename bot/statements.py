@@ -0,0 +1,609 @@
+from __future__ import annotations
+
+import re
+from typing import Dict, FrozenSet
+
+# Каталог именованных SQL-запросов.
+#
+# Каждый запрос Database вызывается по стабильному имени "<область>.<действие>".
+# Все запросы каталога подготавливаются (PREPARE) на каждом новом соединении
+# пула, а метрики и логи пишутся по имени, а не по тексту запроса.
+#
+# Статусы в горячих запросах записаны литералами, а не параметрами: после
+# нескольких выполнений Postgres переходит на generic plan, и только с
+# литералом планировщик может доказать предикат частичного индекса
+# (см. migrations/0002_workload_indexes.sql). Литералы совпадают со значениями
+# OrderStatus / PaymentStatus / SubscriptionStatus из bot.db.
+STATEMENTS: Dict[str, str] = {
+    # ==================== Users ====================
+
+    # Атомарный upsert пользователя за один round trip.
+    # UPDATE срабатывает только при изменении профиля; если строка не менялась,
+    # RETURNING пуст и id берётся из второй ветки UNION.
+    "users.upsert": """
+        WITH upserted AS (
+            INSERT INTO users(tg_user_id, username, first_name)
+            VALUES($1, $2, $3)
+            ON CONFLICT (tg_user_id) DO UPDATE
+            SET username = EXCLUDED.username,
+                first_name = EXCLUDED.first_name
+            WHERE users.username IS DISTINCT FROM EXCLUDED.username
+               OR users.first_name IS DISTINCT FROM EXCLUDED.first_name
+            RETURNING id, (xmax = 0) AS inserted
+        )
+        SELECT id, inserted FROM upserted
+        UNION ALL
+        SELECT id, FALSE AS inserted FROM users WHERE tg_user_id = $1
+        LIMIT 1
+    """,
+
+    "users.id_by_tg": """
+        SELECT id FROM users WHERE tg_user_id=$1
+    """,
+
+    # ==================== Checkout ====================
+
+    # Открытый платёж ищется в проекции open_payments по PK. Новая пара
+    # order + payment сразу попадает в проекцию; если параллельный checkout того
+    # же пользователя успел раньше, INSERT в проекцию падает с UniqueViolation,
+    # весь запрос откатывается, и Database.open_checkout повторяет его.
+    "checkout.open": """
+        WITH owner AS (
+            SELECT tg_user_id FROM users WHERE id = $1
+        ), existing AS (
+            SELECT op.order_id, op.direction, op.payment_id, op.status AS payment_status
+            FROM open_payments op
+            WHERE op.tg_user_id = (SELECT tg_user_id FROM owner)
+            ORDER BY (op.direction = $2) DESC, op.created_at DESC, op.payment_id DESC
+            LIMIT 1
+        ), new_order AS (
+            INSERT INTO orders(user_id, direction, payload_json, status)
+            SELECT $1, $2, $3, $4
+            WHERE NOT EXISTS (SELECT 1 FROM existing)
+            RETURNING id
+        ), new_payment AS (
+            INSERT INTO payments(order_id, method, currency, amount, status)
+            SELECT id, $5, $6, $7, 'pending' FROM new_order
+            RETURNING id, order_id, status, method, currency, amount, created_at, updated_at
+        ), projected AS (
+            INSERT INTO open_payments(
+                tg_user_id, direction, order_id, payment_id, status,
+                method, currency, amount, created_at, updated_at
+            )
+            SELECT (SELECT tg_user_id FROM owner), $2, order_id, id, status,
+                   method, currency, amount, created_at, updated_at
+            FROM new_payment
+        )
+        SELECT order_id, id AS payment_id, status AS payment_status,
+               $2::text AS direction, TRUE AS created
+        FROM new_payment
+        UNION ALL
+        SELECT order_id, payment_id, payment_status, direction, FALSE AS created
+        FROM existing
+    """,
+
+    # Отмена брошенных оформлений: заказы draft/awaiting_payment старше $1, у
+    # которых все платежи ещё pending (или уже закрыты) и не менялись с $1.
+    # Присланный чек или свежий платёж заказ не отменяют. Пачками по $2,
+    # SKIP LOCKED — не ждём заказы, которые прямо сейчас оплачивают.
+    # Повторная проверка status в UPDATE/DELETE пропускает платёж, чек по
+    # которому пришёл после снимка запроса.
+    "checkout.reap_stale": """
+        WITH doomed AS (
+            SELECT o.id FROM orders o
+            WHERE o.status IN ('draft', 'awaiting_payment') AND o.created_at < $1
+              AND NOT EXISTS (
+                  SELECT 1 FROM payments p
+                  WHERE p.order_id = o.id
+                    AND (p.status NOT IN ('pending', 'cancelled', 'rejected')
+                         OR p.updated_at >= $1)
+              )
+            ORDER BY o.created_at, o.id
+            LIMIT $2
+            FOR UPDATE SKIP LOCKED
+        ), closed AS (
+            DELETE FROM open_payments op USING doomed d
+            WHERE op.order_id = d.id AND op.status = 'pending'
+        ), cancelled_payments AS (
+            UPDATE payments p
+            SET status = 'cancelled', updated_at = NOW()
+            FROM doomed d
+            WHERE p.order_id = d.id AND p.status = 'pending'
+            RETURNING p.id, p.order_id
+        ), cancelled_orders AS (
+            UPDATE orders o
+            SET status = 'cancelled'
+            FROM doomed d
+            WHERE o.id = d.id
+            RETURNING o.id, o.user_id, o.direction
+        )
+        SELECT c.id AS order_id, c.direction,
+               (SELECT u.tg_user_id FROM users u WHERE u.id = c.user_id) AS tg_user_id,
+               ARRAY(SELECT cp.id FROM cancelled_payments cp WHERE cp.order_id = c.id) AS payment_ids
+        FROM cancelled_orders c
+        ORDER BY c.id
+    """,
+
+    # ==================== Orders ====================
+
+    "orders.get": """
+        SELECT id, user_id, direction, payload_json, status, created_at
+        FROM orders
+        WHERE id=$1
+    """,
+
+    "orders.owner": """
+        SELECT u.id AS user_id, u.tg_user_id
+        FROM orders o
+        JOIN users u ON u.id = o.user_id
+        WHERE o.id=$1
+    """,
+
+    "orders.cancel": """
+        UPDATE orders
+        SET status=$2
+        WHERE id=$1 AND status IN ($3, $4)
+    """,
+
+    # ==================== Payments ====================
+
+    "payments.get": """
+        SELECT id, order_id, method, currency, amount, status,
+               proof_file_id, admin_id_approved, created_at, updated_at
+        FROM payments
+        WHERE id=$1
+    """,
+
+    "payments.set_proof": """
+        WITH projected AS (
+            UPDATE open_payments
+            SET status=$2, proof_file_id=$3, updated_at=NOW()
+            WHERE payment_id=$1
+        )
+        UPDATE payments
+        SET status=$2, proof_file_id=$3, updated_at=NOW()
+        WHERE id=$1
+    """,
+
+    # Используется и для approve, и для reject: статус передаётся параметром.
+    # Решённый платёж уходит из проекции открытых.
+    "payments.resolve": """
+        WITH closed AS (
+            DELETE FROM open_payments WHERE payment_id=$1
+        )
+        UPDATE payments
+        SET status=$2, admin_id_approved=$3, updated_at=NOW()
+        WHERE id=$1
+    """,
+
+    # Подтверждение админом: блокируем платёж и пользователя до конца транзакции.
+    # Блокировка пользователя сериализует параллельные подтверждения разных
+    # платежей одного пользователя (иначе подписка продлится по устаревшему сроку).
+    # NO KEY UPDATE не мешает вставкам, ссылающимся на эти строки по FK.
+    "payments.lock_for_approval": """
+        SELECT p.status AS payment_status,
+               o.id, o.user_id, o.direction, o.payload_json, o.status, o.created_at,
+               u.tg_user_id
+        FROM payments p
+        JOIN orders o ON o.id = p.order_id
+        JOIN users u ON u.id = o.user_id
+        WHERE p.id = $1
+        FOR NO KEY UPDATE OF p, u
+    """,
+
+    "payments.approve": """
+        WITH closed AS (
+            DELETE FROM open_payments WHERE payment_id=$1
+        ), paid AS (
+            UPDATE payments
+            SET status=$3, admin_id_approved=$2, updated_at=NOW()
+            WHERE id=$1
+        )
+        UPDATE orders SET status=$5 WHERE id=$4
+    """,
+
+    "payments.cancel_open_for_order": """
+        WITH closed AS (
+            DELETE FROM open_payments WHERE order_id=$1
+        )
+        UPDATE payments
+        SET status=$2
+        WHERE order_id=$1 AND status IN ('pending', 'proof_submitted')
+        RETURNING id
+    """,
+
+    "payments.open_for_order": """
+        SELECT id, order_id, method, currency, amount, status,
+               proof_file_id, admin_id_approved, created_at, updated_at
+        FROM payments
+        WHERE order_id = $1
+          AND status IN ('pending', 'proof_submitted')
+        ORDER BY created_at DESC, id DESC
+        LIMIT 1
+    """,
+
+    # ==================== Subscriptions ====================
+
+    "subscriptions.create": """
+        INSERT INTO subscriptions(user_id, product, expires_at, last_payment_id, channel_id)
+        VALUES($1, $2, $3, $4, $5)
+        RETURNING id
+    """,
+
+    "subscriptions.active_yoga": """
+        SELECT id, user_id, product, expires_at, last_payment_id, channel_id, status
+        FROM subscriptions
+        WHERE user_id = $1
+          AND product LIKE 'yoga_%'
+          AND status = 'active'
+          AND (expires_at IS NULL OR expires_at > NOW())
+        ORDER BY expires_at DESC NULLS FIRST, id DESC
+        LIMIT 1
+    """,
+
+    "subscriptions.latest_yoga_id": """
+        SELECT id FROM subscriptions
+        WHERE user_id = $1 AND product LIKE 'yoga_%'
+        ORDER BY id DESC
+        LIMIT 1
+    """,
+
+    "subscriptions.update_yoga": """
+        UPDATE subscriptions
+        SET product = $2, expires_at = $3, last_payment_id = $4,
+            channel_id = $5, status = $6
+        WHERE id = $1
+    """,
+
+    "subscriptions.any_yoga": """
+        SELECT 1 FROM subscriptions WHERE user_id=$1 AND product LIKE 'yoga_%' LIMIT 1
+    """,
+
+    # Последняя непросроченная подписка пользователя (без фильтра по продукту)
+    "subscriptions.latest_unexpired": """
+        SELECT id, product, expires_at FROM subscriptions
+        WHERE user_id=$1 AND expires_at > NOW()
+        ORDER BY expires_at DESC LIMIT 1
+    """,
+
+    "subscriptions.extend": """
+        UPDATE subscriptions SET product=$2, expires_at=$3, last_payment_id=$4 WHERE id=$1
+    """,
+
+    # Страница keyset-пагинации по (expires_at, id) — ключ idx_subscriptions_active_expires.
+    # $1 — момент начала обхода, ($2, $3) — последняя строка предыдущей страницы.
+    # tg_user_id берётся подзапросом по users_pkey: generic plan не знает,
+    # сколько подписок уже истекло, и для JOIN выбирал Seq Scan по users.
+    "subscriptions.due_page": """
+        SELECT s.id, s.user_id,
+               (SELECT u.tg_user_id FROM users u WHERE u.id = s.user_id) AS tg_user_id,
+               s.product, s.expires_at
+        FROM subscriptions s
+        WHERE s.status = 'active'
+          AND s.expires_at <= $1
+          AND (s.expires_at, s.id) > ($2, $3)
+        ORDER BY s.expires_at, s.id
+        LIMIT $4
+    """,
+
+    "subscriptions.expired_yoga_with_channel": """
+        SELECT s.id, s.channel_id,
+               (SELECT u.tg_user_id FROM users u WHERE u.id = s.user_id) AS tg_user_id
+        FROM subscriptions s
+        WHERE s.product LIKE 'yoga_%'
+          AND s.expires_at <= $1
+          AND s.status = 'active'
+          AND s.channel_id IS NOT NULL
+    """,
+
+    # Массовое истечение: меняются только ещё активные подписки, RETURNING
+    # отдаёт ровно те строки, по которым нужно выполнить действия в Telegram
+    "subscriptions.expire_bulk": """
+        WITH expired AS (
+            UPDATE subscriptions
+            SET status = 'expired'
+            WHERE id = ANY($1::bigint[]) AND status = 'active'
+            RETURNING id, user_id, product, expires_at
+        )
+        SELECT e.id, e.user_id, u.tg_user_id, e.product, e.expires_at
+        FROM expired e
+        JOIN users u ON u.id = e.user_id
+        ORDER BY e.id
+    """,
+
+    "subscriptions.expiring_between": """
+        SELECT s.id, s.user_id, s.product, s.expires_at, s.feedback_sent_at,
+               u.tg_user_id
+        FROM subscriptions s
+        JOIN users u ON u.id = s.user_id
+        WHERE s.product LIKE 'yoga_%'
+          AND s.status = 'active'
+          AND s.expires_at BETWEEN $1 AND $2
+        ORDER BY s.expires_at ASC
+    """,
+
+    # Страница подписок, истекающих до $3: ($1, $2) — курсор (expires_at, id)
+    "subscriptions.expiring_between_page": """
+        SELECT s.id, s.user_id, s.product, s.expires_at, s.feedback_sent_at,
+               (SELECT u.tg_user_id FROM users u WHERE u.id = s.user_id) AS tg_user_id
+        FROM subscriptions s
+        WHERE s.product LIKE 'yoga_%'
+          AND s.status = 'active'
+          AND (s.expires_at, s.id) > ($1, $2)
+          AND s.expires_at <= $3
+        ORDER BY s.expires_at, s.id
+        LIMIT $4
+    """,
+
+    "subscriptions.mark_feedback_sent": """
+        UPDATE subscriptions SET feedback_sent_at = NOW() WHERE id = $1
+    """,
+
+    "subscriptions.feedback_status": """
+        SELECT id, feedback_sent_at FROM subscriptions WHERE id = $1
+    """,
+
+    # ==================== Channel Access ====================
+
+    "channel_access.grant": """
+        INSERT INTO channel_access_log(user_id, channel_key, invite_link)
+        VALUES($1, $2, $3)
+    """,
+
+    # $1 и $2 — параллельные массивы (user_id[i], channel_key[i])
+    "channel_access.revoke_bulk": """
+        UPDATE channel_access_log c
+        SET revoked_at = NOW()
+        FROM unnest($1::bigint[], $2::text[]) AS r(user_id, channel_key)
+        WHERE c.user_id = r.user_id
+          AND c.channel_key = r.channel_key
+          AND c.revoked_at IS NULL
+    """,
+
+    # ==================== Archive ====================
+
+    # Перенос отменённых заказов старше $1 вместе со всеми их платежами, если
+    # среди платежей нет оплаченных или незавершённых. Пачками по $2.
+    # FK payments.order_id проверяется в конце запроса, когда платежи уже удалены.
+    "archive.orders": """
+        WITH doomed AS (
+            SELECT o.id FROM orders o
+            WHERE o.status = 'cancelled' AND o.created_at < $1
+              AND NOT EXISTS (
+                  SELECT 1 FROM payments p
+                  WHERE p.order_id = o.id
+                    AND (p.status NOT IN ('cancelled', 'rejected')
+                         OR EXISTS (SELECT 1 FROM subscriptions s WHERE s.last_payment_id = p.id))
+              )
+            ORDER BY o.created_at, o.id
+            LIMIT $2
+            FOR UPDATE SKIP LOCKED
+        ), moved_payments AS (
+            DELETE FROM payments p USING doomed d
+            WHERE p.order_id = d.id
+            RETURNING p.*
+        ), archived_payments AS (
+            INSERT INTO archive.payments SELECT * FROM moved_payments
+        ), moved_orders AS (
+            DELETE FROM orders o USING doomed d
+            WHERE o.id = d.id
+            RETURNING o.*
+        )
+        INSERT INTO archive.orders SELECT * FROM moved_orders
+    """,
+
+    # Перенос закрытых платежей старше $1 у оставшихся заказов (отклонённые
+    # чеки оплаченных заказов и т.п.). Пачками по $2.
+    "archive.payments": """
+        WITH doomed AS (
+            SELECT p.id FROM payments p
+            WHERE p.status IN ('cancelled', 'rejected') AND p.updated_at < $1
+              AND NOT EXISTS (SELECT 1 FROM subscriptions s WHERE s.last_payment_id = p.id)
+            ORDER BY p.updated_at, p.id
+            LIMIT $2
+            FOR UPDATE SKIP LOCKED
+        ), moved AS (
+            DELETE FROM payments p USING doomed d
+            WHERE p.id = d.id
+            RETURNING p.*
+        )
+        INSERT INTO archive.payments SELECT * FROM moved
+    """,
+
+    # Функции из миграции 0005: создают/отсоединяют партиции channel_access_log
+    "archive.ensure_partitions": """
+        SELECT ensure_channel_access_partitions($1) AS created
+    """,
+
+    "archive.detach_partitions": """
+        SELECT archive_channel_access_partitions($1) AS archived
+    """,
+
+    # ==================== Outbox ====================
+
+    "outbox.enqueue": """
+        INSERT INTO outbox(kind, payload, idempotency_key)
+        VALUES($1, $2, $3)
+        ON CONFLICT (idempotency_key) DO NOTHING
+    """,
+
+    "outbox.enqueue_bulk": """
+        INSERT INTO outbox(kind, payload, idempotency_key)
+        SELECT * FROM unnest($1::text[], $2::jsonb[], $3::text[])
+        ON CONFLICT (idempotency_key) DO NOTHING
+    """,
+
+    # Забрать пачку к доставке. SKIP LOCKED: воркеры (и процессы) не ждут друг
+    # друга и не берут одно сообщение дважды. available_at сдвигается на время
+    # аренды — если воркер умрёт, сообщение вернётся в очередь само.
+    "outbox.claim": """
+        UPDATE outbox o
+        SET attempts = o.attempts + 1,
+            available_at = NOW() + make_interval(secs => $2)
+        FROM (
+            SELECT id FROM outbox
+            WHERE status = 'pending' AND available_at <= NOW()
+            ORDER BY available_at, id
+            LIMIT $1
+            FOR UPDATE SKIP LOCKED
+        ) due
+        WHERE o.id = due.id
+        RETURNING o.id, o.kind, o.payload, o.idempotency_key, o.attempts, o.completed_steps
+    """,
+
+    # Продлить аренду перед доставкой очередного сообщения пачки. attempts —
+    # метка аренды: если сообщение успели забрать заново (аренда истекла,
+    # attempts увеличен), строка не обновится и доставлять его нельзя.
+    "outbox.renew": """
+        UPDATE outbox
+        SET available_at = NOW() + make_interval(secs => $3)
+        WHERE id=$1 AND attempts=$2 AND status='pending'
+    """,
+
+    # Отметить шаг обработчика выполненным (повтор его пропустит)
+    "outbox.step_done": """
+        UPDATE outbox
+        SET completed_steps = array_append(completed_steps, $2)
+        WHERE id=$1 AND NOT ($2 = ANY(completed_steps))
+    """,
+
+    # done / retry / dead записываются, только пока аренда своя (attempts
+    # совпадает): иначе сообщение уже забрал другой воркер, и отметка
+    # затёрла бы его результат.
+    "outbox.done": """
+        UPDATE outbox
+        SET status='done', processed_at=NOW(), last_error=NULL
+        WHERE id=$1 AND attempts=$2
+    """,
+
+    "outbox.retry": """
+        UPDATE outbox
+        SET available_at = NOW() + make_interval(secs => $3), last_error=$4
+        WHERE id=$1 AND attempts=$2
+    """,
+
+    "outbox.dead": """
+        UPDATE outbox
+        SET status='dead', processed_at=NOW(), last_error=$3
+        WHERE id=$1 AND attempts=$2
+    """,
+
+    "outbox.purge": """
+        DELETE FROM outbox
+        WHERE status <> 'pending' AND processed_at < $1
+    """,
+
+    # ==================== FSM Storage ====================
+
+    # Состояние FSM (bot/storage/postgres.py). Строки старше $2 секунд считаются
+    # истёкшими, даже если fsm.purge их ещё не удалил.
+    "fsm.get": """
+        SELECT state, data, updated_at
+        FROM fsm_storage
+        WHERE key = $1 AND updated_at > NOW() - make_interval(secs => $2)
+    """,
+
+    # Запись накопленных изменений одним запросом: $1..$4 — параллельные массивы
+    # (key, user_id, state, data). Пустое состояние удаляет строку.
+    "fsm.write": """
+        WITH batch AS (
+            SELECT * FROM unnest($1::text[], $2::bigint[], $3::text[], $4::jsonb[])
+                AS b(key, user_id, state, data)
+        ), removed AS (
+            DELETE FROM fsm_storage f USING batch b
+            WHERE f.key = b.key AND b.state IS NULL AND b.data = '{}'::jsonb
+        )
+        INSERT INTO fsm_storage(key, user_id, state, data, updated_at)
+        SELECT key, user_id, state, data, NOW() FROM batch
+        WHERE state IS NOT NULL OR data <> '{}'::jsonb
+        ON CONFLICT (key) DO UPDATE
+        SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+    """,
+
+    # Удаление истёкших состояний пачками по $2. По ctid, а не по key: общий
+    # план не знает $2 и соединение по key уводил в Hash Join с полным сканом.
+    # Строки заблокированы подзапросом, ctid до удаления не изменится.
+    "fsm.purge": """
+        DELETE FROM fsm_storage
+        WHERE ctid = ANY(ARRAY(
+            SELECT ctid FROM fsm_storage
+            WHERE updated_at < NOW() - make_interval(secs => $1)
+            ORDER BY updated_at
+            LIMIT $2
+            FOR UPDATE SKIP LOCKED
+        ))
+    """,
+
+    # ==================== Stats ====================
+
+    # Пересчитать дневные агрегаты за изменившиеся дни (миграция 0008)
+    "stats.refresh": """
+        SELECT refresh_daily_stats($1, make_interval(secs => $2)) AS days
+    """,
+
+    "stats.state": """
+        SELECT tz, refreshed_at FROM stats_refresh_state
+    """,
+
+    "stats.revenue": """
+        SELECT direction, method, currency,
+               SUM(payments)::int AS payments, SUM(amount)::bigint AS amount
+        FROM stats_daily_revenue
+        WHERE day >= $1 AND day < $2
+        GROUP BY direction, method, currency
+        ORDER BY currency, amount DESC
+    """,
+
+    "stats.subscriptions": """
+        SELECT product,
+               SUM(new)::int AS new, SUM(renewed)::int AS renewed, SUM(expired)::int AS expired
+        FROM stats_daily_subscriptions
+        WHERE day >= $1 AND day < $2
+        GROUP BY product
+        ORDER BY product
+    """,
+
+    "stats.proofs": """
+        SELECT COALESCE(SUM(payments), 0)::int AS payments,
+               COALESCE(SUM(proofs_submitted), 0)::int AS proofs_submitted,
+               COALESCE(SUM(approved), 0)::int AS approved,
+               COALESCE(SUM(rejected), 0)::int AS rejected
+        FROM stats_daily_proofs
+        WHERE day >= $1 AND day < $2
+    """,
+
+    # ==================== Replica ====================
+
+    # Отставание реплики в секундах: 0, если всё полученное WAL уже применено
+    # (иначе простаивающая реплика выглядела бы отстающей); NULL на primary
+    "replica.lag": """
+        SELECT CASE
+                   WHEN NOT pg_is_in_recovery() THEN NULL
+                   WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                   ELSE EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp())
+               END::float8 AS lag
+    """,
+}
+
+
+_LOCKING_CLAUSE = re.compile(r"\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b")
+
+
+def _is_read_only(sql: str) -> bool:
+    text = " ".join(sql.split()).upper()
+    return text.startswith("SELECT") and not _LOCKING_CLAUSE.search(text)
+
+
+# SELECT, которые вызывают пишущие функции
+_WRITING_SELECTS: FrozenSet[str] = frozenset({
+    "archive.ensure_partitions",
+    "archive.detach_partitions",
+    "stats.refresh",
+})
+
+# Запросы без побочных эффектов: их можно выполнять на реплике.
+# Всё, что начинается с WITH (CTE с INSERT/UPDATE/DELETE), считается записью.
+READ_ONLY_STATEMENTS: FrozenSet[str] = frozenset(
+    name for name, sql in STATEMENTS.items()
+    if _is_read_only(sql) and name not in _WRITING_SELECTS
+)
@@ -0,0 +1,2 @@
+from .memory import BoundedMemoryStorage
+from .postgres import PostgresStorage
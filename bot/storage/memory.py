@@ -0,0 +1,252 @@
+"""
+FSM-хранилище aiogram в памяти процесса с ограничением размера и TTL.
+
+Замена MemoryStorage для запуска в один экземпляр (FSM_STORAGE=memory):
+MemoryStorage хранит запись каждого, кто однажды открыл меню, до остановки
+процесса. Здесь состояний не больше max_entries (сверх — вытесняются давно
+неактивные), а состояние без обращений дольше TTL своей группы
+("LangFlow:goal" -> LangFlow) считается брошенным и удаляется.
+
+С snapshot_path состояния сохраняются в файл при close() и поднимаются при
+следующем запуске — деплой не сбрасывает пользователей посреди оформления.
+Файл удаляется после загрузки: после падения процесса старый снимок не
+вернёт состояния, которые с тех пор уже были очищены.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from bot.config import FsmStorageSettings
+from bot.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+# раз в сколько секунд при записи проверять TTL всех состояний
+SWEEP_INTERVAL = 60.0
+# примерные накладные расходы на запись сверх строк ключа, состояния и данных
+ENTRY_OVERHEAD_BYTES = 600
+
+FSM_MEMORY_ENTRIES = "fsm_memory_entries"
+FSM_MEMORY_BYTES = "fsm_memory_bytes"
+FSM_MEMORY_EVICTED = "fsm_memory_evicted_total"
+REGISTRY.describe(FSM_MEMORY_ENTRIES, "FSM states held in process memory")
+REGISTRY.describe(FSM_MEMORY_BYTES, "Estimated memory held by in-process FSM states")
+REGISTRY.describe(FSM_MEMORY_EVICTED, "FSM states dropped from memory by reason (lru/ttl)")
+
+
+@dataclass
+class _Entry:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    # последнее обращение (time.time()): TTL считается от него
+    touched: float = 0.0
+    size: int = 0
+
+
+def _group(state: Optional[str]) -> Optional[str]:
+    """"LangFlow:goal" -> "LangFlow"; строковые состояния без группы — None."""
+    if state is None or ":" not in state:
+        return None
+    return state.split(":", 1)[0]
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """FSM-хранилище в памяти: LRU на max_entries и TTL простоя по группам состояний."""
+
+    def __init__(self, settings: Optional[FsmStorageSettings] = None, clock=time.time):
+        """
+        Args:
+            settings: max_entries, ttl_seconds, group_ttl_seconds, snapshot_path
+                (по умолчанию FsmStorageSettings())
+            clock: Источник времени (секунды epoch: снимок переживает перезапуск)
+        """
+        self._settings = settings or FsmStorageSettings()
+        if self._settings.max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        self._clock = clock
+        self._entries: "OrderedDict[StorageKey, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._last_sweep = clock()
+        self._evicted_lru = REGISTRY.counter(FSM_MEMORY_EVICTED, reason="lru")
+        self._evicted_ttl = REGISTRY.counter(FSM_MEMORY_EVICTED, reason="ttl")
+        REGISTRY.gauge(FSM_MEMORY_ENTRIES, fn=lambda: len(self._entries))
+        REGISTRY.gauge(FSM_MEMORY_BYTES, fn=lambda: self._bytes)
+
+    # ==================== BaseStorage ====================
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = self._get(key)
+        value = state.state if isinstance(state, State) else state
+        self._put(key, value, entry.data if entry else {})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = self._get(key)
+        return entry.state if entry else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Data must be a dict, got {type(data).__name__}")
+        entry = self._get(key)
+        self._put(key, entry.state if entry else None, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        entry = self._get(key)
+        return entry.data.copy() if entry else {}
+
+    async def close(self) -> None:
+        """Сохранить снимок, если задан snapshot_path."""
+        if self._settings.snapshot_path:
+            self.save_snapshot(self._settings.snapshot_path)
+
+    # ==================== Размер и TTL ====================
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def estimated_bytes(self) -> int:
+        return self._bytes
+
+    def _ttl(self, state: Optional[str]) -> float:
+        return self._settings.group_ttl_seconds.get(_group(state), self._settings.ttl_seconds)
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return now - entry.touched > self._ttl(entry.state)
+
+    def _get(self, key: StorageKey) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        now = self._clock()
+        if self._expired(entry, now):
+            self._remove(key)
+            self._evicted_ttl.inc()
+            return None
+        entry.touched = now
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]) -> None:
+        self._remove(key)
+        if state is None and not data:
+            # пустое состояние (после clear) не хранится
+            return
+        now = self._clock()
+        entry = _Entry(state, data, now, self._estimate(key, state, data))
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while len(self._entries) > self._settings.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._evicted_lru.inc()
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self.sweep(now)
+
+    def _remove(self, key: StorageKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    @staticmethod
+    def _estimate(key: StorageKey, state: Optional[str], data: Dict[str, Any]) -> int:
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        return ENTRY_OVERHEAD_BYTES + len(state or "") + len(payload.encode()) + len(key.destiny)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """
+        Удалить все состояния с истёкшим TTL.
+
+        Returns:
+            Число удалённых состояний
+        """
+        now = self._clock() if now is None else now
+        self._last_sweep = now
+        expired = [k for k, e in self._entries.items() if self._expired(e, now)]
+        for key in expired:
+            self._remove(key)
+        if expired:
+            self._evicted_ttl.inc(len(expired))
+            logger.debug(f"Dropped {len(expired)} idle FSM state(s)")
+        return len(expired)
+
+    # ==================== Снимок ====================
+
+    def save_snapshot(self, path: str) -> int:
+        """
+        Записать живые состояния в файл (через временный файл и rename).
+
+        Состояния с данными, которые не сериализуются в JSON, пропускаются.
+
+        Returns:
+            Число сохранённых состояний
+        """
+        self.sweep()
+        records = []
+        skipped = 0
+        for key, entry in self._entries.items():
+            record = {"key": asdict(key), "state": entry.state, "data": entry.data, "touched": entry.touched}
+            try:
+                json.dumps(record)
+            except (TypeError, ValueError):
+                skipped += 1
+                continue
+            records.append(record)
+
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": SNAPSHOT_VERSION, "entries": records}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        logger.info(
+            f"Saved {len(records)} FSM state(s) to {path}"
+            + (f", skipped {skipped} not JSON-serializable" if skipped else "")
+        )
+        return len(records)
+
+    def load_snapshot(self, path: str) -> int:
+        """
+        Загрузить состояния из файла и удалить его. Истёкшие за время простоя
+        состояния не загружаются.
+
+        Returns:
+            Число загруженных состояний
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to read FSM snapshot {path}: {e}")
+            return 0
+
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring FSM snapshot {path} with version {snapshot.get('version')!r}")
+            os.remove(path)
+            return 0
+
+        now = self._clock()
+        loaded = 0
+        # в файле — от давно неактивных к недавним: порядок LRU сохраняется
+        for record in snapshot.get("entries", []):
+            key = StorageKey(**record["key"])
+            state, data = record["state"], record["data"]
+            if now - record["touched"] > self._ttl(state):
+                continue
+            self._put(key, state, data)
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.touched = record["touched"]
+                loaded += 1
+        os.remove(path)
+        logger.info(f"Loaded {loaded} FSM state(s) from {path}")
+        return loaded
@@ -0,0 +1,239 @@
+"""
+FSM-хранилище aiogram в PostgreSQL (таблица fsm_storage, миграция 0011).
+
+Обработчик за один апдейт обычно делает несколько записей подряд
+(clear → update_data → set_state) и ещё больше чтений: фильтры по состоянию
+читают его на каждом роутере. Поэтому перед БД стоит LRU-кэш, а записи
+копятся в памяти и уходят в БД одним запросом: после обработки апдейта
+(FsmFlushMiddleware) и фоновой задачей раз в flush_interval_seconds — для
+записей вне апдейтов (обработчики outbox) и повторов после ошибок.
+
+Изменения из других экземпляров бота приходят через InvalidationBus:
+триггеры fsm_storage шлют user_id изменённых строк, и кэш забывает этих
+пользователей. Уведомления о своих записях (по application_name пула,
+Database.origin) пропускаются: записанное состояние уже лежит в кэше, и
+следующий апдейт пользователя обходится без запроса к БД.
+
+Состояние без изменений дольше ttl_seconds считается брошенным: при чтении
+оно пустое, а задача fsm_purge удаляет такие строки.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from bot.cache import CACHE_ENTRIES, CACHE_REQUESTS, LRUCache
+from bot.config import FsmStorageSettings
+from bot.invalidation import InvalidationBus
+from bot.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+FSM_FLUSHES = "fsm_storage_flushes_total"
+FSM_FLUSHED_KEYS = "fsm_storage_flushed_keys_total"
+FSM_PENDING = "fsm_storage_pending_keys"
+REGISTRY.describe(FSM_FLUSHES, "FSM storage write-behind flushes by result (ok/error)")
+REGISTRY.describe(FSM_FLUSHED_KEYS, "FSM keys written to the database")
+REGISTRY.describe(FSM_PENDING, "FSM keys changed in memory and not yet written")
+
+
+@dataclass(frozen=True)
+class _Entry:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    # когда состояние менялось последний раз (time.time())
+    touched: float = 0.0
+
+    def expired(self, ttl: float, now: float) -> bool:
+        return now - self.touched > ttl
+
+
+_EMPTY = _Entry()
+
+
+class PostgresStorage(BaseStorage):
+    """FSM-хранилище в PostgreSQL с кэшем и отложенной пакетной записью."""
+
+    def __init__(
+            self,
+            db,
+            settings: Optional[FsmStorageSettings] = None,
+            key_builder: Optional[KeyBuilder] = None
+    ):
+        """
+        Args:
+            db: Database (запросы fsm.* из каталога)
+            settings: Размер кэша, TTL и период записи (по умолчанию FsmStorageSettings())
+            key_builder: Построитель строкового ключа (по умолчанию учитывает
+                бота, business connection и destiny)
+        """
+        self._db = db
+        self._settings = settings or FsmStorageSettings()
+        self._key_builder = key_builder or DefaultKeyBuilder(
+            with_bot_id=True, with_business_connection_id=True, with_destiny=True
+        )
+        # user_id -> {ключ -> состояние}: уведомления приходят по user_id
+        self._cache: LRUCache[int, Dict[str, _Entry]] = LRUCache(self._settings.cache_size)
+        # ключ -> (user_id, состояние), ещё не записанные в БД
+        self._pending: Dict[str, tuple] = {}
+        # пачка, которая записывается прямо сейчас
+        self._inflight: Dict[str, tuple] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self._hits = REGISTRY.counter(CACHE_REQUESTS, cache="fsm", result="hit")
+        self._misses = REGISTRY.counter(CACHE_REQUESTS, cache="fsm", result="miss")
+        REGISTRY.gauge(CACHE_ENTRIES, fn=lambda: len(self._cache), cache="fsm")
+        REGISTRY.gauge(FSM_PENDING, fn=lambda: len(self._pending))
+
+    # ==================== BaseStorage ====================
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._load(key)
+        value = state.state if isinstance(state, State) else state
+        self._store(key, _Entry(value, entry.data, time.time()))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Data must be a dict, got {type(data).__name__}")
+        # несериализуемое значение должно упасть в обработчике, а не при записи пачки
+        json.dumps(data)
+        entry = await self._load(key)
+        self._store(key, _Entry(entry.state, data.copy(), time.time()))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._load(key)).data.copy()
+
+    async def close(self) -> None:
+        """Остановить фоновую запись и записать накопленное."""
+        await self.stop()
+        await self.flush()
+
+    # ==================== Write-behind ====================
+
+    async def start(self) -> None:
+        """Запустить фоновую запись раз в flush_interval_seconds."""
+        if self._task is not None:
+            return
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run(), name="fsm-storage-flush")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopping.set()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def flush(self) -> int:
+        """
+        Записать все накопленные изменения одним запросом.
+
+        Записи сериализуются: иначе более старая пачка могла бы закоммититься
+        после более новой. При ошибке изменения остаются в очереди, если их
+        не перекрыла более новая запись.
+
+        Returns:
+            Число записанных ключей
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+            try:
+                await self._db.execute(
+                    "fsm.write",
+                    list(batch),
+                    [user_id for user_id, _ in batch.values()],
+                    [entry.state for _, entry in batch.values()],
+                    [entry.data for _, entry in batch.values()],
+                )
+            except Exception:
+                REGISTRY.counter(FSM_FLUSHES, result="error").inc()
+                for k, pending in batch.items():
+                    self._pending.setdefault(k, pending)
+                raise
+            finally:
+                self._inflight = {}
+            REGISTRY.counter(FSM_FLUSHES, result="ok").inc()
+            REGISTRY.counter(FSM_FLUSHED_KEYS).inc(len(batch))
+            return len(batch)
+
+    async def _run(self) -> None:
+        interval = self._settings.flush_interval_seconds
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush FSM storage ({len(self._pending)} pending): {e}")
+
+    # ==================== Cache ====================
+
+    def subscribe_invalidation(self, bus: InvalidationBus) -> None:
+        """Забывать пользователей, чьё состояние изменил другой процесс."""
+        bus.subscribe("fsm_storage", self._evict, self._cache.clear, skip_origin=self._db.origin)
+
+    def _evict(self, user_ids: List[int]) -> None:
+        for user_id in user_ids:
+            entries = self._cache.get(user_id)
+            # незаписанное состояние новее того, что в БД
+            if entries is not None and not any(k in self._pending or k in self._inflight for k in entries):
+                self._cache.invalidate(user_id)
+
+    async def _load(self, key: StorageKey) -> _Entry:
+        k = self._key_builder.build(key)
+        entry = self._current(key.user_id, k)
+        if entry is None:
+            self._misses.inc()
+            fetched = await self._fetch(k)
+            # пока шёл запрос, состояние могли записать — оно новее прочитанного
+            entry = self._current(key.user_id, k)
+            if entry is None:
+                entry = fetched
+                self._cache_entry(key.user_id, k, entry)
+        else:
+            self._hits.inc()
+        if entry.expired(self._settings.ttl_seconds, time.time()):
+            return _EMPTY
+        return entry
+
+    def _current(self, user_id: int, k: str) -> Optional[_Entry]:
+        pending = self._pending.get(k) or self._inflight.get(k)
+        if pending is not None:
+            return pending[1]
+        entries = self._cache.get(user_id)
+        return entries.get(k) if entries is not None else None
+
+    async def _fetch(self, k: str) -> _Entry:
+        row = await self._db.fetchrow("fsm.get", k, self._settings.ttl_seconds)
+        if row is None:
+            # отсутствие тоже кэшируется: у большинства пользователей состояния нет
+            return _Entry(touched=time.time())
+        return _Entry(row["state"], row["data"], row["updated_at"].timestamp())
+
+    def _store(self, key: StorageKey, entry: _Entry) -> None:
+        k = self._key_builder.build(key)
+        self._pending[k] = (key.user_id, entry)
+        self._cache_entry(key.user_id, k, entry)
+
+    def _cache_entry(self, user_id: int, k: str, entry: _Entry) -> None:
+        entries = self._cache.get(user_id)
+        if entries is None:
+            entries = {}
+            self._cache.set(user_id, entries)
+        entries[k] = entry
@@ -0,0 +1,245 @@
+"""
+Режим вебхука (BOT_MODE=webhook): HTTP-сервер aiohttp вместо getUpdates.
+
+Telegram присылает апдейты POST-запросами на WebhookSettings.path. Сервер
+проверяет секрет (WEBHOOK_SECRET обязателен), кладёт апдейт в ограниченную очередь и сразу отвечает;
+обрабатывают апдейты workers воркеров. Очередь разбита на шарды по
+пользователю: апдейты одного пользователя обрабатывает один воркер строго
+по порядку (иначе два быстрых нажатия могли бы обогнать друг друга в FSM),
+разные пользователи — параллельно. Если шард заполнен, ответ Telegram
+задерживается до освобождения места — с max_connections это и есть
+обратное давление.
+
+Кроме вебхука сервер отдаёт /healthz и /metrics (REGISTRY в формате
+Prometheus). По SIGTERM сервер перестаёт принимать запросы, /healthz
+отвечает 503, а очередь дорабатывается не дольше drain_timeout_seconds.
+"""
+from __future__ import annotations
+
+import asyncio
+import hmac
+import logging
+import signal
+import time
+from typing import List, Optional, Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
+from aiohttp import web
+
+from bot.config import WebhookSettings
+from bot.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+UPDATES_TOTAL = "updates_total"
+UPDATES_QUEUE_DEPTH = "updates_queue_depth"
+UPDATES_QUEUE_LAG = "updates_queue_lag_seconds"
+UPDATES_PROCESSING = "updates_processing_seconds"
+UPDATES_IN_FLIGHT = "updates_in_flight"
+REGISTRY.describe(UPDATES_TOTAL, "Updates received by the webhook by result (ok/error/rejected)")
+REGISTRY.describe(UPDATES_QUEUE_DEPTH, "Updates waiting in the in-process queue")
+REGISTRY.describe(UPDATES_QUEUE_LAG, "Time an update waited in the queue before processing started")
+REGISTRY.describe(UPDATES_PROCESSING, "Update processing time (middlewares and handlers)")
+REGISTRY.describe(UPDATES_IN_FLIGHT, "Updates being processed right now")
+
+
+def _shard_key(update: Update) -> int:
+    """Пользователь апдейта, иначе чат; апдейты без них раскладываются по update_id."""
+    try:
+        event = update.event
+    except UpdateTypeLookupError:
+        return update.update_id
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    if chat is not None:
+        return chat.id
+    return update.update_id
+
+
+class UpdateQueue:
+    """Ограниченная очередь апдейтов, шардированная по пользователю, и её воркеры."""
+
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = 16, queue_size: int = 1000):
+        """
+        Args:
+            dp: Dispatcher, которому передаются апдейты
+            bot: Бот, от имени которого они обрабатываются
+            workers: Число воркеров (и шардов)
+            queue_size: Сколько апдейтов всего может ждать обработки
+        """
+        if workers <= 0:
+            raise ValueError("workers must be positive")
+        self._dp = dp
+        self._bot = bot
+        shard_size = max(1, queue_size // workers)
+        self._shards: List["asyncio.Queue[Tuple[float, Update]]"] = [
+            asyncio.Queue(maxsize=shard_size) for _ in range(workers)
+        ]
+        self._tasks: List[asyncio.Task] = []
+        self._in_flight = 0
+        self._lag = REGISTRY.histogram(UPDATES_QUEUE_LAG)
+        self._processing = REGISTRY.histogram(UPDATES_PROCESSING)
+        REGISTRY.gauge(UPDATES_QUEUE_DEPTH, fn=lambda: sum(q.qsize() for q in self._shards))
+        REGISTRY.gauge(UPDATES_IN_FLIGHT, fn=lambda: self._in_flight)
+
+    def __len__(self) -> int:
+        return sum(q.qsize() for q in self._shards)
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(shard), name=f"update-worker-{i}")
+            for i, shard in enumerate(self._shards)
+        ]
+
+    async def put(self, update: Update) -> None:
+        """Поставить апдейт в очередь; ждёт, пока в шарде пользователя есть место."""
+        shard = self._shards[_shard_key(update) % len(self._shards)]
+        await shard.put((time.monotonic(), update))
+
+    async def stop(self, timeout: float) -> int:
+        """
+        Дождаться обработки очереди (не дольше timeout) и остановить воркеров.
+
+        Returns:
+            Число апдейтов, которые так и не были обработаны
+        """
+        if not self._tasks:
+            return 0
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._shards)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        left = len(self)
+        if left:
+            logger.warning(f"Update queue not drained in {timeout:g}s, dropping {left} update(s)")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        return left
+
+    async def _worker(self, shard: "asyncio.Queue[Tuple[float, Update]]") -> None:
+        while True:
+            enqueued, update = await shard.get()
+            started = time.monotonic()
+            self._lag.observe(started - enqueued)
+            self._in_flight += 1
+            try:
+                await self._dp.feed_update(self._bot, update)
+            except Exception as e:
+                REGISTRY.counter(UPDATES_TOTAL, result="error").inc()
+                logger.exception(f"Failed to process update {update.update_id}: {e}")
+            else:
+                REGISTRY.counter(UPDATES_TOTAL, result="ok").inc()
+            finally:
+                self._in_flight -= 1
+                self._processing.observe(time.monotonic() - started)
+                shard.task_done()
+
+
+class WebhookServer:
+    """aiohttp-сервер: приём апдейтов, /healthz и /metrics."""
+
+    def __init__(self, bot: Bot, settings: WebhookSettings, queue: UpdateQueue):
+        if not settings.secret_token:
+            raise ValueError("Webhook server requires a secret token")
+        self._bot = bot
+        self._settings = settings
+        self._queue = queue
+        self._draining = False
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_post(settings.path, self._handle_update)
+        self.app.router.add_get("/healthz", self._handle_health)
+        self.app.router.add_get("/metrics", self._handle_metrics)
+
+    async def start(self) -> None:
+        s = self._settings
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(
+            self._runner, s.listen_host, s.listen_port, shutdown_timeout=s.drain_timeout_seconds
+        )
+        await site.start()
+        logger.info(f"Webhook server listening on {s.listen_host}:{s.listen_port}{s.path}")
+
+    async def stop(self) -> None:
+        """Перестать принимать апдейты; уже принятые запросы дожидаются места в очереди."""
+        self._draining = True
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self._settings.secret_token):
+            REGISTRY.counter(UPDATES_TOTAL, result="rejected").inc()
+            return web.Response(status=401)
+        if self._draining:
+            # Telegram повторит доставку — уже другому экземпляру
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self._bot})
+        except ValueError as e:
+            REGISTRY.counter(UPDATES_TOTAL, result="rejected").inc()
+            logger.warning(f"Rejected malformed webhook update: {e}")
+            return web.Response(status=400)
+        await self._queue.put(update)
+        return web.Response()
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        if self._draining:
+            return web.Response(status=503, text="draining")
+        return web.Response(text="ok")
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=REGISTRY.render(), content_type="text/plain")
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, settings: WebhookSettings) -> None:
+    """
+    Принимать апдейты вебхуком до SIGTERM/SIGINT, затем доработать очередь.
+
+    Если задан public_url, вебхук регистрируется в Telegram при запуске.
+    При остановке он не снимается: во время деплоя апдейты копятся у
+    Telegram и достаются новому экземпляру.
+    """
+    queue = UpdateQueue(dp, bot, settings.workers, settings.queue_size)
+    server = WebhookServer(bot, settings, queue)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    signals = (signal.SIGTERM, signal.SIGINT)
+    for sig in signals:
+        loop.add_signal_handler(sig, stop.set)
+
+    workflow_data = {"dispatcher": dp, **dp.workflow_data}
+    await dp.emit_startup(bot=bot, **workflow_data)
+    queue.start()
+    try:
+        await server.start()
+        if settings.public_url:
+            await bot.set_webhook(
+                url=settings.public_url.rstrip("/") + settings.path,
+                secret_token=settings.secret_token,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=settings.max_connections,
+            )
+            logger.info(f"Webhook set to {settings.public_url.rstrip('/')}{settings.path}")
+        await stop.wait()
+    finally:
+        for sig in signals:
+            loop.remove_signal_handler(sig)
+        logger.info(f"Draining webhook: {len(queue)} update(s) queued")
+        deadline = time.monotonic() + settings.drain_timeout_seconds
+        await server.stop()
+        await queue.stop(max(0.0, deadline - time.monotonic()))
+        await dp.emit_shutdown(bot=bot, **workflow_data)
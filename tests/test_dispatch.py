@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+
+import pytest
+
+from bot.handlers.dispatch import CallbackRouter, StateRouter, parse_callback_data
+from bot.states.states import LangFlow, YogaFlow
+
+
+async def any_pay(call, **kwargs): ...
+async def pay_lang(call, **kwargs): ...
+async def pay_lang_in_payment(call, **kwargs): ...
+async def menu(call, **kwargs): ...
+async def direction(call, **kwargs): ...
+
+
+def resolved(router: CallbackRouter, data, state=None):
+    found = router.resolve(data, state)
+    if found is None:
+        return None
+    route, args = found
+    return route.handler.callback, args
+
+
+@pytest.fixture
+def callbacks() -> CallbackRouter:
+    router = CallbackRouter()
+    router.on("pay")(any_pay)
+    router.on("pay", "lang")(pay_lang)
+    router.on("pay", "lang", state=LangFlow.payment)(pay_lang_in_payment)
+    router.on("menu", arity=0)(menu)
+    router.on("dir", "english", "chinese", arity=1)(direction)
+    return router
+
+
+def test_parse_callback_data():
+    assert parse_callback_data("pay_m:lang:pix") == ("pay_m", ("lang", "pix"))
+    assert parse_callback_data("menu") == ("menu", ())
+    assert parse_callback_data(None) == ("", ())
+
+
+def test_first_argument_route_wins_over_namespace(callbacks):
+    assert resolved(callbacks, "pay:lang:pix") == (pay_lang, ("lang", "pix"))
+    assert resolved(callbacks, "pay:yoga:pix") == (any_pay, ("yoga", "pix"))
+    assert resolved(callbacks, "pay") == (any_pay, ())
+
+
+def test_state_route_wins_in_its_state(callbacks):
+    assert resolved(callbacks, "pay:lang", LangFlow.payment.state)[0] is pay_lang_in_payment
+    assert resolved(callbacks, "pay:lang", YogaFlow.payment.state)[0] is pay_lang
+    assert resolved(callbacks, "pay:lang")[0] is pay_lang
+
+
+def test_arity_is_exact(callbacks):
+    assert resolved(callbacks, "menu") == (menu, ())
+    assert resolved(callbacks, "menu:extra") is None
+    assert resolved(callbacks, "dir:english") == (direction, ("english",))
+    assert resolved(callbacks, "dir:english:extra") is None
+    assert resolved(callbacks, "dir:french") is None
+
+
+def test_unknown_namespace_is_not_matched(callbacks):
+    assert resolved(callbacks, "unknown:1") is None
+    assert resolved(callbacks, "") is None
+
+
+def test_duplicate_route_is_rejected(callbacks):
+    with pytest.raises(ValueError):
+        callbacks.on("pay", "lang")(any_pay)
+    # тот же ключ в другом состоянии — отдельный маршрут
+    callbacks.on("pay", "lang", state=YogaFlow.payment)(any_pay)
+    assert resolved(callbacks, "pay:lang", YogaFlow.payment.state)[0] is any_pay
+
+
+def test_arity_must_count_first_argument():
+    with pytest.raises(ValueError):
+        CallbackRouter().on("dir", "english", arity=0)
+
+
+async def intro_text(message, **kwargs): ...
+async def intro_any(message, **kwargs): ...
+async def proof_photo(message, **kwargs): ...
+
+
+@pytest.fixture
+def messages() -> StateRouter:
+    router = StateRouter()
+    router.on(YogaFlow.wait_intro, "WAIT_YOGA_INTRO", when=lambda m: m.text is not None)(intro_text)
+    router.on(YogaFlow.wait_intro)(intro_any)
+    router.on(LangFlow.wait_proof, YogaFlow.wait_proof, when=lambda m: m.photo is not None)(proof_photo)
+    return router
+
+
+def message(text=None, photo=None):
+    return SimpleNamespace(text=text, photo=photo)
+
+
+def handler(router: StateRouter, msg, state):
+    route = router.resolve(msg, state)
+    return route.handler.callback if route is not None else None
+
+
+def test_when_falls_through_to_next_route(messages):
+    assert handler(messages, message(text="Анна, Рио"), YogaFlow.wait_intro.state) is intro_text
+    assert handler(messages, message(photo=["file"]), YogaFlow.wait_intro.state) is intro_any
+
+
+def test_string_state_is_registered(messages):
+    assert handler(messages, message(text="hi"), "WAIT_YOGA_INTRO") is intro_text
+    assert handler(messages, message(photo=["file"]), "WAIT_YOGA_INTRO") is None
+
+
+def test_no_route_without_matching_state_or_condition(messages):
+    assert handler(messages, message(text="hi"), None) is None
+    assert handler(messages, message(text="hi"), LangFlow.goal.state) is None
+    assert handler(messages, message(text="no photo"), LangFlow.wait_proof.state) is None
+    assert handler(messages, message(photo=["file"]), YogaFlow.wait_proof.state) is proof_photo
+
+
+def test_state_is_required():
+    with pytest.raises(ValueError):
+        StateRouter().on()
@@ -0,0 +1,146 @@
+import asyncio
+import os
+
+from aiogram.fsm.storage.base import StorageKey
+
+from bot.config import FsmStorageSettings
+from bot.states.states import LangFlow, YogaFlow
+from bot.storage.memory import BoundedMemoryStorage
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def make_storage(clock: FakeClock, **settings) -> BoundedMemoryStorage:
+    return BoundedMemoryStorage(FsmStorageSettings(backend="memory", **settings), clock=clock)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_lru_evicts_least_recently_used():
+    clock = FakeClock()
+    storage = make_storage(clock, max_entries=2)
+
+    async def scenario():
+        await storage.set_state(key(1), LangFlow.goal)
+        await storage.set_state(key(2), LangFlow.goal)
+        # обращение к 1 делает самым давним 2
+        assert await storage.get_state(key(1)) == LangFlow.goal.state
+        await storage.set_state(key(3), LangFlow.goal)
+        return [await storage.get_state(key(i)) for i in (1, 2, 3)]
+
+    assert run(scenario()) == [LangFlow.goal.state, None, LangFlow.goal.state]
+    assert len(storage) == 2
+
+
+def test_clear_does_not_keep_entry():
+    storage = make_storage(FakeClock())
+
+    async def scenario():
+        await storage.set_state(key(1), LangFlow.goal)
+        await storage.set_data(key(1), {"goal": "travel"})
+        await storage.set_state(key(1), None)
+        await storage.set_data(key(1), {})
+
+    run(scenario())
+    assert len(storage) == 0
+    assert storage.estimated_bytes == 0
+
+
+def test_group_ttl_overrides_default():
+    clock = FakeClock()
+    storage = make_storage(clock, ttl_seconds=1000.0, group_ttl_seconds={"LangFlow": 10.0})
+
+    async def scenario():
+        await storage.set_state(key(1), LangFlow.goal)
+        await storage.set_state(key(2), YogaFlow.plan)
+        clock.now += 11
+        return await storage.get_state(key(1)), await storage.get_state(key(2))
+
+    assert run(scenario()) == (None, YogaFlow.plan.state)
+
+
+def test_access_extends_ttl_and_sweep_drops_idle():
+    clock = FakeClock()
+    storage = make_storage(clock, ttl_seconds=10.0)
+
+    async def scenario():
+        await storage.set_state(key(1), LangFlow.goal)
+        await storage.set_state(key(2), LangFlow.goal)
+        clock.now += 8
+        await storage.get_state(key(1))
+        clock.now += 8
+
+    run(scenario())
+    assert storage.sweep() == 1
+    assert run(storage.get_state(key(1))) == LangFlow.goal.state
+    assert run(storage.get_state(key(2))) is None
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "fsm.json")
+    clock = FakeClock()
+    source = make_storage(clock, ttl_seconds=100.0, snapshot_path=path)
+
+    async def fill():
+        await source.set_state(key(1), LangFlow.level)
+        await source.set_data(key(1), {"goal": "travel"})
+        await source.set_state(key(2), YogaFlow.plan)
+        clock.now += 50
+        await source.set_state(key(3), YogaFlow.payment)
+        await source.close()
+
+    run(fill())
+    assert os.path.exists(path)
+
+    # 1 и 2 простояли 120 секунд и истекли, 3 — только 70
+    clock.now += 70
+    target = make_storage(clock, ttl_seconds=100.0)
+    assert target.load_snapshot(path) == 1
+    assert not os.path.exists(path)
+    assert run(target.get_state(key(3))) == YogaFlow.payment.state
+    assert run(target.get_state(key(1))) is None
+
+
+def test_snapshot_keeps_data(tmp_path):
+    path = str(tmp_path / "fsm.json")
+    clock = FakeClock()
+    storage = make_storage(clock)
+    restored = make_storage(clock)
+
+    async def scenario():
+        await storage.set_state(key(1), LangFlow.level)
+        await storage.set_data(key(1), {"goal": "travel", "level": 2})
+        storage.save_snapshot(path)
+        restored.load_snapshot(path)
+        return await restored.get_state(key(1)), await restored.get_data(key(1))
+
+    assert run(scenario()) == (LangFlow.level.state, {"goal": "travel", "level": 2})
+
+
+def test_snapshot_skips_unserializable_data(tmp_path):
+    path = str(tmp_path / "fsm.json")
+    storage = make_storage(FakeClock())
+
+    async def scenario():
+        await storage.set_data(key(1), {"ok": 1})
+        await storage.set_data(key(2), {"bad": object()})
+
+    run(scenario())
+    assert storage.save_snapshot(path) == 1
+
+
+def test_missing_snapshot_loads_nothing(tmp_path):
+    storage = make_storage(FakeClock())
+    assert storage.load_snapshot(str(tmp_path / "absent.json")) == 0